@@ -0,0 +1,42 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Admin view of the database engines, lookup caches and job queue."""
+
+import webob.exc
+
+from dolphin.api.common import wsgi
+from dolphin import db
+
+
+class DBStatsController(wsgi.Controller):
+
+    def show(self, req):
+        """Return the connection pool, statement and cache metrics.
+
+        The metrics are the ones of the API process serving the request,
+        the depth of the collection job queue is the one of all task
+        nodes.
+        """
+        context = req.environ.get('dolphin.context')
+        # Requests which did not pass an auth middleware carry no context,
+        # they are refused like the ones of non admin users.
+        if context is None or not context.is_admin:
+            raise webob.exc.HTTPForbidden()
+        return {'db_stats': {'engines': db.engine_stats(),
+                             'caches': db.cache_stats(),
+                             'collection_jobs':
+                                 db.collection_job_stats(context)}}
+
+
+def create_resource():
+    return wsgi.Resource(DBStatsController())
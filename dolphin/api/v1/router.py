@@ -0,0 +1,32 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""
+WSGI middleware for Dolphin API v1.
+"""
+
+from dolphin.api import common
+from dolphin.api import extensions
+from dolphin.api.v1 import db_stats
+
+
+class APIRouter(common.APIRouter):
+    """Route requests on the v1 API."""
+
+    ExtensionManager = extensions.ExtensionManager
+
+    def _setup_routes(self, mapper):
+        self.resources['db_stats'] = db_stats.create_resource()
+        mapper.connect('db_stats', '/admin/db-stats',
+                       controller=self.resources['db_stats'],
+                       action='show',
+                       conditions={'method': ['GET']})
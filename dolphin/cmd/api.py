@@ -27,6 +27,7 @@ from oslo_config import cfg
 from oslo_log import log
 
 from dolphin.common import config  # Need to register global_opts
+from dolphin import db
 from dolphin import service
 from dolphin import utils
 from dolphin import version
@@ -41,6 +42,10 @@ def main():
     log.setup(CONF, "dolphin")
     utils.monkey_patch()
 
+    # Check the schema once here rather than in every worker, the
+    # connections opened for it are not reused by the forked workers.
+    db.register_db()
+
     launcher = service.process_launcher()
     api_server = service.WSGIService('dolphin')
     task_server = service.Service.create(binary='dolphin-task', coordination=True)
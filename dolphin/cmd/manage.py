@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+#    Licensed under the Apache License, Version 2.0 (the "License");
+#    you may not use this file except in compliance with the License.
+#    You may obtain a copy of the License at
+#
+#        http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS,
+#    WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+#    See the License for the specific language governing permissions and
+#    limitations under the License.
+
+"""CLI interface for dolphin management.
+
+  dolphin-manage db sync [<version>]
+  dolphin-manage db version
+  dolphin-manage db reshard
+"""
+
+import sys
+
+from oslo_config import cfg
+from oslo_log import log
+
+from dolphin.common import config  # Need to register global_opts
+from dolphin import db
+from dolphin.db import migration
+from dolphin import version
+
+CONF = cfg.CONF
+
+
+class DbCommands(object):
+    """Class for managing the database."""
+
+    def sync(self, version=None):
+        """Sync the database up to the most recent version."""
+        return migration.upgrade(version)
+
+    def version(self):
+        """Print the current database version."""
+        print(migration.version())
+
+    def reshard(self):
+        """Partition volumes and pools as db_inventory_shards says.
+
+        Rebuilds the tables, run it while the services are stopped.
+        """
+        db.inventory_reshard()
+
+
+def add_command_parsers(subparsers):
+    parser = subparsers.add_parser('db')
+    parser.set_defaults(command_object=DbCommands())
+    actions = parser.add_subparsers(dest='action')
+    sync = actions.add_parser('sync', help=DbCommands.sync.__doc__)
+    sync.add_argument('version', nargs='?')
+    actions.add_parser('version', help=DbCommands.version.__doc__)
+    actions.add_parser('reshard',
+                       help=DbCommands.reshard.__doc__.splitlines()[0])
+
+
+category_opt = cfg.SubCommandOpt('category',
+                                 title='Command categories',
+                                 handler=add_command_parsers)
+
+
+def main():
+    CONF.register_cli_opt(category_opt)
+    log.register_options(CONF)
+    CONF(sys.argv[1:], project='dolphin',
+         version=version.version_string())
+    log.setup(CONF, "dolphin")
+
+    commands = CONF.category.command_object
+    action = CONF.category.action
+    if action == 'sync':
+        commands.sync(CONF.category.version)
+    elif action == 'version':
+        commands.version()
+    elif action == 'reshard':
+        commands.reshard()
+    else:
+        print("Usage: dolphin-manage db {sync,version,reshard}")
+        sys.exit(2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,73 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Aggregation helpers for capacity values held in array('q') columns.
+
+Capacity columns are integer bytes, so a column of many resources fits
+in a compact signed 64 bit array instead of a list of Python objects.
+When NumPy is installed the arrays are wrapped without a copy and
+aggregated vectorized, otherwise the same results are computed in pure
+Python.
+"""
+
+import array
+
+from oslo_utils import importutils
+
+numpy = importutils.try_import('numpy')
+
+
+def to_array(values):
+    """Return values as an array('q'), None counting as 0."""
+    return array.array('q', (value or 0 for value in values))
+
+
+def _as_ndarray(values):
+    return numpy.frombuffer(values, dtype=numpy.int64)
+
+
+def total(values):
+    """Return the sum of values."""
+    if numpy is not None and len(values):
+        return int(_as_ndarray(values).sum())
+    return sum(values)
+
+
+def percentile(values, percent):
+    """Return the percent percentile of values, linearly interpolated.
+
+    Matches the default method of numpy.percentile. Returns None for no
+    values.
+    """
+    if not len(values):
+        return None
+    if numpy is not None:
+        return float(numpy.percentile(_as_ndarray(values), percent))
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * percent / 100.0
+    lower = int(rank)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (rank - lower)
+
+
+def over_threshold(used, total_capacity, ratio):
+    """Return the positions whose used capacity exceeds ratio of the total.
+
+    :param used: array of used capacities.
+    :param total_capacity: array of total capacities of the same length.
+    :param ratio: threshold as a fraction of the total, e.g. 0.9.
+    """
+    if numpy is not None and len(used):
+        exceeded = _as_ndarray(used) > _as_ndarray(total_capacity) * ratio
+        return numpy.flatnonzero(exceeded).tolist()
+    return [i for i, (u, t) in enumerate(zip(used, total_capacity))
+            if u > t * ratio]
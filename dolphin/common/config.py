@@ -77,6 +77,11 @@ global_opts = [
     cfg.StrOpt('dolphin_task_topic',
                default='dolphin-task',
                help='The topic task manager nodes listen on.'),
+    cfg.IntOpt('task_rpc_batch_size',
+               default=500,
+               min=1,
+               help='Maximum number of collection jobs sent to the task '
+                    'managers in one RPC message.'),
 ]
 
 CONF.register_opts(global_opts)
@@ -20,12 +20,14 @@
 import copy
 
 from oslo_context import context
+from oslo_db.sqlalchemy import enginefacade
 from oslo_utils import timeutils
 import six
 
 from dolphin.i18n import _
 
 
+@enginefacade.transaction_context_provider
 class RequestContext(context.RequestContext):
     """Security context and request information.
 
@@ -84,6 +86,10 @@ class RequestContext(context.RequestContext):
             self.service_catalog = []
 
         self.quota_class = quota_class
+        # NOTE: Time of the last database write made with this context, used
+        # to keep its reads on the primary database while a replica may
+        # still lag behind.
+        self.last_db_write = None
 
     def _get_read_deleted(self):
         return self._read_deleted
@@ -56,6 +56,11 @@ class Coordinator(object):
         self.started = False
         self.prefix = prefix
 
+    @property
+    def member_id(self):
+        """Identifier of this node in locks and groups."""
+        return self.prefix + self.agent_id
+
     def start(self):
         """Connect to coordination back end."""
         if self.started:
@@ -93,6 +98,31 @@ class Coordinator(object):
         else:
             raise exception.LockCreationFailed(_('Coordinator uninitialized.'))
 
+    def join_partitioned_group(self, name, partitions=32):
+        """Join a group, creating it if needed, and return its partitioner.
+
+        The tooz partitioner maps objects onto the members of the group
+        with a consistent hash ring. It follows members joining and
+        leaving whenever :meth:`run_watchers` is called. The group is left
+        when the coordinator stops, or once the heartbeats of a crashed
+        member time out.
+
+        :param str name: The group name that is used to identify it
+            across all nodes.
+        :param int partitions: Points of each member on the hash ring,
+            more points spread the objects more evenly.
+        """
+        group_id = (self.prefix + name).encode('ascii')
+        if not self.started:
+            raise exception.LockCreationFailed(_('Coordinator uninitialized.'))
+        return self.coordinator.join_partitioned_group(
+            group_id, partitions=partitions)
+
+    def run_watchers(self):
+        """Process the group membership changes seen since the last call."""
+        if self.started:
+            self.coordinator.run_watchers()
+
 
 LOCK_COORDINATOR = Coordinator(prefix='dolphin-')
 
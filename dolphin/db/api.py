@@ -42,65 +42,593 @@ these objects be simple dictionaries.
 """
 from oslo_config import cfg
 from oslo_db import api as db_api
+from oslo_log import log
+
+from dolphin.db import write_behind
+from dolphin import rpc
+from dolphin import utils
 
 db_opts = [
     cfg.StrOpt('db_backend',
                default='sqlalchemy',
                help='The backend to use for database.'),
+    cfg.IntOpt('db_replica_max_staleness',
+               default=5,
+               help='Seconds the database replica configured with '
+                    '[database]/slave_connection may lag behind the primary. '
+                    'Read functions are served by the replica, except for a '
+                    'request context which wrote to the primary less than '
+                    'this many seconds ago, so that its own writes are '
+                    'always visible to it.'),
+    cfg.IntOpt('db_cache_size',
+               default=4096,
+               help='Maximum number of storages and of registry contexts '
+                    'each kept in the in-process lookup cache.'),
+    cfg.IntOpt('db_cache_ttl',
+               default=60,
+               help='Seconds an entry of the in-process lookup cache stays '
+                    'valid. Writes made through dolphin.db invalidate '
+                    'entries immediately, the ttl bounds how long changes '
+                    'made by other processes can go unnoticed. Set to 0 to '
+                    'disable the cache.'),
+    cfg.IntOpt('registry_credentials_cache_ttl',
+               default=3600,
+               help='Seconds the decoded access info of a storage stays in '
+                    'the credentials cache. Entries are refreshed as soon '
+                    'as a registry context changed notification arrives, '
+                    'the ttl only bounds how long a missed notification '
+                    'goes unnoticed. Set to 0 to disable the cache.'),
+    cfg.IntOpt('db_bulk_upsert_batch_size',
+               default=500,
+               help='Maximum number of rows written by a single statement '
+                    'of the bulk upsert functions. Each batch call is still '
+                    'committed as one transaction.'),
+    cfg.IntOpt('db_write_behind_interval',
+               default=5,
+               help='Seconds volume and pool updates queued with '
+                    'volume_update_deferred and pool_update_deferred, and '
+                    'the volume updates of collections, are held back at '
+                    'most. Updates of the same resource in '
+                    'between are coalesced into one. Set to 0 to write '
+                    'every update immediately.'),
+    cfg.IntOpt('db_write_behind_max_rows',
+               default=1000,
+               help='Number of resources with pending deferred updates at '
+                    'which they are written right away, whatever the '
+                    'db_write_behind_interval.'),
+    cfg.IntOpt('db_inventory_shards',
+               default=1,
+               min=1,
+               help='Number of partitions the volumes and pools tables are '
+                    'hash partitioned into by storage_id. MySQL and '
+                    'PostgreSQL partition the tables natively, other '
+                    'databases get one table per partition. The tables are '
+                    'partitioned by dolphin-manage db reshard, services do '
+                    'not start while their partitioning differs. Changing '
+                    'the number rebuilds the tables on PostgreSQL and is '
+                    'refused for separate tables.'),
+    cfg.FloatOpt('db_slow_statement_threshold',
+                 default=0.5,
+                 help='Seconds after which a statement counts as slow in '
+                      'the database engine metrics, which group slow '
+                      'statements by their SQL fingerprint. Set to 0 to '
+                      'disable.'),
+    cfg.IntOpt('db_metrics_log_interval',
+               default=300,
+               help='Seconds between two log lines with the connection '
+                    'pool and statement metrics of each database engine. '
+                    'Set to 0 to disable.'),
+    cfg.IntOpt('tombstone_retention_days',
+               default=30,
+               help='Days soft deleted storages, pools and volumes are kept '
+                    'before they are purged.'),
+    cfg.IntOpt('tombstone_purge_batch_size',
+               default=1000,
+               help='Maximum number of soft deleted rows purged by one '
+                    'transaction.'),
+    cfg.IntOpt('tombstone_purge_max_batches',
+               default=100,
+               help='Maximum number of purge transactions per table and '
+                    'run of the periodic purge, the rest is left to the '
+                    'next run.'),
+]
 
+capacity_opts = [
+    cfg.IntOpt('capacity_retention_raw_days',
+               default=2,
+               help='Days raw capacity samples are kept.'),
+    cfg.IntOpt('capacity_retention_5m_days',
+               default=14,
+               help='Days 5 minute capacity rollups are kept.'),
+    cfg.IntOpt('capacity_retention_1h_days',
+               default=90,
+               help='Days 1 hour capacity rollups are kept.'),
+    cfg.IntOpt('capacity_retention_1d_days',
+               default=1825,
+               help='Days 1 day capacity rollups are kept.'),
+    cfg.IntOpt('capacity_rollup_delay',
+               default=300,
+               help='Seconds to wait after the end of a bucket before it is '
+                    'rolled up, for late samples to arrive.'),
+    cfg.IntOpt('capacity_history_max_points',
+               default=1000,
+               help='Maximum number of samples per resource a capacity '
+                    'history query returns when it picks the resolution '
+                    'itself.'),
 ]
 
+LOG = log.getLogger(__name__)
+
 CONF = cfg.CONF
 CONF.register_opts(db_opts)
+CONF.register_opts(capacity_opts)
 
 _BACKEND_MAPPING = {'sqlalchemy': 'dolphin.db.sqlalchemy.api'}
 IMPL = db_api.DBAPI.from_config(cfg.CONF, backend_mapping=_BACKEND_MAPPING,
                                 lazy=True)
 
 
+_CACHES = {}
+# Options with the ttl of the caches not using db_cache_ttl.
+_CACHE_TTL_OPTS = {'registry_credentials': 'registry_credentials_cache_ttl'}
+
+
+def _cache(name):
+    if name not in _CACHES:
+        ttl = CONF.get(_CACHE_TTL_OPTS.get(name, 'db_cache_ttl'))
+        _CACHES[name] = utils.LRUCache(CONF.db_cache_size, ttl)
+    return _CACHES[name]
+
+
+def _cached_get(name, context, key, getter):
+    """Look key up in the named cache, loading it with getter on a miss.
+
+    Inside a transaction the cache is bypassed, as rows read there may
+    still be rolled back. So is it for contexts reading deleted rows, the
+    cache only holds live ones.
+    """
+    if IMPL.in_transaction(context) or context.read_deleted != 'no':
+        return getter(context, key)
+    cache = _cache(name)
+    value = cache.get(key)
+    if value is None:
+        # Read first, a write committed while loading invalidates the key
+        # and keeps the value loaded from being cached.
+        version = cache.version(key)
+        value = getter(context, key)
+        if value is not None:
+            cache.set(key, value, version)
+    return value
+
+
+def _invalidate(context, name, keys):
+    """Drop cache entries after a write made with context.
+
+    Called once the write returned, which outside a transaction means it
+    is committed. Inside one, other contexts may still load and cache the
+    old rows until it commits, so the entries are dropped again then.
+    """
+    cache = _cache(name)
+    keys = list(keys)
+
+    def invalidate():
+        for key in keys:
+            cache.invalidate(key)
+    invalidate()
+    if IMPL.in_transaction(context):
+        IMPL.after_commit(context, invalidate)
+
+
+def cache_stats():
+    """Return the hit, miss and eviction counters of the lookup caches."""
+    return dict((name, cache.stats()) for name, cache in _CACHES.items())
+
+
+def _write_behind_writer(context, resource_type, storage_id, updates):
+    return IMPL.resource_bulk_update(context, resource_type, updates,
+                                     storage_id)
+
+
+_WRITE_BEHIND = write_behind.WriteBehindBuffer(_write_behind_writer)
+
+
+def write_behind_flush(context=None):
+    """Write the pending deferred updates, e.g. when the service stops."""
+    return _WRITE_BEHIND.flush(context)
+
+
+def write_behind_stats():
+    """Return the counters of the deferred update buffer."""
+    return _WRITE_BEHIND.stats()
+
+
+def engine_stats():
+    """Return the connection pool and statement metrics of each engine."""
+    return IMPL.engine_stats()
+
+
 def register_db():
     IMPL.register_db()
 
 
-def storage_get(storage_id):
-    return IMPL.storage_get(storage_id)
+def inventory_reshard():
+    """Partition volumes and pools into db_inventory_shards partitions.
+
+    Rebuilds the tables, run it while the services are stopped. The
+    services refuse to start as long as the partitioning differs from
+    db_inventory_shards.
+    """
+    IMPL.inventory_reshard()
+
+
+def transaction(context, read_only=False):
+    """Run the db calls made with context in one session and transaction.
+
+    Used as ``with db.transaction(context):``, every function of this
+    module called with the same context inside the block shares the
+    connection and the transaction, which is committed when the block is
+    left. A read_only transaction only allows read functions.
+    """
+    return IMPL.transaction(context, read_only)
+
+
+def storage_get(context, storage_id):
+    return _cached_get('storages', context, storage_id, IMPL.storage_get)
+
+
+def storage_create(context, storage):
+    result = IMPL.storage_create(context, storage)
+    _invalidate(context, 'storages', [storage.id])
+    return result
+
+
+def storage_get_all(context, filters=None, limit=None, marker=None,
+                    sort_keys=None, sort_dirs=None):
+    """Get a page of storages.
+
+    :param filters: dict of column name to value, a list value matches any
+        of its items.
+    :param limit: maximum number of items to return.
+    :param marker: id of the last item of the previous page.
+    :param sort_keys: list of columns to sort by, the id is always appended.
+    :param sort_dirs: list of 'asc' or 'desc', one per sort key. NULLs sort
+        last ascending and first descending.
+    """
+    return IMPL.storage_get_all(context, filters, limit, marker, sort_keys,
+                                sort_dirs)
+
+
+def storage_iter(context, filters=None, chunk_size=1000):
+    """Iterate over all storages, streaming chunk_size rows at a time."""
+    return IMPL.storage_iter(context, filters, chunk_size)
+
+
+def storage_bulk_upsert(context, storages):
+    """Insert or update a list of storage dicts in one transaction."""
+    result = IMPL.storage_bulk_upsert(context, storages)
+    _invalidate(context, 'storages', [storage['id'] for storage in storages])
+    return result
+
+
+def storage_delete(context, storage_id):
+    """Soft delete a storage together with its pools and volumes."""
+    result = IMPL.storage_delete(context, storage_id)
+    _invalidate(context, 'storages', [storage_id])
+    _registry_context_changed(context, storage_id)
+    return result
+
+
+def volume_create(context, volume, storage_id):
+    return IMPL.volume_create(context, volume, storage_id)
+
+
+def volume_get(context, volume_id, storage_id):
+    return IMPL.volume_get(context, volume_id, storage_id)
+
+
+def volume_get_all(context, storage_id, filters=None, limit=None,
+                   marker=None, sort_keys=None, sort_dirs=None):
+    """Get a page of the volumes of a storage.
+
+    Takes the same paging arguments as :func:`storage_get_all`.
+    """
+    return IMPL.volume_get_all(context, storage_id, filters, limit, marker,
+                               sort_keys, sort_dirs)
+
+
+def volume_iter(context, storage_id=None, filters=None, chunk_size=1000):
+    """Iterate over the volumes of a storage, or of all storages.
+
+    Rows are streamed from the database chunk_size at a time instead of
+    being loaded into one list, for exports and reports over the fleet.
+    """
+    return IMPL.volume_iter(context, storage_id, filters, chunk_size)
+
+
+def volume_update_deferred(context, volume_id, storage_id, values):
+    """Queue an update of some columns of a volume, e.g. its status.
+
+    The update is written later, batched with the ones of other volumes,
+    see dolphin.db.write_behind. Reads made meanwhile still return the
+    previous values.
+    """
+    _WRITE_BEHIND.add('volume', volume_id, storage_id, values)
+
+
+def volume_bulk_upsert(context, volumes, storage_id):
+    """Insert or update a list of volume dicts in one transaction."""
+    return IMPL.volume_bulk_upsert(context, volumes, storage_id)
+
+
+def volume_sync(context, volumes, storage_id, deferred=False):
+    """Write only the differences between collected and stored volumes.
+
+    With deferred, the updates of changed volumes, mostly their status
+    and capacity, are queued like :func:`volume_update_deferred` ones
+    rather than written in the transaction of the sync. New and vanished
+    volumes are always written right away.
+
+    Returns a dict with the number of added, updated, deleted and
+    unchanged volumes.
+    """
+    defer = None
+    if deferred:
+        def defer(volume_id, values):
+            _WRITE_BEHIND.add('volume', volume_id, storage_id, values)
+    return IMPL.volume_sync(context, volumes, storage_id, defer)
+
+
+def pool_create(context, pool, storage_id):
+    return IMPL.pool_create(context, pool, storage_id)
+
+
+def pool_get(context, pool_id, storage_id):
+    return IMPL.pool_get(context, pool_id, storage_id)
+
+
+def pool_get_all(context, storage_id, filters=None, limit=None, marker=None,
+                 sort_keys=None, sort_dirs=None):
+    """Get a page of the pools of a storage.
+
+    Takes the same paging arguments as :func:`storage_get_all`.
+    """
+    return IMPL.pool_get_all(context, storage_id, filters, limit, marker,
+                             sort_keys, sort_dirs)
+
+
+def pool_iter(context, storage_id=None, filters=None, chunk_size=1000):
+    """Iterate over the pools of a storage, or of all storages.
+
+    Rows are streamed from the database chunk_size at a time instead of
+    being loaded into one list, for exports and reports over the fleet.
+    """
+    return IMPL.pool_iter(context, storage_id, filters, chunk_size)
+
+
+def pool_update_deferred(context, pool_id, storage_id, values):
+    """Queue an update of some columns of a pool.
+
+    See :func:`volume_update_deferred`.
+    """
+    _WRITE_BEHIND.add('pool', pool_id, storage_id, values)
+
+
+def pool_bulk_upsert(context, pools, storage_id):
+    """Insert or update a list of pool dicts in one transaction."""
+    return IMPL.pool_bulk_upsert(context, pools, storage_id)
+
+
+def pool_sync(context, pools, storage_id):
+    """Write only the differences between collected and stored pools.
+
+    Returns a dict with the number of added, updated, deleted and
+    unchanged pools.
+    """
+    return IMPL.pool_sync(context, pools, storage_id)
+
+
+def capacity_samples_add(context, samples, sampled_at=None):
+    """Store raw capacity samples of storages, pools or volumes.
+
+    Each sample is a dict with resource_type, resource_id, storage_id and
+    total_capacity, used_capacity and free_capacity. sampled_at is in
+    seconds since the epoch and defaults to now.
+    """
+    return IMPL.capacity_samples_add(context, samples, sampled_at)
+
+
+def capacity_history_get(context, resource_type, resource_ids, start, end,
+                         resolution=None):
+    """Get the capacity history of resources between start and end.
+
+    Without a resolution (0 for raw samples, or 300, 3600 or 86400 seconds
+    for rollups), the finest one that stays within
+    capacity_history_max_points and is still retained for start is picked.
+    """
+    return IMPL.capacity_history_get(context, resource_type, resource_ids,
+                                     start, end, resolution)
+
+
+def capacity_rollup(context, now=None):
+    """Roll raw capacity samples up to 5 minute, 1 hour and 1 day ones."""
+    return IMPL.capacity_rollup(context, now)
+
+
+def capacity_purge(context, now=None):
+    """Delete capacity samples older than their retention."""
+    return IMPL.capacity_purge(context, now)
+
+
+def tombstone_purge(context, resource_type, before, batch_size):
+    """Purge one batch of 'storage', 'pool' or 'volume' tombstones.
+
+    Hard deletes at most batch_size rows soft deleted before the given
+    datetime in one short transaction and returns their number.
+    """
+    return IMPL.tombstone_purge(context, resource_type, before, batch_size)
+
+
+def capacity_arrays(context, resource_type, storage_id=None, filters=None,
+                    columns=('total_capacity', 'used_capacity',
+                             'free_capacity'),
+                    chunk_size=1000):
+    """Load capacity columns of storages, pools or volumes into arrays.
+
+    Returns a dict of column name to array('q') and 'id' to the list of
+    resource ids, see dolphin.common.capacity for the aggregations.
+    """
+    return IMPL.capacity_arrays(context, resource_type, storage_id, filters,
+                                columns, chunk_size)
+
+
+def capacity_summary_get_all(context, storage_id):
+    """Get the maintained volume capacity totals of each pool of a storage."""
+    return IMPL.capacity_summary_get_all(context, storage_id)
+
+
+def storage_capacity_summary_get(context, storage_id):
+    """Get a dict with the volume count and capacity totals of a storage."""
+    return IMPL.storage_capacity_summary_get(context, storage_id)
+
+
+def capacity_summary_by_vendor(context):
+    """Get the volume count and capacity totals of all storages by vendor."""
+    return IMPL.capacity_summary_by_vendor(context)
+
+
+def collection_job_enqueue(context, jobs, node):
+    """Queue (storage_id, resource_type) collection jobs of a task node.
+
+    A job already queued for the same storage and resource type is not
+    queued again. Returns the number of jobs newly queued.
+    """
+    return IMPL.collection_job_enqueue(context, jobs, node)
+
+
+def collection_job_lease(context, worker, limit, lease_time, node=None,
+                         created_before=None):
+    """Lease up to limit queued jobs of node, by default the worker's own.
+
+    A leased job is invisible to other workers for lease_time seconds, it
+    returns to the queue unless completed within that time. With
+    created_before, only jobs queued before that time are leased.
+    """
+    return IMPL.collection_job_lease(context, worker, limit, lease_time,
+                                     node, created_before)
+
+
+def collection_job_complete(context, job_id, worker):
+    """Remove a job leased by worker from the queue."""
+    return IMPL.collection_job_complete(context, job_id, worker)
+
+
+def collection_job_claim(context, storage_id, resource_type, worker,
+                         lease_time):
+    """Queue one collection job and lease it to worker right away.
+
+    The job stays leased by its current worker if it is running already,
+    the returned job's leased_by tells who runs it.
+    """
+    return IMPL.collection_job_claim(context, storage_id, resource_type,
+                                     worker, lease_time)
+
+
+def collection_job_get(context, job_id):
+    """Get a collection job, None if it is no longer queued."""
+    return IMPL.collection_job_get(context, job_id)
+
+
+def collection_job_overdue(context, created_before):
+    """Count the unleased collection jobs queued before a time, by node."""
+    return IMPL.collection_job_overdue(context, created_before)
+
+
+def collection_job_stats(context, node=None):
+    """Get the depth of the collection job queue and the oldest job's age.
 
+    Returns a dict with depth, leased and oldest_age in seconds, of the
+    jobs of node or of all nodes.
+    """
+    return IMPL.collection_job_stats(context, node)
 
-def storage_create(storage):
-    IMPL.storage_create(storage)
 
+def registry_context_create(context, register_info):
+    result = IMPL.registry_context_create(context, register_info)
+    _registry_context_changed(context, register_info.storage_id)
+    return result
 
-def volume_create(volume, storage_id):
-    IMPL.volume_create(volume)
 
+def _registry_context_changed(context, storage_id):
+    """Drop the cached credentials of a storage, here and on task nodes."""
+    for name in ('registry_contexts', 'registry_credentials'):
+        _invalidate(context, name, [storage_id])
+    if IMPL.in_transaction(context):
+        IMPL.after_commit(context, lambda: _notify_registry_context_changed(
+            context, storage_id))
+    else:
+        _notify_registry_context_changed(context, storage_id)
 
-def volume_get(volume_id, storage_id):
-    IMPL.volume_get(volume_id, storage_id)
 
+def _notify_registry_context_changed(context, storage_id):
+    if not rpc.initialized():
+        # Not running in a service, e.g. in dolphin-manage.
+        return
+    # Imported here, the task manager RPC API imports dolphin.db itself.
+    from dolphin.task_manager import rpcapi
+    try:
+        rpcapi.TaskAPI().registry_context_changed(context, storage_id)
+    except Exception:
+        LOG.exception("Failed to notify the task managers of the changed "
+                      "registry context of storage %s, they keep using "
+                      "the cached one for up to "
+                      "registry_credentials_cache_ttl.", storage_id)
 
-def volume_get_all(storage_id):
-    IMPL.volume_get_all(storage_id)
 
+def registry_context_invalidate(storage_id):
+    """Drop the cached registry context and credentials of a storage.
 
-def pool_create(pool, storage_id):
-    IMPL.pool_create(pool)
+    Called by the task managers on the registry_context_changed
+    notification, which the processes changing a registry context cast
+    once the change is committed.
+    """
+    _cache('registry_contexts').invalidate(storage_id)
+    _cache('registry_credentials').invalidate(storage_id)
 
 
-def pool_get(pool_id, storage_id):
-    IMPL.pool_get(pool_id, storage_id)
+def registry_context_get(context, storage_id):
+    return _cached_get('registry_contexts', context, storage_id,
+                       IMPL.registry_context_get)
 
 
-def pool_get_all(storage_id):
-    IMPL.pool_get_all(storage_id)
+def _registry_credentials_get(context, storage_id):
+    registry_context = IMPL.registry_context_get(context, storage_id)
+    if registry_context is None:
+        return None
+    credentials = dict(registry_context)
+    credentials['extra_attributes'] = dict(
+        registry_context.extra_attributes or {})
+    return credentials
 
 
-def registry_context_create(register_info):
-    return IMPL.registry_context_create(register_info)
+def registry_credentials_get(context, storage_id):
+    """Get the access info drivers connect to a storage with.
 
+    Returns the columns of the registry context of storage_id as a plain
+    dict, extra_attributes already decoded, or None. The dict is cached
+    until the registry context changes, so polling a storage neither
+    queries the database nor decodes JSON. It is shared between callers
+    and must not be modified.
+    """
+    return _cached_get('registry_credentials', context, storage_id,
+                       _registry_credentials_get)
 
-def registry_context_get(storage_id):
-    return IMPL.registry_context_get(storage_id)
 
+def registry_context_get_all(context, filters=None, limit=None, marker=None,
+                             sort_keys=None, sort_dirs=None):
+    """Get a page of registry contexts.
 
-def registry_context_get_all():
-    return IMPL.registry_context_get_all()
\ No newline at end of file
+    Takes the same paging arguments as :func:`storage_get_all`, the marker
+    being a storage_id.
+    """
+    return IMPL.registry_context_get_all(context, filters, limit, marker,
+                                         sort_keys, sort_dirs)
@@ -0,0 +1,50 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from __future__ import with_statement
+
+from alembic import context
+
+from dolphin.db.sqlalchemy import api as db_api
+from dolphin.db.sqlalchemy import models as db_models
+from dolphin.db.sqlalchemy import sharding
+
+
+def include_object(object, name, type_, reflected, compare_to):
+    """Leave the shard tables of volumes and pools out of autogenerate.
+
+    They are created by dolphin-manage db reshard, a migration changing
+    volumes or pools applies the change to sharding.physical_tables.
+    """
+    return not (type_ == 'table' and sharding.is_shard_table(name))
+
+
+def run_migrations_online():
+    """Run migrations in 'online' mode.
+
+    In this scenario we need to create an Engine
+    and associate a connection with the context.
+    """
+    engine = db_api.get_engine()
+    connection = engine.connect()
+    target_metadata = db_models.BASE.metadata
+    context.configure(connection=connection,  # pylint: disable=no-member
+                      target_metadata=target_metadata,
+                      include_object=include_object)
+    try:
+        with context.begin_transaction():  # pylint: disable=no-member
+            context.run_migrations()  # pylint: disable=no-member
+    finally:
+        connection.close()
+
+
+run_migrations_online()
@@ -0,0 +1,69 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Add capacity_summaries table
+
+Revision ID: 1d1c513825e3
+Revises: a588a736bbb3
+Create Date: 2026-10-18 16:05:12.402817
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '1d1c513825e3'
+down_revision = 'a588a736bbb3'
+
+from alembic import op
+from sqlalchemy import BigInteger, Column, func, Integer, sql, String
+
+
+def upgrade():
+    summaries = op.create_table(
+        'capacity_summaries',
+        Column('storage_id', String(36), primary_key=True),
+        Column('pool_id', String(255), primary_key=True),
+        Column('volume_count', Integer, nullable=False),
+        Column('total_capacity', BigInteger, nullable=False),
+        Column('used_capacity', BigInteger, nullable=False),
+        Column('free_capacity', BigInteger, nullable=False),
+        mysql_engine='InnoDB',
+    )
+
+    # Seed the totals from the volumes already stored.
+    volumes = sql.table('volumes',
+                        sql.column('storage_id'),
+                        sql.column('pool_id'),
+                        sql.column('deleted'),
+                        sql.column('total_capacity'),
+                        sql.column('used_capacity'),
+                        sql.column('free_capacity'))
+    pool_id = func.coalesce(volumes.c.pool_id, '')
+
+    def total(column):
+        return func.coalesce(func.sum(column), 0)
+
+    op.execute(summaries.insert().from_select(
+        ['storage_id', 'pool_id', 'volume_count', 'total_capacity',
+         'used_capacity', 'free_capacity'],
+        sql.select([volumes.c.storage_id,
+                    pool_id,
+                    func.count(),
+                    total(volumes.c.total_capacity),
+                    total(volumes.c.used_capacity),
+                    total(volumes.c.free_capacity)])
+        .where(volumes.c.deleted == 0)
+        .where(volumes.c.storage_id.isnot(None))
+        .group_by(volumes.c.storage_id, pool_id)))
+
+
+def downgrade():
+    op.drop_table('capacity_summaries')
@@ -0,0 +1,38 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Add per-storage indexes to volumes and pools
+
+Revision ID: 4184089fa43e
+Revises: 77940f58207b
+Create Date: 2026-10-18 14:02:11.870244
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4184089fa43e'
+down_revision = '77940f58207b'
+
+from alembic import op
+
+
+def upgrade():
+    op.create_index('volumes_storage_id_idx', 'volumes', ['storage_id'])
+    op.create_index('volumes_storage_id_pool_id_idx', 'volumes',
+                    ['storage_id', 'pool_id'])
+    op.create_index('pools_storage_id_idx', 'pools', ['storage_id'])
+
+
+def downgrade():
+    op.drop_index('pools_storage_id_idx', table_name='pools')
+    op.drop_index('volumes_storage_id_pool_id_idx', table_name='volumes')
+    op.drop_index('volumes_storage_id_idx', table_name='volumes')
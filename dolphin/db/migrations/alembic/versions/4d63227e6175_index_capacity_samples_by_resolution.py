@@ -0,0 +1,41 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Index capacity_samples by resolution and sampled_at
+
+Revision ID: 4d63227e6175
+Revises: 5da8e7bdf33d
+Create Date: 2026-10-18 21:12:07.301846
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '4d63227e6175'
+down_revision = '5da8e7bdf33d'
+
+from alembic import op
+
+
+def upgrade():
+    # No query filters the samples by storage_id, the rollup and the
+    # purge select them by resolution and sampled_at.
+    op.drop_index('capacity_samples_storage_id_idx',
+                  table_name='capacity_samples')
+    op.create_index('capacity_samples_resolution_idx', 'capacity_samples',
+                    ['resolution', 'sampled_at'])
+
+
+def downgrade():
+    op.drop_index('capacity_samples_resolution_idx',
+                  table_name='capacity_samples')
+    op.create_index('capacity_samples_storage_id_idx', 'capacity_samples',
+                    ['storage_id', 'resolution', 'sampled_at'])
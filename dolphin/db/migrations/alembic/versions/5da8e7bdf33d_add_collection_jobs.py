@@ -0,0 +1,52 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Add collection_jobs table
+
+Revision ID: 5da8e7bdf33d
+Revises: 754c9e9a04db
+Create Date: 2026-10-18 19:02:31.508143
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '5da8e7bdf33d'
+down_revision = '754c9e9a04db'
+
+from alembic import op
+from sqlalchemy import Column, DateTime, Integer, String, UniqueConstraint
+
+
+def upgrade():
+    op.create_table(
+        'collection_jobs',
+        Column('created_at', DateTime),
+        Column('updated_at', DateTime),
+        Column('id', Integer, primary_key=True, autoincrement=True),
+        Column('storage_id', String(36), nullable=False),
+        Column('resource_type', String(36), nullable=False),
+        Column('node', String(255)),
+        Column('leased_by', String(255)),
+        Column('lease_expires_at', DateTime),
+        Column('attempts', Integer, nullable=False),
+        UniqueConstraint(
+            'storage_id', 'resource_type',
+            name='uniq_collection_jobs0storage_id0resource_type'),
+        mysql_engine='InnoDB',
+    )
+    op.create_index('collection_jobs_node_idx', 'collection_jobs',
+                    ['node', 'created_at'])
+
+
+def downgrade():
+    op.drop_index('collection_jobs_node_idx', table_name='collection_jobs')
+    op.drop_table('collection_jobs')
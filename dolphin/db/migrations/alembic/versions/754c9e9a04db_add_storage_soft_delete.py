@@ -0,0 +1,72 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Add soft delete to storages and partial indexes
+
+Revision ID: 754c9e9a04db
+Revises: 95a0b04b8918
+Create Date: 2026-10-18 17:21:04.663180
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '754c9e9a04db'
+down_revision = '95a0b04b8918'
+
+from alembic import op
+from oslo_db.sqlalchemy.types import SoftDeleteInteger
+from sqlalchemy import Column, DateTime, text
+
+LIVE_ROWS = {'postgresql_where': text('deleted = 0'),
+             'sqlite_where': text('deleted = 0')}
+TOMBSTONES = {'postgresql_where': text('deleted != 0'),
+              'sqlite_where': text('deleted != 0')}
+
+STORAGE_ID_INDEXES = (
+    ('volumes_storage_id_idx', 'volumes', ['storage_id']),
+    ('volumes_storage_id_pool_id_idx', 'volumes', ['storage_id', 'pool_id']),
+    ('pools_storage_id_idx', 'pools', ['storage_id']),
+)
+TABLES = ('storages', 'volumes', 'pools')
+
+
+def _partial_indexes_supported():
+    # MySQL would rebuild the very same full indexes.
+    return op.get_bind().dialect.name != 'mysql'
+
+
+def upgrade():
+    with op.batch_alter_table('storages') as batch_op:
+        batch_op.add_column(Column('deleted_at', DateTime))
+        batch_op.add_column(Column('deleted', SoftDeleteInteger, default=0))
+    op.execute("UPDATE storages SET deleted = 0")
+
+    if _partial_indexes_supported():
+        for name, table, columns in STORAGE_ID_INDEXES:
+            op.drop_index(name, table_name=table)
+            op.create_index(name, table, columns, **LIVE_ROWS)
+    for table in TABLES:
+        op.create_index('%s_deleted_at_idx' % table, table, ['deleted_at'],
+                        **TOMBSTONES)
+
+
+def downgrade():
+    for table in TABLES:
+        op.drop_index('%s_deleted_at_idx' % table, table_name=table)
+    if _partial_indexes_supported():
+        for name, table, columns in STORAGE_ID_INDEXES:
+            op.drop_index(name, table_name=table)
+            op.create_index(name, table, columns)
+
+    with op.batch_alter_table('storages') as batch_op:
+        batch_op.drop_column('deleted')
+        batch_op.drop_column('deleted_at')
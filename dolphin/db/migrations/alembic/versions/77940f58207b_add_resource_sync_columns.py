@@ -0,0 +1,51 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Add soft delete and content hash columns to volumes and pools
+
+Revision ID: 77940f58207b
+Revises: 9daa401447b6
+Create Date: 2026-10-18 10:47:05.533102
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '77940f58207b'
+down_revision = '9daa401447b6'
+
+from alembic import op
+from oslo_db.sqlalchemy.types import SoftDeleteInteger
+from sqlalchemy import Column, DateTime, String
+
+
+def upgrade():
+    for table in ('volumes', 'pools'):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.add_column(Column('deleted_at', DateTime))
+            batch_op.add_column(
+                Column('deleted', SoftDeleteInteger, default=0))
+            batch_op.add_column(Column('content_hash', String(64)))
+        op.execute("UPDATE %s SET deleted = 0" % table)
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.create_unique_constraint(
+                'uniq_%s0storage_id0name0deleted' % table,
+                ['storage_id', 'name', 'deleted'])
+
+
+def downgrade():
+    for table in ('volumes', 'pools'):
+        with op.batch_alter_table(table) as batch_op:
+            batch_op.drop_constraint(
+                'uniq_%s0storage_id0name0deleted' % table, type_='unique')
+            batch_op.drop_column('content_hash')
+            batch_op.drop_column('deleted')
+            batch_op.drop_column('deleted_at')
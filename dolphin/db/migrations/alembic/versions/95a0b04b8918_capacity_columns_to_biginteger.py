@@ -0,0 +1,44 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Store capacity columns as integer bytes
+
+Revision ID: 95a0b04b8918
+Revises: 1d1c513825e3
+Create Date: 2026-10-18 16:48:27.530961
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '95a0b04b8918'
+down_revision = '1d1c513825e3'
+
+from alembic import op
+from sqlalchemy import BigInteger, Numeric
+
+CAPACITY_COLUMNS = ('total_capacity', 'used_capacity', 'free_capacity')
+
+
+def upgrade():
+    for table in ('storages', 'volumes', 'pools'):
+        with op.batch_alter_table(table) as batch_op:
+            for column in CAPACITY_COLUMNS:
+                batch_op.alter_column(column, type_=BigInteger,
+                                      existing_type=Numeric)
+
+
+def downgrade():
+    for table in ('storages', 'volumes', 'pools'):
+        with op.batch_alter_table(table) as batch_op:
+            for column in CAPACITY_COLUMNS:
+                batch_op.alter_column(column, type_=Numeric,
+                                      existing_type=BigInteger)
@@ -0,0 +1,97 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""dolphin_init
+
+Revision ID: 9daa401447b6
+Revises: None
+Create Date: 2026-10-18 09:06:32.419871
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = '9daa401447b6'
+down_revision = None
+
+from alembic import op
+from oslo_db.sqlalchemy.types import JsonEncodedDict
+from sqlalchemy import Column, DateTime, Integer, String, Numeric
+
+
+def upgrade():
+    op.create_table(
+        'registry_contexts',
+        Column('created_at', DateTime),
+        Column('updated_at', DateTime),
+        Column('storage_id', String(36), primary_key=True),
+        Column('hostname', String(36)),
+        Column('username', String(255)),
+        Column('password', String(255)),
+        Column('vendor', String(255)),
+        Column('model', String(255)),
+        Column('extra_attributes', JsonEncodedDict),
+        mysql_engine='InnoDB',
+    )
+
+    op.create_table(
+        'storages',
+        Column('created_at', DateTime),
+        Column('updated_at', DateTime),
+        Column('id', String(36), primary_key=True),
+        Column('name', String(255)),
+        Column('vendor', String(255)),
+        Column('description', String(255)),
+        Column('model', String(255)),
+        Column('status', String(255)),
+        Column('serial_number', String(255)),
+        Column('location', String(255)),
+        Column('total_capacity', Numeric),
+        Column('used_capacity', Numeric),
+        Column('free_capacity', Numeric),
+        mysql_engine='InnoDB',
+    )
+
+    op.create_table(
+        'volumes',
+        Column('created_at', DateTime),
+        Column('updated_at', DateTime),
+        Column('id', Integer, primary_key=True),
+        Column('name', String(255)),
+        Column('storage_id', String(255)),
+        Column('pool_id', String(255)),
+        Column('description', String(255)),
+        Column('status', String(255)),
+        Column('total_capacity', Numeric),
+        Column('used_capacity', Numeric),
+        Column('free_capacity', Numeric),
+        mysql_engine='InnoDB',
+    )
+
+    op.create_table(
+        'pools',
+        Column('created_at', DateTime),
+        Column('updated_at', DateTime),
+        Column('id', Integer, primary_key=True),
+        Column('name', String(255)),
+        Column('storage_id', String(255)),
+        Column('description', String(255)),
+        Column('status', String(255)),
+        Column('total_capacity', Numeric),
+        Column('used_capacity', Numeric),
+        Column('free_capacity', Numeric),
+        mysql_engine='InnoDB',
+    )
+
+
+def downgrade():
+    for table in ('pools', 'volumes', 'storages', 'registry_contexts'):
+        op.drop_table(table)
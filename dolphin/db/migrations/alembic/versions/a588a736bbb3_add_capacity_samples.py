@@ -0,0 +1,53 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Add capacity_samples table
+
+Revision ID: a588a736bbb3
+Revises: 4184089fa43e
+Create Date: 2026-10-18 15:32:40.118532
+
+"""
+
+# revision identifiers, used by Alembic.
+revision = 'a588a736bbb3'
+down_revision = '4184089fa43e'
+
+from alembic import op
+from sqlalchemy import BigInteger, Column, Integer, String
+
+
+def upgrade():
+    op.create_table(
+        'capacity_samples',
+        Column('resource_type', String(36), primary_key=True),
+        Column('resource_id', String(255), primary_key=True),
+        Column('resolution', Integer, primary_key=True,
+               autoincrement=False),
+        Column('sampled_at', BigInteger, primary_key=True,
+               autoincrement=False),
+        Column('storage_id', String(36)),
+        Column('total_capacity', BigInteger),
+        Column('used_capacity', BigInteger),
+        Column('free_capacity', BigInteger),
+        Column('max_used_capacity', BigInteger),
+        Column('sample_count', Integer),
+        mysql_engine='InnoDB',
+    )
+    op.create_index('capacity_samples_storage_id_idx', 'capacity_samples',
+                    ['storage_id', 'resolution', 'sampled_at'])
+
+
+def downgrade():
+    op.drop_index('capacity_samples_storage_id_idx',
+                  table_name='capacity_samples')
+    op.drop_table('capacity_samples')
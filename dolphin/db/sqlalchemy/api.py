@@ -18,40 +18,138 @@
 
 """Implementation of SQLAlchemy backend."""
 
+import array
+import collections
+import datetime
 from functools import wraps
+import hashlib
 import sys
+import time
 from oslo_config import cfg
+from oslo_db import exception as db_exc
 from oslo_db import options as db_options
-from oslo_db.sqlalchemy import session
+from oslo_db.sqlalchemy import enginefacade
 from oslo_log import log
-from sqlalchemy import  create_engine
+from oslo_serialization import jsonutils
+from oslo_utils import timeutils
+import six
+from sqlalchemy import BigInteger, cast, func, inspect, literal, or_, sql
+from sqlalchemy import event
+from sqlalchemy import tuple_
+from sqlalchemy.dialects import mysql
+from sqlalchemy.dialects import postgresql
+from dolphin.db import migration
+from dolphin import exception
+from dolphin.i18n import _
+from dolphin.db.sqlalchemy import metrics
 from dolphin.db.sqlalchemy import models
-from dolphin.db.sqlalchemy.models import Storage, RegistryContext
+from dolphin.db.sqlalchemy import sharding
+from dolphin.db.sqlalchemy.models import Storage, RegistryContext, Volume, Pool
+from dolphin.db.sqlalchemy.models import CapacitySample, CapacitySummary
+from dolphin.db.sqlalchemy.models import CollectionJob
 
 CONF = cfg.CONF
 LOG = log.getLogger(__name__)
-_FACADE = None
 
 _DEFAULT_SQL_CONNECTION = 'sqlite:///'
+_INITIAL_REVISION = '9daa401447b6'
 db_options.set_defaults(cfg.CONF,
                         connection=_DEFAULT_SQL_CONNECTION)
 
 
+main_context_manager = enginefacade.transaction_context()
+main_context_manager.append_on_engine_create(metrics.instrument_engine)
+
+
 def get_engine():
-    facade = _create_facade_lazily()
-    return facade.get_engine()
+    return main_context_manager.writer.get_engine()
+
+
+def get_session(use_slave=False, **kwargs):
+    """Return a session which is not tied to any request context."""
+    if use_slave:
+        return main_context_manager.reader.get_sessionmaker()(**kwargs)
+    return main_context_manager.writer.get_sessionmaker()(**kwargs)
+
+
+def _use_replica(context):
+    """Whether reads made with context may be served by the replica.
+
+    Only if a slave_connection is configured, and not for a context which
+    wrote to the primary within the last db_replica_max_staleness seconds,
+    so that callers always read their own writes.
+    """
+    if not CONF.database.slave_connection:
+        return False
+    last_write = getattr(context, 'last_db_write', None)
+    return (last_write is None or
+            timeutils.is_older_than(last_write,
+                                    CONF.db_replica_max_staleness))
+
+
+def _reader(context):
+    if _use_replica(context):
+        return main_context_manager.async_
+    return main_context_manager.reader.allow_async
+
+
+def _replica_reader(f):
+    """Decorator for read functions, routing them to the replica if allowed.
+
+    Inside an enclosing transaction of the context the function joins that
+    transaction instead, whatever engine it uses.
+    """
+    @wraps(f)
+    def wrapper(context, *args, **kwargs):
+        with _reader(context).using(context):
+            return f(context, *args, **kwargs)
+    return wrapper
+
 
+def _primary_writer(f):
+    """Decorator for write functions, recording the write on the context."""
+    @wraps(f)
+    def wrapper(context, *args, **kwargs):
+        with main_context_manager.writer.using(context):
+            result = f(context, *args, **kwargs)
+        context.last_db_write = timeutils.utcnow()
+        return result
+    return wrapper
 
-def get_session(**kwargs):
-    facade = _create_facade_lazily()
-    return facade.get_session(**kwargs)
 
+def transaction(context, read_only=False):
+    """Share one session and transaction between db calls made with context.
 
-def _create_facade_lazily():
-    global _FACADE
-    if _FACADE is None:
-        _FACADE = session.EngineFacade.from_config(cfg.CONF)
-    return _FACADE
+    The db functions of this module join the session of an enclosing
+    transaction on the same context instead of opening their own one. A
+    read_only transaction is routed like a single read function.
+    """
+    if read_only:
+        return _reader(context).using(context)
+    return main_context_manager.writer.using(context)
+
+
+def in_transaction(context):
+    """Whether context is inside an enclosing db transaction."""
+    try:
+        context.transaction_ctx
+    except db_exc.NoEngineContextEstablished:
+        return False
+    return True
+
+
+def after_commit(context, callback):
+    """Call callback once the enclosing transaction of context commits.
+
+    Nothing is called if it is rolled back.
+    """
+    event.listen(context.session, 'after_commit',
+                 lambda session: callback(), once=True)
+
+
+def engine_stats():
+    """Return the pool and statement metrics of the database engines."""
+    return metrics.engine_stats()
 
 
 def get_backend():
@@ -60,46 +158,70 @@ def get_backend():
 
 
 def register_db():
-    engine = create_engine(_DEFAULT_SQL_CONNECTION, echo=False)
-    models = (Storage,
-              RegistryContext
-              )
-    engine = create_engine(CONF.database.connection, echo=False)
-    for model in models:
-        model.metadata.create_all(engine)
+    """Bring the database schema up to the latest migration.
 
+    The revision recorded in the alembic_version table is compared with
+    the head of the migration scripts first, so an up to date schema,
+    the common case on service start, costs a single query and no
+    migration run. The engine used is the one of the enginefacade, which
+    the following db calls reuse. The partitioning of the inventory is
+    only checked, see :func:`inventory_reshard`.
+    """
+    _sync_schema()
+    sharding.check_shards(get_engine())
 
-def registry_context_create(register_info):
+
+def inventory_reshard():
+    """Migrate the schema, then repartition the volumes and pools tables."""
+    _sync_schema()
+    sharding.reshard(get_engine())
+
+
+def _sync_schema():
+    current = migration.version()
+    if current is None or current != migration.head():
+        if (current is None and Storage.__tablename__ in
+                inspect(get_engine()).get_table_names()):
+            # NOTE: Databases created before migrations were introduced
+            # hold the initial schema, record that so they are upgraded
+            # from there.
+            migration.stamp(_INITIAL_REVISION)
+        migration.upgrade('head')
+
+
+@_primary_writer
+def registry_context_create(context, register_info):
     register_ref = models.RegistryContext()
     register_ref.storage_id = register_info.storage_id
     register_ref.username = register_info.username
     register_ref.hostname = register_info.hostname
     register_ref.password = register_info.password
     register_ref.extra_attributes = register_info.extra_attributes
-    this_session = get_session()
-    this_session.begin()
-    this_session.add(register_ref)
-    this_session.commit()
+    context.session.add(register_ref)
     return register_ref
 
 
-def registry_context_get(storage_id):
-    this_session = get_session()
-    this_session.begin()
-    registry_context = this_session.query(RegistryContext) \
+@_replica_reader
+def registry_context_get(context, storage_id):
+    registry_context = context.session.query(RegistryContext) \
         .filter(RegistryContext.storage_id == storage_id) \
         .first()
     return registry_context
 
 
-def registry_context_get_all():
-    this_session = get_session()
-    this_session.begin()
-    registry_context = this_session.query(RegistryContext).all()
+@_replica_reader
+def registry_context_get_all(context, filters=None, limit=None, marker=None,
+                             sort_keys=None, sort_dirs=None):
+    query = context.session.query(RegistryContext)
+    query = _process_filters(query, RegistryContext, filters)
+    query = _paginate_query(query, RegistryContext, limit, marker,
+                            sort_keys, sort_dirs)
+    registry_context = query.all()
     return registry_context
 
 
-def storage_create(storage):
+@_primary_writer
+def storage_create(context, storage):
     storage_ref = models.Storage()
     storage_ref.id = storage.id
     storage_ref.name = storage.name
@@ -107,17 +229,1151 @@ def storage_create(storage):
     storage_ref.vendor = storage.vendor
     storage_ref.description = storage.description
     storage_ref.location = storage.location
-    this_session = get_session()
-    this_session.begin()
-    this_session.add(storage_ref)
-    this_session.commit()
+    context.session.add(storage_ref)
     return storage_ref
 
 
-def storage_get(storage_id):
-    this_session = get_session()
-    this_session.begin()
-    storage_by_id = this_session.query(Storage) \
+@_replica_reader
+def storage_get(context, storage_id):
+    query = context.session.query(Storage).filter(Storage.id == storage_id)
+    storage_by_id = _read_deleted_filter(query, context, Storage).first()
+    return storage_by_id
+
+
+@_replica_reader
+def storage_get_all(context, filters=None, limit=None, marker=None,
+                    sort_keys=None, sort_dirs=None):
+    query = _read_deleted_filter(context.session.query(Storage), context,
+                                 Storage)
+    query = _process_filters(query, Storage, filters)
+    query = _paginate_query(query, Storage, limit, marker,
+                            sort_keys, sort_dirs)
+    storages = query.all()
+    return storages
+
+
+def storage_iter(context, filters=None, chunk_size=1000):
+    this_session = get_session(use_slave=_use_replica(context))
+    query = _read_deleted_filter(this_session.query(Storage), context,
+                                 Storage)
+    query = _process_filters(query, Storage, filters)
+    return _iter_query(this_session, [query.order_by(Storage.id)],
+                       chunk_size)
+
+
+@_primary_writer
+def storage_bulk_upsert(context, storages):
+    """Insert or update a batch of storages keyed by their id.
+
+    Upserting a deleted storage makes it live again.
+    """
+    rows = [dict(storage, deleted=0, deleted_at=None)
+            for storage in storages]
+    return _bulk_upsert(context, Storage, rows, ('id',))
+
+
+@_primary_writer
+def storage_delete(context, storage_id):
+    """Soft delete a storage together with its pools and volumes.
+
+    Its registry context and queued collection jobs are deleted, so the
+    storage is no longer collected.
+    """
+    now = timeutils.utcnow()
+    count = context.session.query(Storage) \
         .filter(Storage.id == storage_id) \
+        .filter(Storage.deleted == 0) \
+        .update({Storage.deleted: 1, Storage.deleted_at: now},
+                synchronize_session=False)
+    if not count:
+        raise exception.StorageNotFound(storage_id=storage_id)
+    for base_model in (Volume, Pool):
+        model = sharding.model_for(base_model, storage_id)
+        context.session.query(model) \
+            .filter(model.storage_id == storage_id) \
+            .filter(model.deleted == 0) \
+            .update({model.deleted: model.id, model.deleted_at: now},
+                    synchronize_session=False)
+    for model in (CapacitySummary, RegistryContext, CollectionJob):
+        context.session.query(model) \
+            .filter(model.storage_id == storage_id) \
+            .delete(synchronize_session=False)
+
+
+@_primary_writer
+def volume_create(context, volume, storage_id):
+    volume_ref = sharding.model_for(Volume, storage_id)()
+    volume_ref.update(volume)
+    volume_ref.storage_id = storage_id
+    context.session.add(volume_ref)
+    deltas = {}
+    _capacity_summary_add(deltas, volume, 1)
+    _capacity_summary_apply(context.session, storage_id, deltas)
+    return volume_ref
+
+
+@_replica_reader
+def volume_get(context, volume_id, storage_id):
+    model = sharding.model_for(Volume, storage_id)
+    query = context.session.query(model) \
+        .filter(model.id == volume_id) \
+        .filter(model.storage_id == storage_id)
+    volume = _read_deleted_filter(query, context, model).first()
+    return volume
+
+
+@_replica_reader
+def volume_get_all(context, storage_id, filters=None, limit=None,
+                   marker=None, sort_keys=None, sort_dirs=None):
+    model = sharding.model_for(Volume, storage_id)
+    query = context.session.query(model) \
+        .filter(model.storage_id == storage_id)
+    query = _read_deleted_filter(query, context, model)
+    query = _process_filters(query, model, filters)
+    query = _paginate_query(query, model, limit, marker,
+                            sort_keys, sort_dirs)
+    volumes = query.all()
+    return volumes
+
+
+def volume_iter(context, storage_id=None, filters=None, chunk_size=1000):
+    return _iter_resources(context, Volume, storage_id, filters, chunk_size)
+
+
+@_primary_writer
+def volume_bulk_upsert(context, volumes, storage_id):
+    """Insert or update a batch of volumes of one storage.
+
+    Volumes are matched on their natural key (storage_id, name) among the
+    rows that are not deleted.
+    """
+    rows = [dict(volume, storage_id=storage_id, deleted=0,
+                 content_hash=_content_hash(volume))
+            for volume in volumes]
+    written = _bulk_upsert(context, sharding.model_for(Volume, storage_id),
+                           rows, _NATURAL_KEY)
+    _capacity_summary_rebuild(context.session, storage_id)
+    return written
+
+
+@_primary_writer
+def volume_sync(context, volumes, storage_id, defer=None):
+    """Make the stored volumes of a storage match the collected ones.
+
+    Only new, changed and vanished volumes are written, see
+    :func:`_resource_sync`.
+    """
+    return _resource_sync(context, Volume, volumes, storage_id, defer)
+
+
+@_primary_writer
+def pool_create(context, pool, storage_id):
+    pool_ref = sharding.model_for(Pool, storage_id)()
+    pool_ref.update(pool)
+    pool_ref.storage_id = storage_id
+    context.session.add(pool_ref)
+    return pool_ref
+
+
+@_replica_reader
+def pool_get(context, pool_id, storage_id):
+    model = sharding.model_for(Pool, storage_id)
+    query = context.session.query(model) \
+        .filter(model.id == pool_id) \
+        .filter(model.storage_id == storage_id)
+    pool = _read_deleted_filter(query, context, model).first()
+    return pool
+
+
+@_replica_reader
+def pool_get_all(context, storage_id, filters=None, limit=None, marker=None,
+                 sort_keys=None, sort_dirs=None):
+    model = sharding.model_for(Pool, storage_id)
+    query = context.session.query(model) \
+        .filter(model.storage_id == storage_id)
+    query = _read_deleted_filter(query, context, model)
+    query = _process_filters(query, model, filters)
+    query = _paginate_query(query, model, limit, marker,
+                            sort_keys, sort_dirs)
+    pools = query.all()
+    return pools
+
+
+def pool_iter(context, storage_id=None, filters=None, chunk_size=1000):
+    return _iter_resources(context, Pool, storage_id, filters, chunk_size)
+
+
+@_primary_writer
+def pool_bulk_upsert(context, pools, storage_id):
+    """Insert or update a batch of pools of one storage.
+
+    Pools are matched on their natural key (storage_id, name) among the
+    rows that are not deleted.
+    """
+    rows = [dict(pool, storage_id=storage_id, deleted=0,
+                 content_hash=_content_hash(pool))
+            for pool in pools]
+    return _bulk_upsert(context, sharding.model_for(Pool, storage_id), rows,
+                        _NATURAL_KEY)
+
+
+@_primary_writer
+def pool_sync(context, pools, storage_id):
+    """Make the stored pools of a storage match the collected ones.
+
+    Only new, changed and vanished pools are written, see
+    :func:`_resource_sync`.
+    """
+    return _resource_sync(context, Pool, pools, storage_id)
+
+
+# Columns a partial update of a volume or pool may not change.
+_NON_UPDATABLE_COLUMNS = frozenset(['id', 'storage_id', 'created_at',
+                                    'deleted_at', 'deleted'])
+
+
+@_primary_writer
+def resource_bulk_update(context, resource_type, updates, storage_id):
+    """Update some columns of many pools or volumes of one storage.
+
+    updates is a dict of resource id to the dict of columns to set. Rows
+    with the same set of columns are updated by one executemany UPDATE.
+    Deleted rows are left alone. The content hash of the updated rows is
+    cleared unless it is part of the update, so that the next sync writes
+    the collected values again.
+    For volumes the capacity summaries follow the changes.
+
+    :returns: the number of rows updated.
+    """
+    model = _resource_model(resource_type)
+    if model not in sharding.SHARDED_MODELS:
+        msg = _("Resource type %s can not be updated in bulk.") % \
+            resource_type
+        raise exception.InvalidInput(reason=msg)
+    model = sharding.model_for(model, storage_id)
+    table = model.__table__
+    now = timeutils.utcnow()
+    by_columns = {}
+    for resource_id, values in updates.items():
+        row = dict((column, value) for column, value in values.items()
+                   if column in table.columns and
+                   column not in _NON_UPDATABLE_COLUMNS)
+        row['updated_at'] = now
+        row.setdefault('content_hash', None)
+        by_columns.setdefault(tuple(sorted(row)), []).append(
+            dict(row, _id=resource_id))
+
+    this_session = context.session
+    if resource_type == 'volume':
+        changed_rows = [dict(row, id=row['_id'])
+                        for columns, rows in by_columns.items()
+                        if set(columns) & set(_SUMMARY_COLUMNS + ('pool_id',))
+                        for row in rows]
+        if changed_rows:
+            _volume_summary_sync(this_session, storage_id, [],
+                                 changed_rows, [])
+    updated = 0
+    for columns, rows in by_columns.items():
+        stmt = table.update() \
+            .where(table.c.id == sql.bindparam('_id')) \
+            .where(table.c.storage_id == storage_id) \
+            .where(table.c.deleted == 0) \
+            .values(dict((column, sql.bindparam(column))
+                         for column in columns))
+        for chunk in _chunks(rows, CONF.db_bulk_upsert_batch_size):
+            updated += this_session.execute(stmt, chunk).rowcount
+    return updated
+
+
+# Resolutions, in seconds, capacity samples are rolled up to, each one from
+# the previous level. Raw samples have a resolution of 0.
+CAPACITY_RESOLUTIONS = (0, 300, 3600, 86400)
+
+
+def _capacity_retention():
+    return {0: CONF.capacity_retention_raw_days,
+            300: CONF.capacity_retention_5m_days,
+            3600: CONF.capacity_retention_1h_days,
+            86400: CONF.capacity_retention_1d_days}
+
+
+@_primary_writer
+def capacity_samples_add(context, samples, sampled_at=None):
+    """Store raw capacity samples.
+
+    :param samples: list of dicts with resource_type, resource_id,
+        storage_id and the total, used and free capacity.
+    :param sampled_at: seconds since the epoch, defaults to now.
+    """
+    if sampled_at is None:
+        sampled_at = int(time.time())
+    rows = []
+    for sample in samples:
+        rows.append({'resource_type': sample['resource_type'],
+                     'resource_id': six.text_type(sample['resource_id']),
+                     'storage_id': sample.get('storage_id'),
+                     'resolution': 0,
+                     'sampled_at': int(sample.get('sampled_at', sampled_at)),
+                     'total_capacity': sample.get('total_capacity'),
+                     'used_capacity': sample.get('used_capacity'),
+                     'free_capacity': sample.get('free_capacity'),
+                     'max_used_capacity': sample.get('used_capacity'),
+                     'sample_count': 1})
+    for chunk in _chunks(rows, CONF.db_bulk_upsert_batch_size):
+        context.session.execute(CapacitySample.__table__.insert(), chunk)
+    return len(rows)
+
+
+@_replica_reader
+def capacity_history_get(context, resource_type, resource_ids, start, end,
+                         resolution=None):
+    """Get the capacity samples of resources between start and end.
+
+    Without an explicit resolution the finest one that stays within
+    capacity_history_max_points per resource and whose retention still
+    covers start is used, so long ranges are answered from the rollups
+    instead of the raw samples.
+
+    :returns: named tuples of resource_id, sampled_at and the capacity
+        columns, ordered by resource_id and sampled_at. Plain rows rather
+        than model objects keep long ranges cheap to load.
+    """
+    resource_ids = [six.text_type(resource_id)
+                    for resource_id in resource_ids]
+    if resolution is None:
+        resolution = _capacity_resolution_for(context, resource_type,
+                                              resource_ids, start, end)
+    query = context.session.query(CapacitySample.resource_id,
+                                  CapacitySample.sampled_at,
+                                  CapacitySample.total_capacity,
+                                  CapacitySample.used_capacity,
+                                  CapacitySample.free_capacity,
+                                  CapacitySample.max_used_capacity) \
+        .filter(CapacitySample.resource_type == resource_type) \
+        .filter(CapacitySample.resource_id.in_(resource_ids)) \
+        .filter(CapacitySample.resolution == resolution) \
+        .filter(CapacitySample.sampled_at >= int(start)) \
+        .filter(CapacitySample.sampled_at < int(end)) \
+        .order_by(CapacitySample.resource_id, CapacitySample.sampled_at)
+    return query.all()
+
+
+def _capacity_resolution_for(context, resource_type, resource_ids, start,
+                             end):
+    retention = _capacity_retention()
+    oldest = time.time() - start
+    for resolution in CAPACITY_RESOLUTIONS:
+        if oldest > retention[resolution] * 86400:
+            continue
+        if resolution == 0:
+            # Raw samples come at the collection interval, their number
+            # is counted rather than derived from the range.
+            points = max([0] + [count for count, in context.session.query(
+                func.count())
+                .filter(CapacitySample.resource_type == resource_type)
+                .filter(CapacitySample.resource_id.in_(resource_ids))
+                .filter(CapacitySample.resolution == 0)
+                .filter(CapacitySample.sampled_at >= int(start))
+                .filter(CapacitySample.sampled_at < int(end))
+                .group_by(CapacitySample.resource_id)])
+        else:
+            points = (end - start) / resolution
+        if points <= CONF.capacity_history_max_points:
+            return resolution
+    return CAPACITY_RESOLUTIONS[-1]
+
+
+@_primary_writer
+def capacity_rollup(context, now=None):
+    """Roll capacity samples up into the coarser resolutions.
+
+    Each level aggregates the complete buckets of the previous level which
+    end at least capacity_rollup_delay seconds before now and were not
+    rolled up yet, with one INSERT ... SELECT ... GROUP BY per level.
+
+    :returns: the number of rows written.
+    """
+    if now is None:
+        now = int(time.time())
+    table = CapacitySample.__table__
+    rolled = 0
+    for source, target in zip(CAPACITY_RESOLUTIONS[:-1],
+                              CAPACITY_RESOLUTIONS[1:]):
+        last = context.session.query(func.max(table.c.sampled_at)) \
+            .filter(table.c.resolution == target).scalar()
+        if last is None:
+            first = context.session.query(func.min(table.c.sampled_at)) \
+                .filter(table.c.resolution == source).scalar()
+            if first is None:
+                continue
+            start = first - first % target
+        else:
+            start = last + target
+        end = now - CONF.capacity_rollup_delay
+        end -= end % target
+        if end <= start:
+            continue
+
+        bucket = table.c.sampled_at - table.c.sampled_at % target
+        count = func.sum(table.c.sample_count)
+
+        def average(column):
+            return cast(func.sum(column * table.c.sample_count) / count,
+                        BigInteger)
+
+        select = sql.select([table.c.resource_type,
+                             table.c.resource_id,
+                             literal(target),
+                             bucket,
+                             func.max(table.c.storage_id),
+                             average(table.c.total_capacity),
+                             average(table.c.used_capacity),
+                             average(table.c.free_capacity),
+                             func.max(table.c.max_used_capacity),
+                             count]) \
+            .where(table.c.resolution == source) \
+            .where(table.c.sampled_at >= start) \
+            .where(table.c.sampled_at < end) \
+            .group_by(table.c.resource_type, table.c.resource_id, bucket)
+        result = context.session.execute(table.insert().from_select(
+            ['resource_type', 'resource_id', 'resolution', 'sampled_at',
+             'storage_id', 'total_capacity', 'used_capacity',
+             'free_capacity', 'max_used_capacity', 'sample_count'],
+            select))
+        rolled += result.rowcount
+    return rolled
+
+
+@_primary_writer
+def capacity_purge(context, now=None):
+    """Delete capacity samples older than the retention of their resolution.
+
+    :returns: the number of rows deleted.
+    """
+    if now is None:
+        now = int(time.time())
+    purged = 0
+    for resolution, days in _capacity_retention().items():
+        purged += context.session.query(CapacitySample) \
+            .filter(CapacitySample.resolution == resolution) \
+            .filter(CapacitySample.sampled_at < now - days * 86400) \
+            .delete(synchronize_session=False)
+    return purged
+
+
+# Models of the inventory resource types.
+_RESOURCE_MODELS = {'storage': Storage, 'pool': Pool, 'volume': Volume}
+_CAPACITY_COLUMNS = ('total_capacity', 'used_capacity', 'free_capacity')
+
+
+@_replica_reader
+def capacity_arrays(context, resource_type, storage_id=None, filters=None,
+                    columns=_CAPACITY_COLUMNS, chunk_size=1000):
+    """Load capacity columns of storages, pools or volumes into arrays.
+
+    The rows are streamed as plain tuples and appended to one
+    array('q') per column, a NULL capacity is stored as 0. The arrays
+    are meant for :mod:`dolphin.common.capacity`.
+
+    :returns: a dict of column name to array('q'), plus 'id' with the
+        resource ids in the same order.
+    """
+    model = _resource_model(resource_type)
+    for column in columns:
+        if column not in _CAPACITY_COLUMNS:
+            msg = _("Invalid capacity column: %s") % column
+            raise exception.InvalidInput(reason=msg)
+    if storage_id is not None and model is not Storage:
+        shard_models = [sharding.model_for(model, storage_id)]
+    else:
+        shard_models = sharding.models_of(model)
+
+    ids = []
+    arrays = [array.array('q') for column in columns]
+    for shard_model in shard_models:
+        query = context.session.query(
+            shard_model.id,
+            *[getattr(shard_model, column) for column in columns])
+        query = _read_deleted_filter(query, context, shard_model)
+        if storage_id is not None:
+            attr = (shard_model.id if model is Storage
+                    else shard_model.storage_id)
+            query = query.filter(attr == storage_id)
+        query = _process_filters(query, shard_model, filters)
+        # Executed as a core statement, the rows skip the ORM result
+        # processing and are fetched in chunk_size batches.
+        result = context.session.execute(
+            query.order_by(shard_model.id).statement)
+        for rows in iter(lambda: result.fetchmany(chunk_size), []):
+            for row in rows:
+                ids.append(row[0])
+                for values, value in zip(arrays, row[1:]):
+                    values.append(value or 0)
+    result = dict(zip(columns, arrays))
+    result['id'] = ids
+    return result
+
+
+# Columns of capacity_summaries maintained from the volumes of a pool.
+_SUMMARY_COLUMNS = ('volume_count', 'total_capacity', 'used_capacity',
+                    'free_capacity')
+
+
+@_replica_reader
+def capacity_summary_get_all(context, storage_id):
+    """Get the volume capacity totals of each pool of a storage."""
+    return context.session.query(CapacitySummary) \
+        .filter(CapacitySummary.storage_id == storage_id) \
+        .order_by(CapacitySummary.pool_id) \
+        .all()
+
+
+@_replica_reader
+def storage_capacity_summary_get(context, storage_id):
+    """Get the volume count and capacity totals of a storage.
+
+    Sums the few pool rows of the storage in capacity_summaries rather
+    than its volumes.
+    """
+    result = context.session.query(
+        *[func.coalesce(func.sum(getattr(CapacitySummary, column)), 0)
+          for column in _SUMMARY_COLUMNS]) \
+        .filter(CapacitySummary.storage_id == storage_id) \
+        .one()
+    return dict((column, int(value))
+                for column, value in zip(_SUMMARY_COLUMNS, result))
+
+
+@_replica_reader
+def capacity_summary_by_vendor(context):
+    """Get the volume count and capacity totals of all storages by vendor.
+
+    :returns: named tuples of vendor and the summary columns.
+    """
+    return context.session.query(
+        Storage.vendor,
+        *[func.sum(getattr(CapacitySummary, column)).label(column)
+          for column in _SUMMARY_COLUMNS]) \
+        .join(CapacitySummary, CapacitySummary.storage_id == Storage.id) \
+        .group_by(Storage.vendor) \
+        .order_by(Storage.vendor) \
+        .all()
+
+
+def _capacity_summary_add(deltas, volume, sign):
+    """Count volume in or, with a negative sign, out of deltas."""
+    delta = deltas.setdefault(volume.get('pool_id') or '',
+                              [0] * len(_SUMMARY_COLUMNS))
+    delta[0] += sign
+    for i, column in enumerate(_SUMMARY_COLUMNS[1:], 1):
+        delta[i] += sign * int(volume.get(column) or 0)
+
+
+def _capacity_summary_apply(this_session, storage_id, deltas):
+    """Add the per pool deltas to the capacity summaries of a storage.
+
+    The columns are incremented in place, so the totals stay right when
+    other transactions change other volumes of the same pool.
+    """
+    table = CapacitySummary.__table__
+    for pool_id, delta in deltas.items():
+        if not any(delta):
+            continue
+        values = dict(zip(_SUMMARY_COLUMNS, delta))
+        result = this_session.execute(
+            table.update()
+            .where(table.c.storage_id == storage_id)
+            .where(table.c.pool_id == pool_id)
+            .values(dict((column, table.c[column] + value)
+                         for column, value in values.items())))
+        if not result.rowcount:
+            this_session.execute(table.insert().values(
+                storage_id=storage_id, pool_id=pool_id, **values))
+
+
+def _capacity_summary_rebuild(this_session, storage_id):
+    """Recompute the capacity summaries of a storage from its volumes."""
+    table = CapacitySummary.__table__
+    volume = sharding.model_for(Volume, storage_id)
+    pool_id = func.coalesce(volume.pool_id, '')
+    this_session.execute(
+        table.delete().where(table.c.storage_id == storage_id))
+    this_session.execute(table.insert().from_select(
+        ['storage_id', 'pool_id'] + list(_SUMMARY_COLUMNS),
+        sql.select([volume.storage_id, pool_id, func.count()] +
+                   [func.coalesce(func.sum(getattr(volume, column)), 0)
+                    for column in _SUMMARY_COLUMNS[1:]])
+        .where(volume.storage_id == storage_id)
+        .where(volume.deleted == 0)
+        .group_by(volume.storage_id, pool_id)))
+
+
+def _volume_summary_sync(this_session, storage_id, new_rows, changed_rows,
+                         vanished_ids):
+    """Apply the capacity changes of a volume sync to the summaries.
+
+    Only the previous pool and capacities of the changed and vanished
+    volumes are read, so the cost follows the number of changes rather
+    than the number of volumes of the storage.
+    """
+    volume = sharding.model_for(Volume, storage_id)
+    columns = (volume.id, volume.pool_id, volume.total_capacity,
+               volume.used_capacity, volume.free_capacity)
+    stored = {}
+    ids = [row['id'] for row in changed_rows] + vanished_ids
+    for chunk in _chunks(ids, CONF.db_bulk_upsert_batch_size):
+        for row in this_session.query(*columns) \
+                .filter(volume.id.in_(chunk)) \
+                .filter(volume.deleted == 0):
+            stored[row.id] = row._asdict()
+
+    deltas = {}
+    for row in new_rows:
+        _capacity_summary_add(deltas, row, 1)
+    for row in changed_rows:
+        if row['id'] not in stored:
+            continue
+        _capacity_summary_add(deltas, stored[row['id']], -1)
+        _capacity_summary_add(deltas, dict(stored[row['id']], **row), 1)
+    for resource_id in vanished_ids:
+        _capacity_summary_add(deltas, stored[resource_id], -1)
+    _capacity_summary_apply(this_session, storage_id, deltas)
+
+
+@_primary_writer
+def tombstone_purge(context, resource_type, before, batch_size):
+    """Hard delete one batch of rows soft deleted before the given time.
+
+    The ids of at most batch_size tombstones are looked up first, then
+    deleted by primary key. Each call is a transaction of its own, so a
+    large backlog is purged by repeated calls without holding row or
+    table locks for long.
+
+    :returns: the number of rows deleted.
+    """
+    purged = 0
+    for model in sharding.models_of(_resource_model(resource_type)):
+        ids = [row[0] for row in context.session.query(model.id)
+               .filter(model.deleted != 0)
+               .filter(model.deleted_at < before)
+               .limit(batch_size - purged)]
+        if ids:
+            purged += context.session.query(model) \
+                .filter(model.id.in_(ids)) \
+                .delete(synchronize_session=False)
+            if model is Storage:
+                # Left behind by deletes made before storage_delete
+                # removed the registry context itself.
+                context.session.query(RegistryContext) \
+                    .filter(RegistryContext.storage_id.in_(ids)) \
+                    .delete(synchronize_session=False)
+        if purged >= batch_size:
+            break
+    return purged
+
+
+def _job_leasable(now):
+    return or_(CollectionJob.lease_expires_at.is_(None),
+               CollectionJob.lease_expires_at < now)
+
+
+@_primary_writer
+def collection_job_enqueue(context, jobs, node):
+    """Queue collection jobs of node, skipping the ones already queued.
+
+    jobs is a list of (storage_id, resource_type). Already queued jobs of
+    other nodes which are not leased are handed over to node, as a node
+    only queues jobs of the storages it owns.
+
+    :returns: the number of jobs newly queued.
+    """
+    jobs = list(set(jobs))
+    if not jobs:
+        return 0
+    this_session = context.session
+    now = timeutils.utcnow()
+    key = tuple_(CollectionJob.storage_id, CollectionJob.resource_type)
+    queued = {}
+    for chunk in _chunks(jobs, CONF.db_bulk_upsert_batch_size):
+        for job_id, storage_id, resource_type, job_node in \
+                this_session.query(CollectionJob.id,
+                                   CollectionJob.storage_id,
+                                   CollectionJob.resource_type,
+                                   CollectionJob.node) \
+                .filter(key.in_(chunk)):
+            queued[(storage_id, resource_type)] = (job_id, job_node)
+
+    handed_over = [job_id for job_id, job_node in queued.values()
+                   if job_node != node]
+    for chunk in _chunks(handed_over, CONF.db_bulk_upsert_batch_size):
+        this_session.query(CollectionJob) \
+            .filter(CollectionJob.id.in_(chunk)) \
+            .filter(_job_leasable(now)) \
+            .update({CollectionJob.node: node}, synchronize_session=False)
+
+    rows = [{'storage_id': storage_id, 'resource_type': resource_type,
+             'node': node, 'attempts': 0, 'created_at': now}
+            for storage_id, resource_type in jobs
+            if (storage_id, resource_type) not in queued]
+    for chunk in _chunks(rows, CONF.db_bulk_upsert_batch_size):
+        # Jobs queued concurrently by another transaction are skipped.
+        this_session.execute(_insert_ignore(this_session,
+                                            CollectionJob.__table__), chunk)
+    return len(rows)
+
+
+def _insert_ignore(this_session, table):
+    dialect = this_session.bind.dialect.name
+    if dialect == 'postgresql':
+        return postgresql.insert(table).on_conflict_do_nothing()
+    elif dialect == 'mysql':
+        return table.insert().prefix_with('IGNORE')
+    return table.insert().prefix_with('OR IGNORE')
+
+
+@_primary_writer
+def collection_job_lease(context, worker, limit, lease_time, node=None,
+                         created_before=None):
+    """Lease up to limit queued jobs of node, the oldest first.
+
+    Jobs never leased and jobs whose lease expired without being
+    completed can be leased. The jobs are held by worker for lease_time
+    seconds, until completed with :func:`collection_job_complete`.
+
+    :param node: the node whose jobs to lease, defaults to worker.
+    :param created_before: only lease jobs queued before that time.
+    :returns: the leased jobs.
+    """
+    this_session = context.session
+    now = timeutils.utcnow()
+    query = this_session.query(CollectionJob.id) \
+        .filter(CollectionJob.node == (node or worker)) \
+        .filter(_job_leasable(now))
+    if created_before is not None:
+        query = query.filter(CollectionJob.created_at < created_before)
+    ids = [row[0] for row in query
+           .order_by(CollectionJob.created_at, CollectionJob.id)
+           .limit(limit)]
+    if not ids:
+        return []
+    expires_at = now + datetime.timedelta(seconds=lease_time)
+    # Jobs leased by someone else since the select above are left out.
+    this_session.query(CollectionJob) \
+        .filter(CollectionJob.id.in_(ids)) \
+        .filter(_job_leasable(now)) \
+        .update({CollectionJob.leased_by: worker,
+                 CollectionJob.lease_expires_at: expires_at,
+                 CollectionJob.attempts: CollectionJob.attempts + 1},
+                synchronize_session=False)
+    return this_session.query(CollectionJob) \
+        .filter(CollectionJob.id.in_(ids)) \
+        .filter(CollectionJob.leased_by == worker) \
+        .all()
+
+
+@_primary_writer
+def collection_job_complete(context, job_id, worker):
+    """Remove a job leased by worker.
+
+    :returns: False if the lease expired and the job was leased again by
+        another worker meanwhile.
+    """
+    return bool(context.session.query(CollectionJob)
+                .filter(CollectionJob.id == job_id)
+                .filter(CollectionJob.leased_by == worker)
+                .delete(synchronize_session=False))
+
+
+@_primary_writer
+def collection_job_claim(context, storage_id, resource_type, worker,
+                         lease_time):
+    """Queue the job of a resource type of a storage and lease it to worker.
+
+    A job leased by another worker is left to it, a queued job which is
+    not leased is handed over to worker.
+
+    :returns: the job, leased by worker unless it is run elsewhere.
+    """
+    this_session = context.session
+    now = timeutils.utcnow()
+    this_session.execute(
+        _insert_ignore(this_session, CollectionJob.__table__),
+        [{'storage_id': storage_id, 'resource_type': resource_type,
+          'node': worker, 'attempts': 0, 'created_at': now}])
+    query = this_session.query(CollectionJob) \
+        .filter(CollectionJob.storage_id == storage_id) \
+        .filter(CollectionJob.resource_type == resource_type)
+    expires_at = now + datetime.timedelta(seconds=lease_time)
+    query.filter(_job_leasable(now)) \
+        .update({CollectionJob.node: worker,
+                 CollectionJob.leased_by: worker,
+                 CollectionJob.lease_expires_at: expires_at,
+                 CollectionJob.attempts: CollectionJob.attempts + 1},
+                synchronize_session=False)
+    return query.one()
+
+
+@_replica_reader
+def collection_job_get(context, job_id):
+    """Return a job, None once it is completed."""
+    return context.session.query(CollectionJob) \
+        .filter(CollectionJob.id == job_id) \
         .first()
-    return storage_by_id
+
+
+@_replica_reader
+def collection_job_overdue(context, created_before):
+    """Count the jobs of each node queued before a time and not leased.
+
+    :returns: a dict of node to its number of such jobs.
+    """
+    now = timeutils.utcnow()
+    return dict(context.session.query(CollectionJob.node, func.count())
+                .filter(CollectionJob.created_at < created_before)
+                .filter(_job_leasable(now))
+                .group_by(CollectionJob.node))
+
+
+@_replica_reader
+def collection_job_stats(context, node=None):
+    """Return the depth of the job queue of node, or of all nodes.
+
+    :returns: a dict with the number of queued jobs, of leased ones and
+        the age in seconds of the oldest job.
+    """
+    now = timeutils.utcnow()
+    query = context.session.query(
+        func.count(),
+        func.sum(sql.case([(CollectionJob.lease_expires_at >= now, 1)],
+                          else_=0)),
+        func.min(CollectionJob.created_at))
+    if node is not None:
+        query = query.filter(CollectionJob.node == node)
+    depth, leased, oldest = query.one()
+    return {'depth': depth,
+            'leased': int(leased or 0),
+            'oldest_age': (timeutils.delta_seconds(oldest, now)
+                           if oldest else 0.0)}
+
+
+def _resource_model(resource_type):
+    model = _RESOURCE_MODELS.get(resource_type)
+    if model is None:
+        msg = _("Invalid resource type: %s") % resource_type
+        raise exception.InvalidInput(reason=msg)
+    return model
+
+
+def _read_deleted_filter(query, context, model):
+    """Restrict query to the rows context.read_deleted asks for.
+
+    'no' hides soft deleted rows, 'only' returns nothing else and 'yes'
+    returns both.
+    """
+    if context.read_deleted == 'no':
+        return query.filter(model.deleted == 0)
+    elif context.read_deleted == 'only':
+        return query.filter(model.deleted != 0)
+    return query
+
+
+def _process_filters(query, model, filters):
+    """Apply exact match filters, a list value matches any of its items."""
+    for key, value in (filters or {}).items():
+        if key not in model.__table__.columns:
+            msg = _("Invalid filter key: %s") % key
+            raise exception.InvalidInput(reason=msg)
+        column = getattr(model, key)
+        if isinstance(value, (list, tuple, set, frozenset)):
+            query = query.filter(column.in_(value))
+        else:
+            query = query.filter(column == value)
+    return query
+
+
+def _paginate_query(query, model, limit=None, marker=None, sort_keys=None,
+                    sort_dirs=None):
+    """Order query and apply keyset pagination to it.
+
+    The primary key is always appended as the last sort key so the order is
+    total. marker is the primary key of the last row of the previous page,
+    looked up with query itself, so that a marker the listing does not
+    return is rejected. The next page is selected with a seek predicate
+    built from the sort key values of that row instead of an OFFSET, which
+    keeps the cost of a page independent of its position.
+
+    NULLs sort after all values in ascending order and before them in
+    descending order, on every database. A nullable key is sorted by
+    whether it is NULL first, which the seek predicate compares too.
+    """
+    primary_key = model.__mapper__.primary_key[0].name
+    sort_keys = list(sort_keys or [])
+    sort_dirs = list(sort_dirs or [])
+    if primary_key not in sort_keys:
+        sort_keys.append(primary_key)
+    default_dir = sort_dirs[0] if sort_dirs else 'asc'
+    sort_dirs.extend([default_dir] * (len(sort_keys) - len(sort_dirs)))
+
+    marker_ref = None
+    if marker is not None:
+        marker_ref = query.filter(getattr(model, primary_key) == marker) \
+            .first()
+        if not marker_ref:
+            raise exception.MarkerNotFound(marker=marker)
+
+    # (expression, direction, value of the marker) per term of the seek
+    # predicate.
+    terms = []
+    for key, sort_dir in zip(sort_keys, sort_dirs):
+        if key not in model.__table__.columns:
+            msg = _("Invalid sort key: %s") % key
+            raise exception.InvalidInput(reason=msg)
+        if sort_dir not in ('asc', 'desc'):
+            msg = _("Invalid sort direction: %s") % sort_dir
+            raise exception.InvalidInput(reason=msg)
+        column = getattr(model, key)
+        value = getattr(marker_ref, key, None)
+        if model.__table__.columns[key].nullable:
+            is_null = sql.case([(column.is_(None), 1)], else_=0)
+            query = query.order_by(getattr(is_null, sort_dir)())
+            terms.append((is_null, sort_dir, int(value is None)))
+        query = query.order_by(getattr(column, sort_dir)())
+        # Past a NULL marker value, rows equal in the NULL flag have a NULL
+        # key too, the key itself tells nothing more.
+        if marker_ref is None or value is not None:
+            terms.append((column, sort_dir, value))
+
+    if marker_ref is not None:
+        criteria = []
+        for i, (expression, sort_dir, value) in enumerate(terms):
+            after = (expression > value if sort_dir == 'asc'
+                     else expression < value)
+            criteria.append(sql.and_(*[
+                previous == previous_value
+                for previous, _dir, previous_value in terms[:i]] + [after]))
+        query = query.filter(or_(*criteria))
+    if limit is not None:
+        query = query.limit(limit)
+    return query
+
+
+def _iter_resources(context, model, storage_id, filters, chunk_size):
+    """Stream the volumes or pools of one storage or of all storages."""
+    if storage_id is not None:
+        shard_models = [sharding.model_for(model, storage_id)]
+    else:
+        shard_models = sharding.models_of(model)
+    this_session = get_session(use_slave=_use_replica(context))
+    queries = []
+    for shard_model in shard_models:
+        query = _read_deleted_filter(this_session.query(shard_model),
+                                     context, shard_model)
+        if storage_id is not None:
+            query = query.filter(shard_model.storage_id == storage_id)
+        query = _process_filters(query, shard_model, filters)
+        queries.append(query.order_by(shard_model.id))
+    return _iter_query(this_session, queries, chunk_size)
+
+
+def _iter_query(this_session, queries, chunk_size):
+    """Yield the rows of queries, fetching chunk_size rows at a time.
+
+    yield_per streams the result from the server side cursor instead of
+    buffering it, and rows already handed out are not kept alive by the
+    session, so memory use is bounded by chunk_size. The iteration runs in
+    its own session rather than the one of the request context, as it
+    outlives the call, and the session is closed once the iteration is
+    finished or abandoned.
+    """
+    try:
+        for query in queries:
+            for ref in query.yield_per(chunk_size):
+                yield ref
+    finally:
+        this_session.close()
+
+
+# Volumes and pools are identified by their name within a storage, deleted
+# rows keep their id in the deleted column to leave the name free.
+_NATURAL_KEY = ('storage_id', 'name', 'deleted')
+
+# Columns which are bookkeeping rather than collected resource data.
+_NON_CONTENT_COLUMNS = frozenset(['id', 'storage_id', 'created_at',
+                                  'updated_at', 'deleted_at', 'deleted',
+                                  'content_hash'])
+
+
+def _content_hash(values):
+    """Return a digest of the collected attributes of a resource."""
+    content = dict((key, value) for key, value in values.items()
+                   if key not in _NON_CONTENT_COLUMNS)
+    serialized = jsonutils.dumps(content, sort_keys=True,
+                                 default=six.text_type)
+    return hashlib.sha256(serialized.encode('utf-8')).hexdigest()
+
+
+def _resource_sync(context, model, values_list, storage_id, defer=None):
+    """Diff collected resources of a storage against the stored ones.
+
+    The stored side is read as (id, name, content_hash) only. Resources
+    with an unknown name are inserted, resources whose content hash
+    changed are updated and stored resources which were not collected
+    any more are soft deleted. Unchanged rows are not touched at all.
+    For volumes the capacity summaries are adjusted by the same changes.
+
+    :param defer: callable(resource_id, values) the updates of changed
+        resources are handed to instead of being written here, e.g. to
+        queue them in the write-behind buffer, which adjusts the
+        summaries once it writes them.
+
+    :returns: a dict with the number of added, updated, deleted and
+        unchanged resources.
+    """
+    is_volume = model is Volume
+    model = sharding.model_for(model, storage_id)
+    collected = dict((values['name'], values) for values in values_list)
+    now = timeutils.utcnow()
+    chunk_size = CONF.db_bulk_upsert_batch_size
+    this_session = context.session
+    stored = dict(
+        (name, (resource_id, content_hash))
+        for resource_id, name, content_hash in this_session.query(
+            model.id, model.name, model.content_hash)
+        .filter(model.storage_id == storage_id)
+        .filter(model.deleted == 0))
+
+    new_rows = []
+    changed_rows = []
+    for name, values in collected.items():
+        row = dict(values, storage_id=storage_id,
+                   content_hash=_content_hash(values))
+        if name not in stored:
+            row.update(created_at=now, deleted=0)
+            new_rows.append(row)
+        elif stored[name][1] != row['content_hash']:
+            row.update(id=stored[name][0], updated_at=now)
+            changed_rows.append(row)
+    vanished_ids = [resource_id for name, (resource_id, _hash)
+                    in stored.items() if name not in collected]
+    updated = len(changed_rows)
+    if defer is not None:
+        for row in changed_rows:
+            defer(row['id'], row)
+        changed_rows = []
+    if is_volume:
+        _volume_summary_sync(this_session, storage_id, new_rows,
+                             changed_rows, vanished_ids)
+
+    for chunk in _chunks(new_rows, chunk_size):
+        this_session.bulk_insert_mappings(model, chunk)
+    for chunk in _chunks(changed_rows, chunk_size):
+        this_session.bulk_update_mappings(model, chunk)
+    for chunk in _chunks(vanished_ids, chunk_size):
+        this_session.query(model) \
+            .filter(model.id.in_(chunk)) \
+            .update({model.deleted: model.id, model.deleted_at: now},
+                    synchronize_session=False)
+
+    return {'added': len(new_rows),
+            'updated': updated,
+            'deleted': len(vanished_ids),
+            'unchanged': len(collected) - len(new_rows) - updated}
+
+
+def _mysql_upsert(table, rows, key_columns, update_columns):
+    stmt = mysql.insert(table).values(rows)
+    return stmt.on_duplicate_key_update(
+        dict((column, stmt.inserted[column]) for column in update_columns))
+
+
+def _postgresql_upsert(table, rows, key_columns, update_columns):
+    stmt = postgresql.insert(table).values(rows)
+    return stmt.on_conflict_do_update(
+        index_elements=key_columns,
+        set_=dict((column, stmt.excluded[column])
+                  for column in update_columns))
+
+
+# Dialects able to upsert a whole chunk with one multi-row
+# INSERT ... ON CONFLICT / ON DUPLICATE KEY statement.
+_UPSERT_STATEMENTS = {
+    'mysql': _mysql_upsert,
+    'postgresql': _postgresql_upsert,
+}
+
+
+def _chunks(rows, size):
+    for i in range(0, len(rows), size):
+        yield rows[i:i + size]
+
+
+def _bulk_upsert(context, model, values_list, key_columns):
+    """Write a batch of rows of model in the transaction of context.
+
+    Every row is matched on key_columns: rows that already exist are
+    updated, the others are inserted. Of several rows of the batch with
+    the same key, the last one is written. All dicts of one batch are
+    expected to carry the same keys, a missing key is written as NULL.
+
+    :returns: the number of rows written.
+    """
+    if not values_list:
+        return 0
+    table = model.__table__
+    columns = set()
+    for values in values_list:
+        columns.update(key for key in values if key in table.columns)
+    key_columns = list(key_columns)
+    update_columns = sorted(columns - set(key_columns) -
+                            set(['id', 'created_at']))
+    now = timeutils.utcnow()
+    rows_by_key = collections.OrderedDict()
+    for values in values_list:
+        row = dict((column, values.get(column)) for column in columns)
+        row.setdefault('created_at', now)
+        row['updated_at'] = now
+        rows_by_key[tuple(row[column] for column in key_columns)] = row
+    rows = list(rows_by_key.values())
+    update_columns.append('updated_at')
+
+    chunk_size = CONF.db_bulk_upsert_batch_size
+    this_session = context.session
+    upsert = _UPSERT_STATEMENTS.get(this_session.bind.dialect.name)
+    for chunk in _chunks(rows, chunk_size):
+        if upsert:
+            this_session.execute(
+                upsert(table, chunk, key_columns, update_columns))
+        else:
+            _generic_upsert(this_session, model, chunk, key_columns)
+    return len(rows)
+
+
+def _generic_upsert(this_session, model, rows, key_columns):
+    """Upsert for dialects without a native statement, e.g. SQLite.
+
+    Looks up the ids of the already existing rows with one query, then
+    issues one executemany INSERT and one executemany UPDATE.
+    """
+    key_attrs = [getattr(model, column) for column in key_columns]
+    keys = [tuple(row[column] for column in key_columns) for row in rows]
+    if len(key_attrs) == 1:
+        criterion = key_attrs[0].in_([key[0] for key in keys])
+    else:
+        criterion = tuple_(*key_attrs).in_(keys)
+    existing = dict(
+        (tuple(result[1:]), result[0]) for result in
+        this_session.query(model.id, *key_attrs).filter(criterion))
+
+    new_rows = []
+    updated_rows = []
+    for key, row in zip(keys, rows):
+        if key in existing:
+            row = dict(row, id=existing[key])
+            row.pop('created_at', None)
+            updated_rows.append(row)
+        else:
+            new_rows.append(row)
+    if new_rows:
+        this_session.bulk_insert_mappings(model, new_rows)
+    if updated_rows:
+        this_session.bulk_update_mappings(model, updated_rows)
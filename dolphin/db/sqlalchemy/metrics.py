@@ -0,0 +1,255 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Connection pool and statement metrics of the database engines.
+
+Every engine created by the enginefacade is instrumented through
+SQLAlchemy pool and connection events: connection checkouts with the
+time spent waiting for them, pool overflow, checkout timeouts,
+invalidated connections and statements slower than
+db_slow_statement_threshold grouped by their SQL fingerprint.
+"""
+
+import os
+import re
+import threading
+import time
+
+from oslo_config import cfg
+from oslo_log import log
+from oslo_service import loopingcall
+from sqlalchemy import event
+from sqlalchemy import exc as sqla_exc
+
+CONF = cfg.CONF
+LOG = log.getLogger(__name__)
+
+# Slow statement fingerprints kept per engine, statements with a new
+# fingerprint beyond that are only counted.
+MAX_FINGERPRINTS = 100
+
+_STRING_LITERALS = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERALS = re.compile(r'\b\d+(?:\.\d+)?\b')
+_PLACEHOLDER_LISTS = re.compile(
+    r'\(\s*(?:\?|%s|%\(\w+\)s|:\w+)(?:\s*,\s*(?:\?|%s|%\(\w+\)s|:\w+))*\s*\)')
+_REPEATED_LISTS = re.compile(r'\(\.\.\.\)(?:\s*,\s*\(\.\.\.\))+')
+_WHITESPACE = re.compile(r'\s+')
+
+
+def fingerprint(statement):
+    """Reduce a SQL statement to its shape.
+
+    Literals become ?, placeholder lists such as IN (?, ?, ?) or the rows
+    of a multi-row VALUES become (...), so that statements differing only
+    in their parameters share one fingerprint.
+    """
+    statement = _WHITESPACE.sub(' ', statement).strip()
+    statement = _STRING_LITERALS.sub('?', statement)
+    statement = _NUMBER_LITERALS.sub('?', statement)
+    statement = _PLACEHOLDER_LISTS.sub('(...)', statement)
+    return _REPEATED_LISTS.sub('(...)', statement)
+
+
+class EngineMetrics(object):
+    """Counters of one engine, updated from SQLAlchemy events."""
+
+    def __init__(self, name, engine):
+        self.name = name
+        self.engine = engine
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.checkout_wait = 0.0
+        self.checkout_wait_max = 0.0
+        self.checkout_timeouts = 0
+        self.overflow_max = 0
+        self.connects = 0
+        self.invalidations = 0
+        self.statements = 0
+        self.slow_statements = 0
+        self.fingerprints = {}
+
+    def instrument(self):
+        pool = self.engine.pool
+        self._wrap_pool_connect(pool)
+        event.listen(pool, 'connect', self._on_connect)
+        event.listen(pool, 'invalidate', self._on_invalidate)
+        event.listen(pool, 'soft_invalidate', self._on_invalidate)
+        event.listen(self.engine, 'engine_disposed', self._on_disposed)
+        event.listen(self.engine, 'before_cursor_execute',
+                     self._before_execute)
+        event.listen(self.engine, 'after_cursor_execute',
+                     self._after_execute)
+        event.listen(self.engine, 'handle_error', self._on_error)
+
+    def _wrap_pool_connect(self, pool):
+        # There is no event for a checkout request, so the time until the
+        # connection is handed out is measured around the pool methods
+        # the engine checks connections out with.
+        for method in ('connect', 'unique_connection'):
+            if hasattr(pool, method):
+                setattr(pool, method,
+                        self._timed_checkout(pool, getattr(pool, method)))
+
+    def _timed_checkout(self, pool, checkout):
+        def timed_checkout(*args, **kwargs):
+            start = time.time()
+            try:
+                connection = checkout(*args, **kwargs)
+            except sqla_exc.TimeoutError:
+                with self._lock:
+                    self.checkout_timeouts += 1
+                raise
+            self._on_checkout(pool, time.time() - start)
+            return connection
+        return timed_checkout
+
+    def _on_disposed(self, engine):
+        # dispose() replaces the pool of the engine, the new pool keeps
+        # the event listeners but not the wrapped connect().
+        self._wrap_pool_connect(engine.pool)
+
+    def _on_checkout(self, pool, wait):
+        _ensure_log_timer()
+        overflow = pool.overflow() if hasattr(pool, 'overflow') else 0
+        with self._lock:
+            self.checkouts += 1
+            self.checkout_wait += wait
+            self.checkout_wait_max = max(self.checkout_wait_max, wait)
+            self.overflow_max = max(self.overflow_max, overflow)
+
+    def _on_connect(self, dbapi_connection, connection_record):
+        with self._lock:
+            self.connects += 1
+
+    def _on_invalidate(self, dbapi_connection, connection_record,
+                       exception):
+        with self._lock:
+            self.invalidations += 1
+
+    def _before_execute(self, conn, cursor, statement, parameters, context,
+                        executemany):
+        conn.info.setdefault('query_start', []).append(time.time())
+
+    def _after_execute(self, conn, cursor, statement, parameters, context,
+                       executemany):
+        elapsed = time.time() - conn.info['query_start'].pop()
+        with self._lock:
+            self.statements += 1
+        threshold = CONF.db_slow_statement_threshold
+        if threshold > 0 and elapsed >= threshold:
+            self._record_slow(statement, elapsed)
+
+    def _on_error(self, exception_context):
+        starts = exception_context.connection is not None and \
+            exception_context.connection.info.get('query_start')
+        if starts:
+            starts.pop()
+
+    def _record_slow(self, statement, elapsed):
+        key = fingerprint(statement)
+        with self._lock:
+            self.slow_statements += 1
+            stats = self.fingerprints.get(key)
+            if stats is None:
+                if len(self.fingerprints) >= MAX_FINGERPRINTS:
+                    return
+                stats = self.fingerprints[key] = {'count': 0, 'time': 0.0,
+                                                  'max_time': 0.0}
+            stats['count'] += 1
+            stats['time'] += elapsed
+            stats['max_time'] = max(stats['max_time'], elapsed)
+
+    def stats(self):
+        """Return the counters and the current pool state as a dict."""
+        pool = self.engine.pool
+        with self._lock:
+            slowest = sorted(self.fingerprints.items(),
+                             key=lambda item: item[1]['time'], reverse=True)
+            result = {
+                'name': self.name,
+                'pool_class': type(pool).__name__,
+                'checkouts': self.checkouts,
+                'checkout_wait_avg': (self.checkout_wait / self.checkouts
+                                      if self.checkouts else 0.0),
+                'checkout_wait_max': self.checkout_wait_max,
+                'checkout_timeouts': self.checkout_timeouts,
+                'overflow_max': self.overflow_max,
+                'connects': self.connects,
+                'invalidations': self.invalidations,
+                'statements': self.statements,
+                'slow_statements': self.slow_statements,
+                'slow_fingerprints': [dict(stats, fingerprint=key)
+                                      for key, stats in slowest],
+            }
+        for gauge in ('size', 'checkedin', 'checkedout', 'overflow'):
+            if hasattr(pool, gauge):
+                result['pool_%s' % gauge] = getattr(pool, gauge)()
+        return result
+
+
+_ENGINES = []
+_ENGINES_LOCK = threading.Lock()
+# Log timers by process id. Engines created before the service forks
+# its workers are shared with them, the timer of the parent is not.
+_LOG_TIMERS = {}
+
+
+def instrument_engine(engine):
+    """Attach EngineMetrics to an engine created by the enginefacade.
+
+    The facade creates the engine of [database]/connection first and the
+    one of slave_connection, if any, second.
+    """
+    with _ENGINES_LOCK:
+        name = 'replica' if _ENGINES else 'primary'
+        metrics = EngineMetrics(name, engine)
+        metrics.instrument()
+        _ENGINES.append(metrics)
+
+
+def _ensure_log_timer():
+    pid = os.getpid()
+    if pid in _LOG_TIMERS or CONF.db_metrics_log_interval <= 0:
+        return
+    with _ENGINES_LOCK:
+        if pid not in _LOG_TIMERS:
+            timer = loopingcall.FixedIntervalLoopingCall(log_stats)
+            timer.start(interval=CONF.db_metrics_log_interval,
+                        initial_delay=CONF.db_metrics_log_interval)
+            _LOG_TIMERS[pid] = timer
+
+
+def engine_stats():
+    """Return the stats of all instrumented engines."""
+    return [metrics.stats() for metrics in _ENGINES]
+
+
+def log_stats():
+    try:
+        _log_stats()
+    except Exception:
+        # Keep the timer running.
+        LOG.exception("Failed to log database engine stats.")
+
+
+def _log_stats():
+    for stats in engine_stats():
+        LOG.info("Database engine %(name)s: %(checkouts)s checkouts, "
+                 "wait avg %(checkout_wait_avg).4fs max "
+                 "%(checkout_wait_max).4fs, %(checkout_timeouts)s timeouts, "
+                 "overflow max %(overflow_max)s, %(invalidations)s "
+                 "invalidations, %(slow_statements)s of %(statements)s "
+                 "statements slow.", stats)
+        for slow in stats['slow_fingerprints'][:5]:
+            LOG.info("Database engine %(name)s slow statement: %(count)s "
+                     "times, %(time).3fs total, %(max_time).3fs max: "
+                     "%(fingerprint)s", dict(slow, name=stats['name']))
@@ -23,12 +23,22 @@ import json
 from oslo_config import cfg
 from oslo_db.sqlalchemy import models
 from oslo_db.sqlalchemy.types import JsonEncodedDict
-from sqlalchemy import Column, Integer, String, Numeric
+from oslo_utils import timeutils
+from sqlalchemy import BigInteger, Column, DateTime, Integer, String
+from sqlalchemy import Index, schema, text
 from sqlalchemy.ext.declarative import declarative_base
 
 CONF = cfg.CONF
 BASE = declarative_base()
 
+# Indexes serving the queries of live rows only leave the tombstones out
+# where the database supports partial indexes, the tombstone indexes
+# hold nothing else. MySQL ignores the condition and indexes every row.
+_LIVE_ROWS = {'postgresql_where': text('deleted = 0'),
+              'sqlite_where': text('deleted = 0')}
+_TOMBSTONES = {'postgresql_where': text('deleted != 0'),
+               'sqlite_where': text('deleted != 0')}
+
 
 class DolphinBase(models.ModelBase,
                   models.TimestampMixin):
@@ -49,10 +59,14 @@ class RegistryContext(BASE, DolphinBase):
     extra_attributes = Column(JsonEncodedDict)
 
 
-class Storage(BASE, DolphinBase):
+class Storage(BASE, DolphinBase, models.SoftDeleteMixin):
     """Represents a storage object."""
 
     __tablename__ = 'storages'
+    __table_args__ = (
+        Index('storages_deleted_at_idx', 'deleted_at', **_TOMBSTONES),
+        {'mysql_engine': 'InnoDB'},
+    )
     id = Column(String(36), primary_key=True)
     name = Column(String(255))
     vendor = Column(String(255))
@@ -61,34 +75,124 @@ class Storage(BASE, DolphinBase):
     status = Column(String(255))
     serial_number = Column(String(255))
     location = Column(String(255))
-    total_capacity = Column(Numeric)
-    used_capacity = Column(Numeric)
-    free_capacity = Column(Numeric)
+    total_capacity = Column(BigInteger)
+    used_capacity = Column(BigInteger)
+    free_capacity = Column(BigInteger)
 
+    def soft_delete(self, session):
+        # The id is not an integer, 1 marks the row as deleted instead.
+        self.deleted = 1
+        self.deleted_at = timeutils.utcnow()
+        self.save(session=session)
 
 
-class Volume(BASE, DolphinBase):
+class Volume(BASE, DolphinBase, models.SoftDeleteMixin):
     """Represents a volume object."""
     __tablename__ = 'volumes'
+    __table_args__ = (
+        schema.UniqueConstraint('storage_id', 'name', 'deleted',
+                                name='uniq_volumes0storage_id0name0deleted'),
+        Index('volumes_storage_id_idx', 'storage_id', **_LIVE_ROWS),
+        Index('volumes_storage_id_pool_id_idx', 'storage_id', 'pool_id',
+              **_LIVE_ROWS),
+        Index('volumes_deleted_at_idx', 'deleted_at', **_TOMBSTONES),
+        {'mysql_engine': 'InnoDB'},
+    )
     id = Column(Integer, primary_key=True)
     name = Column(String(255))
     storage_id = Column(String(255))
     pool_id = Column(String(255))
     description = Column(String(255))
     status = Column(String(255))
-    total_capacity = Column(Numeric)
-    used_capacity = Column(Numeric)
-    free_capacity = Column(Numeric)
+    total_capacity = Column(BigInteger)
+    used_capacity = Column(BigInteger)
+    free_capacity = Column(BigInteger)
+    content_hash = Column(String(64))
 
 
-class Pool(BASE, DolphinBase):
+class Pool(BASE, DolphinBase, models.SoftDeleteMixin):
     """Represents a pool object."""
     __tablename__ = 'pools'
+    __table_args__ = (
+        schema.UniqueConstraint('storage_id', 'name', 'deleted',
+                                name='uniq_pools0storage_id0name0deleted'),
+        Index('pools_storage_id_idx', 'storage_id', **_LIVE_ROWS),
+        Index('pools_deleted_at_idx', 'deleted_at', **_TOMBSTONES),
+        {'mysql_engine': 'InnoDB'},
+    )
     id = Column(Integer, primary_key=True)
     name = Column(String(255))
     storage_id = Column(String(255))
     description = Column(String(255))
     status = Column(String(255))
-    total_capacity = Column(Numeric)
-    used_capacity = Column(Numeric)
-    free_capacity = Column(Numeric)
+    total_capacity = Column(BigInteger)
+    used_capacity = Column(BigInteger)
+    free_capacity = Column(BigInteger)
+    content_hash = Column(String(64))
+
+
+class CapacitySample(BASE, models.ModelBase):
+    """Represents a capacity sample of a storage, pool or volume.
+
+    Raw samples have a resolution of 0, rollups hold the average of the
+    raw samples of their resolution long bucket, which starts at
+    sampled_at (seconds since the epoch).
+    """
+    __tablename__ = 'capacity_samples'
+    __table_args__ = (
+        # For the rollup and the purge, which scan one resolution by time.
+        Index('capacity_samples_resolution_idx', 'resolution', 'sampled_at'),
+        {'mysql_engine': 'InnoDB'},
+    )
+    resource_type = Column(String(36), primary_key=True)
+    resource_id = Column(String(255), primary_key=True)
+    resolution = Column(Integer, primary_key=True, autoincrement=False)
+    sampled_at = Column(BigInteger, primary_key=True, autoincrement=False)
+    storage_id = Column(String(36))
+    total_capacity = Column(BigInteger)
+    used_capacity = Column(BigInteger)
+    free_capacity = Column(BigInteger)
+    max_used_capacity = Column(BigInteger)
+    sample_count = Column(Integer)
+
+
+class CapacitySummary(BASE, models.ModelBase):
+    """Represents the volume capacity totals of one pool of a storage.
+
+    The totals are maintained by the volume write paths, so per storage
+    and per pool capacity is read without aggregating the volumes table.
+    Volumes without a pool are summed up under an empty pool_id.
+    """
+    __tablename__ = 'capacity_summaries'
+    __table_args__ = {'mysql_engine': 'InnoDB'}
+    storage_id = Column(String(36), primary_key=True)
+    pool_id = Column(String(255), primary_key=True)
+    volume_count = Column(Integer, nullable=False, default=0)
+    total_capacity = Column(BigInteger, nullable=False, default=0)
+    used_capacity = Column(BigInteger, nullable=False, default=0)
+    free_capacity = Column(BigInteger, nullable=False, default=0)
+
+
+class CollectionJob(BASE, DolphinBase):
+    """Represents a queued collection of one resource type of a storage.
+
+    There is at most one job per storage and resource type. node is the
+    task manager which queued the job and works it off, a job is held by
+    leased_by until lease_expires_at and returns to the queue if it is
+    not completed by then.
+    """
+    __tablename__ = 'collection_jobs'
+    __table_args__ = (
+        schema.UniqueConstraint(
+            'storage_id', 'resource_type',
+            name='uniq_collection_jobs0storage_id0resource_type'),
+        Index('collection_jobs_node_idx', 'node', 'created_at'),
+        {'mysql_engine': 'InnoDB'},
+    )
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    storage_id = Column(String(36), nullable=False)
+    resource_type = Column(String(36), nullable=False)
+    node = Column(String(255))
+    leased_by = Column(String(255))
+    lease_expires_at = Column(DateTime)
+    attempts = Column(Integer, nullable=False, default=0)
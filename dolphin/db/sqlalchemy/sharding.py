@@ -0,0 +1,357 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Hash partitioning of the volumes and pools tables by storage_id.
+
+With db_inventory_shards above 1 the rows of volumes and pools are
+spread over that many partitions by their storage_id:
+
+* MySQL and PostgreSQL partition the tables natively, the tables keep
+  their name and queries are routed by the database.
+* Other databases, i.e. SQLite, get one physical table per shard, named
+  <table>_p<n>, each mapped to a model class of its own. Callers resolve
+  the model of a storage with :func:`model_for` or, for queries across
+  all storages, iterate over :func:`models_of`.
+
+Each shard table starts its ids at n << 40, so ids stay unique across
+the shards as they are with a single table.
+
+The partitioning is changed by ``dolphin-manage db reshard`` only, which
+locks the tables while they are rebuilt and has to run while the
+services are stopped. On start the services merely check that it
+matches db_inventory_shards and refuse to start otherwise.
+
+The migrations only know the volumes and pools tables. Natively
+partitioned tables pass schema changes on to their partitions, but the
+shard tables of other databases do not, so a migration changing volumes
+or pools has to apply the change to each table returned by
+:func:`physical_tables`. Autogenerated migrations leave the shard tables
+alone, see :func:`is_shard_table`.
+"""
+
+import re
+import threading
+import zlib
+
+from oslo_config import cfg
+from oslo_log import log
+from oslo_db.sqlalchemy import models
+from sqlalchemy.engine import url as sa_url
+from sqlalchemy import inspect, MetaData, orm, schema, sql
+
+from dolphin import exception
+from dolphin.i18n import _
+from dolphin.db.sqlalchemy.models import DolphinBase, Pool, Volume
+
+CONF = cfg.CONF
+LOG = log.getLogger(__name__)
+
+SHARDED_MODELS = (Volume, Pool)
+NATIVE_DIALECTS = ('mysql', 'postgresql')
+SHARD_ID_BITS = 40
+
+# Shard tables are kept out of models.BASE.metadata, which describes the
+# schema the migrations maintain.
+_METADATA = MetaData()
+_SHARDS = {}
+_LOCK = threading.Lock()
+
+
+def shard_count():
+    return CONF.db_inventory_shards
+
+
+def shard_of(storage_id):
+    """Return the shard index of a storage, stable across processes."""
+    return zlib.crc32(storage_id.encode('utf-8')) % shard_count()
+
+
+def shard_table_name(table_name, index):
+    return '%s_p%d' % (table_name, index)
+
+
+_SHARD_TABLE_RE = re.compile(r'^(%s)_p\d+$' % '|'.join(
+    model.__tablename__ for model in SHARDED_MODELS))
+
+
+def is_shard_table(name):
+    """Whether name is the one of a shard table or native partition."""
+    return bool(_SHARD_TABLE_RE.match(name))
+
+
+def physical_tables(connection, table_name):
+    """Return the tables holding the rows of volumes or pools.
+
+    For use by migrations, that is table_name itself and, on databases
+    without native partitioning, its shard tables.
+    """
+    if connection.dialect.name in NATIVE_DIALECTS:
+        return [table_name]
+    tables = set(inspect(connection).get_table_names())
+    return [table_name] + sorted(
+        name for name in tables
+        if is_shard_table(name) and name.rpartition('_p')[0] == table_name)
+
+
+def _dialect_name():
+    return sa_url.make_url(CONF.database.connection).get_backend_name()
+
+
+def uses_shard_tables():
+    """Whether the inventory is split into shard tables by dolphin.
+
+    That is the case when sharding is enabled and the database does not
+    partition the tables itself.
+    """
+    return shard_count() > 1 and _dialect_name() not in NATIVE_DIALECTS
+
+
+def _shard_models(model):
+    if model not in _SHARDS:
+        with _LOCK:
+            if model not in _SHARDS:
+                _SHARDS[model] = [_make_shard_model(model, index)
+                                  for index in range(shard_count())]
+    return _SHARDS[model]
+
+
+def _make_shard_model(model, index):
+    base_name = model.__tablename__
+    name = shard_table_name(base_name, index)
+    table = model.__table__.tometadata(_METADATA, name=name)
+    table.dialect_options['sqlite']['autoincrement'] = True
+    for item in list(table.indexes) + list(table.constraints):
+        if item.name:
+            item.name = item.name.replace(base_name, name, 1)
+    cls = type('%sShard%d' % (model.__name__, index),
+               (DolphinBase, models.SoftDeleteMixin),
+               {'__table__': table, '__tablename__': name})
+    cls.__mapper__ = orm.mapper(cls, table)
+    return cls
+
+
+def model_for(model, storage_id):
+    """Return the model holding the rows of storage_id."""
+    if model not in SHARDED_MODELS or not uses_shard_tables():
+        return model
+    return _shard_models(model)[shard_of(storage_id)]
+
+
+def models_of(model):
+    """Return the models holding the rows of all storages."""
+    if model not in SHARDED_MODELS or not uses_shard_tables():
+        return [model]
+    return _shard_models(model)
+
+
+def check_shards(engine):
+    """Check the partitioning of the inventory tables against config.
+
+    Called by register_db on service start, which does not repartition.
+
+    :raises InvalidInput: if a table is split into another number of
+        partitions than db_inventory_shards.
+    """
+    with engine.connect() as conn:
+        for model in SHARDED_MODELS:
+            if engine.dialect.name in NATIVE_DIALECTS:
+                found = _native_partitions(conn, model.__tablename__)
+            else:
+                found = _shard_table_count(conn, model)
+            if (found or 1) != shard_count():
+                msg = _("Table %(table)s is split into %(found)s "
+                        "partitions, but db_inventory_shards is %(count)s. "
+                        "Run dolphin-manage db reshard while the services "
+                        "are stopped.") % {'table': model.__tablename__,
+                                           'found': found or 1,
+                                           'count': shard_count()}
+                raise exception.InvalidInput(reason=msg)
+
+
+def reshard(engine):
+    """Bring the partitioning of the inventory tables in line with config.
+
+    Rebuilds the tables, holding their locks meanwhile, only run it while
+    the services are stopped.
+    """
+    if engine.dialect.name == 'mysql':
+        for model in SHARDED_MODELS:
+            _mysql_partition(engine, model.__table__)
+    elif engine.dialect.name == 'postgresql':
+        for model in SHARDED_MODELS:
+            _postgresql_partition(engine, model.__table__)
+    else:
+        _check_shard_tables(engine)
+        if uses_shard_tables():
+            for model in SHARDED_MODELS:
+                _create_shard_tables(engine, model)
+
+
+def _shard_table_count(conn, model):
+    tables = set(inspect(conn).get_table_names())
+    index = 0
+    while shard_table_name(model.__tablename__, index) in tables:
+        index += 1
+    return index
+
+
+def _native_partitions(conn, table_name):
+    if conn.dialect.name == 'mysql':
+        return conn.execute(sql.text(
+            "SELECT COUNT(*) FROM information_schema.partitions "
+            "WHERE table_schema = DATABASE() AND table_name = :table "
+            "AND partition_name IS NOT NULL"), table=table_name).scalar()
+    return conn.execute(sql.text(
+        "SELECT COUNT(*) FROM pg_inherits "
+        "WHERE inhparent = CAST(:table AS regclass)"),
+        table=table_name).scalar()
+
+
+def _check_shard_tables(engine):
+    for model in SHARDED_MODELS:
+        with engine.connect() as conn:
+            index = _shard_table_count(conn, model)
+        if index and index != shard_count():
+            msg = _("Table %(table)s is split into %(found)s shards, but "
+                    "db_inventory_shards is %(count)s. Changing the number "
+                    "of shard tables is not supported.") % {
+                'table': model.__tablename__, 'found': index,
+                'count': shard_count()}
+            raise exception.InvalidInput(reason=msg)
+
+
+def _create_shard_tables(engine, model):
+    base_table = model.__table__
+    shards = _shard_models(model)
+    with engine.begin() as conn:
+        existing = set(inspect(conn).get_table_names())
+        start = conn.execute(
+            sql.select([sql.func.max(base_table.c.id)])).scalar() or 0
+        for index, shard in enumerate(shards):
+            table = shard.__table__
+            if table.name in existing:
+                continue
+            table.create(conn)
+            if engine.dialect.name != 'sqlite':
+                continue
+            # Place the ids of each shard in a range of their own, after
+            # the ones the rows moved over from the single table keep.
+            conn.execute(sql.text(
+                "INSERT INTO sqlite_sequence (name, seq) VALUES "
+                "(:name, :seq)"),
+                name=table.name, seq=(index << SHARD_ID_BITS) + start)
+        _move_rows(conn, base_table)
+
+
+def _move_rows(conn, base_table):
+    """Move the rows of the single table into their shard tables."""
+    columns = [column.name for column in base_table.columns]
+    moved = 0
+    while True:
+        rows = conn.execute(
+            base_table.select().order_by(base_table.c.id)
+            .limit(CONF.db_bulk_upsert_batch_size)).fetchall()
+        if not rows:
+            break
+        by_shard = {}
+        for row in rows:
+            values = dict(zip(columns, row))
+            by_shard.setdefault(shard_of(values['storage_id'] or ''),
+                                []).append(values)
+        for index, values in by_shard.items():
+            table = _METADATA.tables[
+                shard_table_name(base_table.name, index)]
+            conn.execute(table.insert(), values)
+        conn.execute(base_table.delete().where(
+            base_table.c.id.in_([row['id'] for row in rows])))
+        moved += len(rows)
+    if moved:
+        LOG.info("Moved %(moved)s rows of %(table)s into its shard tables.",
+                 {'moved': moved, 'table': base_table.name})
+
+
+def _mysql_partition(engine, table):
+    with engine.begin() as conn:
+        partitions = _native_partitions(conn, table.name)
+        count = shard_count()
+        if partitions == count or (not partitions and count == 1):
+            return
+        LOG.warning("Repartitioning table %(table)s from %(old)s into "
+                    "%(new)s partitions.",
+                    {'table': table.name, 'old': partitions or 1,
+                     'new': count})
+        if count == 1:
+            conn.execute("ALTER TABLE %s REMOVE PARTITIONING" % table.name)
+        elif not partitions:
+            # Every unique key of a partitioned table has to contain the
+            # partitioning column.
+            conn.execute(
+                "ALTER TABLE %s MODIFY storage_id VARCHAR(255) NOT NULL, "
+                "DROP PRIMARY KEY, ADD PRIMARY KEY (id, storage_id)"
+                % table.name)
+            conn.execute("ALTER TABLE %s PARTITION BY KEY (storage_id) "
+                         "PARTITIONS %d" % (table.name, count))
+        elif count > partitions:
+            conn.execute("ALTER TABLE %s ADD PARTITION PARTITIONS %d"
+                         % (table.name, count - partitions))
+        else:
+            conn.execute("ALTER TABLE %s COALESCE PARTITION %d"
+                         % (table.name, partitions - count))
+
+
+def _postgresql_partition(engine, table):
+    name = table.name
+    with engine.begin() as conn:
+        partitions = _native_partitions(conn, name)
+        count = shard_count()
+        if partitions == count or (not partitions and count == 1):
+            return
+        LOG.warning("Repartitioning table %(table)s from %(old)s into "
+                    "%(new)s partitions.",
+                    {'table': name, 'old': partitions or 1, 'new': count})
+        # Hash partitions can not be split or merged, the table is
+        # rebuilt as a partitioned one in this transaction. The id
+        # sequence is detached meanwhile so it survives the old table.
+        sequence = conn.execute(sql.text(
+            "SELECT pg_get_serial_sequence(:table, 'id')"),
+            table=name).scalar()
+        conn.execute("ALTER SEQUENCE %s OWNED BY NONE" % sequence)
+        conn.execute("CREATE TABLE %(name)s_new (LIKE %(name)s "
+                     "INCLUDING DEFAULTS INCLUDING CONSTRAINTS) "
+                     "PARTITION BY HASH (storage_id)" % {'name': name})
+        for index in range(count):
+            conn.execute("CREATE TABLE %s PARTITION OF %s_new FOR VALUES "
+                         "WITH (MODULUS %d, REMAINDER %d)"
+                         % (shard_table_name(name + '_new', index), name,
+                            count, index))
+        conn.execute("INSERT INTO %(name)s_new SELECT * FROM %(name)s"
+                     % {'name': name})
+        conn.execute("DROP TABLE %s" % name)
+        conn.execute("ALTER TABLE %(name)s_new RENAME TO %(name)s"
+                     % {'name': name})
+        for index in range(count):
+            conn.execute("ALTER TABLE %s RENAME TO %s"
+                         % (shard_table_name(name + '_new', index),
+                            shard_table_name(name, index)))
+        conn.execute("ALTER SEQUENCE %s OWNED BY %s.id" % (sequence, name))
+        # The primary key and every unique key of a partitioned table
+        # have to contain the partitioning column.
+        conn.execute("ALTER TABLE %s ADD PRIMARY KEY (id, storage_id)"
+                     % name)
+        for constraint in table.constraints:
+            if isinstance(constraint, schema.UniqueConstraint):
+                conn.execute("ALTER TABLE %s ADD CONSTRAINT %s UNIQUE (%s)"
+                             % (name, constraint.name,
+                                ', '.join(column.name for column
+                                          in constraint.columns)))
+        for index in table.indexes:
+            index.create(conn)
@@ -0,0 +1,142 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Write-behind buffer for frequent updates of single resources.
+
+Status and capacity updates of volumes and pools are collected in memory
+and coalesced per (resource type, id), a later update of a column
+replacing the pending value. The pending updates are written with batched
+UPDATEs in one transaction once db_write_behind_max_rows resources are
+pending, every db_write_behind_interval seconds, and when the service
+stops.
+"""
+
+import os
+import threading
+
+from oslo_config import cfg
+from oslo_log import log
+from oslo_service import loopingcall
+
+from dolphin import context as dolphin_context
+
+CONF = cfg.CONF
+LOG = log.getLogger(__name__)
+
+
+class WriteBehindBuffer(object):
+    """Pending updates by (resource_type, resource_id).
+
+    :param writer: callable(context, resource_type, storage_id, updates)
+        writing updates, a dict of resource id to the dict of its changed
+        columns, of resources of one type and storage.
+    """
+
+    def __init__(self, writer):
+        self._writer = writer
+        self._pending = {}
+        self._lock = threading.Lock()
+        # Serializes flushes, so that an older batch is never written after
+        # a newer one of the same resources.
+        self._flush_lock = threading.Lock()
+        self._timers = {}
+        self.updates = 0
+        self.flushes = 0
+        self.rows_written = 0
+
+    def add(self, resource_type, resource_id, storage_id, values):
+        """Queue an update, flushing right away if the buffer is full.
+
+        With a db_write_behind_interval of 0 the update is written before
+        returning.
+        """
+        key = (resource_type, resource_id)
+        with self._lock:
+            self.updates += 1
+            entry = self._pending.get(key)
+            if entry is None:
+                self._pending[key] = (storage_id, dict(values))
+            else:
+                entry[1].update(values)
+            full = len(self._pending) >= CONF.db_write_behind_max_rows
+        if CONF.db_write_behind_interval <= 0 or full:
+            self.flush()
+        else:
+            self._ensure_timer()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def flush(self, context=None):
+        """Write all pending updates, returns the number of rows written.
+
+        If the write fails, the updates are queued again unless a newer
+        value of the same column has been queued meanwhile, and the error
+        is raised.
+        """
+        context = context or dolphin_context.get_admin_context()
+        with self._flush_lock:
+            with self._lock:
+                pending, self._pending = self._pending, {}
+            if not pending:
+                return 0
+            batches = {}
+            for (resource_type, resource_id), (storage_id, values) in \
+                    pending.items():
+                batches.setdefault((resource_type, storage_id),
+                                   {})[resource_id] = values
+            try:
+                for (resource_type, storage_id), updates in batches.items():
+                    self._writer(context, resource_type, storage_id, updates)
+            except Exception:
+                self._requeue(pending)
+                raise
+            with self._lock:
+                self.flushes += 1
+                self.rows_written += len(pending)
+            return len(pending)
+
+    def _requeue(self, pending):
+        with self._lock:
+            for key, (storage_id, values) in pending.items():
+                entry = self._pending.get(key)
+                if entry is not None:
+                    values = dict(values, **entry[1])
+                self._pending[key] = (storage_id, values)
+
+    def _ensure_timer(self):
+        # Started on first use in each process, a timer of the parent does
+        # not run in forked workers.
+        pid = os.getpid()
+        if pid in self._timers:
+            return
+        with self._lock:
+            if pid not in self._timers:
+                timer = loopingcall.FixedIntervalLoopingCall(
+                    self._periodic_flush)
+                timer.start(interval=CONF.db_write_behind_interval,
+                            initial_delay=CONF.db_write_behind_interval)
+                self._timers[pid] = timer
+
+    def _periodic_flush(self):
+        try:
+            self.flush()
+        except Exception:
+            # Keep the timer running, the updates are retried next time.
+            LOG.exception("Failed to write %s buffered resource updates.",
+                          len(self._pending))
+
+    def stats(self):
+        return {'pending': len(self._pending),
+                'updates': self.updates,
+                'flushes': self.flushes,
+                'rows_written': self.rows_written}
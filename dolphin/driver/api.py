@@ -0,0 +1,89 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Interface of the storage drivers and their loading.
+
+Drivers are registered as stevedore extensions in the
+dolphin.storage.drivers namespace under the vendor name the storage was
+registered with.
+"""
+
+import abc
+import threading
+
+from oslo_log import log
+import six
+from stevedore import driver as stevedore_driver
+
+from dolphin import exception
+from dolphin.driver import throttle
+
+LOG = log.getLogger(__name__)
+
+DRIVER_NAMESPACE = 'dolphin.storage.drivers'
+
+
+@six.add_metaclass(abc.ABCMeta)
+class StorageDriver(object):
+    """Base class of the drivers collecting the resources of a storage.
+
+    A driver is created with the registry credentials of one storage, as
+    returned by db.registry_credentials_get, and reused for each
+    collection of that storage as long as they do not change.
+    """
+
+    def __init__(self, **credentials):
+        self.credentials = credentials
+
+    @abc.abstractmethod
+    def get_storage(self, context):
+        """Return the attributes of the storage as a dict."""
+
+    @abc.abstractmethod
+    def list_pools(self, context):
+        """Return the pools of the storage as a list of dicts."""
+
+    @abc.abstractmethod
+    def list_volumes(self, context):
+        """Return the volumes of the storage as a list of dicts."""
+
+
+_DRIVERS = {}
+_LOCK = threading.Lock()
+
+
+def get_driver(credentials):
+    """Return the driver of the storage credentials belong to.
+
+    The driver is wrapped so that its calls keep to the limits of the
+    storage, see dolphin.driver.throttle.
+
+    :raises StorageDriverNotFound: if no driver is registered for the
+        vendor of the storage.
+    """
+    storage_id = credentials['storage_id']
+    driver = _DRIVERS.get(storage_id)
+    if driver is not None and driver.credentials == credentials:
+        return driver
+    try:
+        manager = stevedore_driver.DriverManager(
+            namespace=DRIVER_NAMESPACE, name=credentials.get('vendor'),
+            invoke_on_load=True, invoke_kwds=credentials)
+    except RuntimeError:
+        # stevedore raises NoMatches, a RuntimeError, for unknown names.
+        raise exception.StorageDriverNotFound(name=credentials.get('vendor'))
+    driver = throttle.ThrottledDriver(manager.driver,
+                                      throttle.limiter_for(credentials))
+    with _LOCK:
+        _DRIVERS[storage_id] = driver
+    return driver
+
@@ -0,0 +1,158 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Per storage limits on the calls made to a driver.
+
+Each storage gets a semaphore bounding its concurrent driver calls and a
+token bucket bounding the rate they start at. The limits come from the
+driver_call_limits entry of the vendor/model or vendor of the storage,
+else from driver_max_concurrent_calls and driver_max_calls_per_second.
+A call waiting for its turn only holds its own green thread, calls to
+other storages go on meanwhile.
+"""
+
+import functools
+import threading
+import time
+
+from oslo_config import cfg
+from oslo_log import log
+
+from dolphin import exception
+from dolphin.i18n import _
+
+LOG = log.getLogger(__name__)
+
+throttle_opts = [
+    cfg.IntOpt('driver_max_concurrent_calls',
+               default=4,
+               min=1,
+               help='Maximum number of driver calls made to one storage at '
+                    'a time.'),
+    cfg.FloatOpt('driver_max_calls_per_second',
+                 default=0,
+                 min=0,
+                 help='Maximum rate of driver calls to one storage, bursts '
+                      'of up to one second worth of calls are allowed. Set '
+                      'to 0 for no limit.'),
+    cfg.DictOpt('driver_call_limits',
+                default={},
+                help='Limits for the storages of a vendor or a vendor and '
+                     'model, as registered in their registry context, in '
+                     'place of driver_max_concurrent_calls and '
+                     'driver_max_calls_per_second. Each value is '
+                     '<concurrent calls>/<calls per second>, either may be '
+                     'left empty, e.g. acme:2/5,acme/x9000:1/0.5'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(throttle_opts)
+
+
+class TokenBucket(object):
+    """Lets calls start at rate per second, in bursts of up to burst.
+
+    Callers arriving when the bucket is empty take a token in advance and
+    sleep until it is due, so they start in their order of arrival.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.burst = burst or max(rate, 1)
+        self._tokens = self.burst
+        self._updated = time.time()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            now = time.time()
+            self._tokens = min(self.burst, self._tokens +
+                               (now - self._updated) * self.rate)
+            self._updated = now
+            self._tokens -= 1
+            wait = -self._tokens / self.rate if self._tokens < 0 else 0
+        if wait:
+            time.sleep(wait)
+
+
+class Limiter(object):
+    """The concurrency and rate limits of the driver calls to a storage."""
+
+    def __init__(self, concurrency, rate):
+        self.concurrency = concurrency
+        self.rate = rate
+        self._semaphore = threading.BoundedSemaphore(concurrency)
+        self._bucket = TokenBucket(rate) if rate > 0 else None
+
+    def __enter__(self):
+        self._semaphore.acquire()
+        if self._bucket is not None:
+            try:
+                self._bucket.acquire()
+            except BaseException:
+                # Timed out while waiting for a token.
+                self._semaphore.release()
+                raise
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self._semaphore.release()
+
+
+def limiter_for(credentials):
+    """Create the limiter of the storage credentials belong to."""
+    concurrency = CONF.driver_max_concurrent_calls
+    rate = CONF.driver_max_calls_per_second
+    vendor = credentials.get('vendor')
+    model = credentials.get('model')
+    keys = ['%s/%s' % (vendor, model), vendor] if model else [vendor]
+    for key in keys:
+        if key in CONF.driver_call_limits:
+            concurrency, rate = _parse_limits(
+                key, CONF.driver_call_limits[key], concurrency, rate)
+            break
+    return Limiter(concurrency, rate)
+
+
+def _parse_limits(key, value, concurrency, rate):
+    try:
+        concurrent_calls, _sep, calls_per_second = value.partition('/')
+        if concurrent_calls.strip():
+            concurrency = int(concurrent_calls)
+        if calls_per_second.strip():
+            rate = float(calls_per_second)
+        if concurrency < 1 or rate < 0:
+            raise ValueError()
+    except ValueError:
+        msg = _("Invalid driver_call_limits entry %(key)s:%(value)s.") % {
+            'key': key, 'value': value}
+        raise exception.InvalidInput(reason=msg)
+    return concurrency, rate
+
+
+class ThrottledDriver(object):
+    """Proxy of a driver running each of its methods under a limiter."""
+
+    def __init__(self, driver, limiter):
+        self._driver = driver
+        self.limiter = limiter
+
+    def __getattr__(self, name):
+        attr = getattr(self._driver, name)
+        if not callable(attr):
+            return attr
+
+        @functools.wraps(attr)
+        def throttled(*args, **kwargs):
+            with self.limiter:
+                return attr(*args, **kwargs)
+        return throttled
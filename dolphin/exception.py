@@ -210,6 +210,18 @@ class MessageNotFound(NotFound):
     message = _("Message %(message_id)s could not be found.")
 
 
+class MarkerNotFound(NotFound):
+    message = _("Marker %(marker)s could not be found.")
+
+
+class StorageNotFound(NotFound):
+    message = _("Storage %(storage_id)s could not be found.")
+
+
+class StorageDriverNotFound(NotFound):
+    message = _("Storage driver %(name)s could not be found.")
+
+
 class Found(DolphinException):
     message = _("Resource was found.")
     code = 302
@@ -260,6 +272,10 @@ class InvalidSqliteDB(Invalid):
     message = _("Invalid Sqlite database.")
 
 
+class LockCreationFailed(DolphinException):
+    message = _('Unable to create lock. Coordination backend not started.')
+
+
 class SSHException(DolphinException):
     message = _("Exception in SSH protocol negotiation or logic.")
 
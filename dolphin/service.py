@@ -31,6 +31,7 @@ from oslo_utils import importutils
 import oslo_messaging as messaging
 
 from dolphin import context
+from dolphin import db
 from dolphin import exception
 from dolphin import rpc
 from dolphin import coordination
@@ -185,6 +186,10 @@ class Service(service.Service):
                 x.stop()
             except Exception:
                 pass
+        try:
+            db.write_behind_flush()
+        except Exception:
+            LOG.exception("Unable to write the buffered database updates.")
         if self.coordinator:
             try:
                 coordination.LOCK_COORDINATOR.stop()
@@ -0,0 +1,633 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Parallel collection of the resources of all storages.
+
+A collection cycle runs every periodic_interval. It walks the registry
+contexts and queues a job in the collection_jobs table for each resource
+type of a storage that is due, then leases the jobs of its node and runs
+each in a green thread of a bounded pool. A slow or hanging array only
+holds its own thread, for at most collection_timeout seconds. Jobs stay
+queued across restarts, a job leased by a node which died is run again
+once its lease expires, and a node whose backlog exceeds
+collection_queue_max_depth stops queuing more. Jobs sent in batches
+through the collect_storages cast are queued the same way.
+
+The storage itself, its pools and its volumes are collected on schedules
+of their own, per storage. In adaptive mode the interval of a resource
+type is stretched after a collection without changes or a failed one,
+reset after one with changes and shortened after one changing many
+resources, so arrays whose data rarely changes are polled less often.
+
+The task managers join the COLLECTOR_GROUP tooz group, a consistent hash
+ring over its members assigns each storage_id to one of them. When a
+member joins or leaves, only the storages it gains or loses move, from
+the next cycle on. A node done with its own jobs steals the jobs other
+nodes left waiting for more than collection_steal_after seconds, so that
+a node owning slow arrays does not hold the collections back while
+others are idle.
+
+Collections are single-flight per storage and resource type: a refresh
+asked for while the same collection runs on this node waits for it and
+gets its outcome, one asked for while it runs on another node waits for
+that node to complete its job. Either way the array is polled once.
+"""
+
+import collections
+import datetime
+import time
+
+import eventlet
+from eventlet import event
+from eventlet import greenpool
+from oslo_config import cfg
+from oslo_db import exception as db_exc
+from oslo_log import log
+from oslo_utils import timeutils
+
+from dolphin import coordination
+from dolphin import db
+from dolphin.driver import api as driver_api
+from dolphin import exception
+from dolphin.i18n import _
+
+LOG = log.getLogger(__name__)
+
+collector_opts = [
+    cfg.IntOpt('storage_collection_interval',
+               default=3600,
+               min=1,
+               help='Seconds between two collections of the attributes of '
+                    'a storage.'),
+    cfg.IntOpt('pool_collection_interval',
+               default=300,
+               min=1,
+               help='Seconds between two collections of the pools of a '
+                    'storage.'),
+    cfg.IntOpt('volume_collection_interval',
+               default=600,
+               min=1,
+               help='Seconds between two collections of the volumes of a '
+                    'storage.'),
+    cfg.BoolOpt('collection_adaptive',
+                default=True,
+                help='Adapt the collection intervals of each storage to '
+                     'the rate its resources change at. An interval is '
+                     'doubled after a collection without changes or a '
+                     'failed one, up to collection_adaptive_max_factor '
+                     'times the configured one. It is reset to the '
+                     'configured one after a collection with changes, and '
+                     'halved after one changing at least '
+                     'collection_volatile_ratio of the resources, down to '
+                     'collection_adaptive_min_factor times the configured '
+                     'one.'),
+    cfg.FloatOpt('collection_adaptive_max_factor',
+                 default=8.0,
+                 min=1.0,
+                 help='Maximum factor a collection interval is stretched '
+                      'by in adaptive mode.'),
+    cfg.FloatOpt('collection_adaptive_min_factor',
+                 default=0.25,
+                 min=0.0,
+                 max=1.0,
+                 help='Minimum factor a collection interval is shortened '
+                      'to in adaptive mode. Intervals are still bounded by '
+                      'periodic_interval.'),
+    cfg.FloatOpt('collection_volatile_ratio',
+                 default=0.05,
+                 min=0.0,
+                 max=1.0,
+                 help='Share of the resources of a type added, updated or '
+                      'deleted by one collection from which the interval '
+                      'of that type is shortened in adaptive mode.'),
+    cfg.IntOpt('collection_queue_max_depth',
+               default=10000,
+               min=1,
+               help='Number of queued collection jobs of a task node above '
+                    'which it stops queuing due jobs until its backlog is '
+                    'worked off. The most overdue jobs are queued first.'),
+    cfg.IntOpt('collection_job_lease_time',
+               default=600,
+               min=1,
+               help='Seconds a task node holds a collection job it runs. '
+                    'A job not completed by then, e.g. because the node '
+                    'died, is run again. Has to exceed '
+                    'collection_timeout.'),
+    cfg.BoolOpt('collection_work_stealing',
+                default=True,
+                help='Let a task node with idle workers run the overdue '
+                     'collection jobs of other nodes.'),
+    cfg.IntOpt('collection_steal_after',
+               default=60,
+               min=0,
+               help='Seconds a collection job has to be queued without '
+                    'being run before another node may steal it.'),
+    cfg.IntOpt('collection_workers',
+               default=32,
+               min=1,
+               help='Maximum number of storages collected concurrently.'),
+    cfg.IntOpt('collection_timeout',
+               default=240,
+               min=1,
+               help='Seconds the driver calls collecting one resource type '
+                    'of a storage may take before the collection of that '
+                    'storage is aborted.'),
+]
+
+CONF = cfg.CONF
+CONF.register_opts(collector_opts)
+CONF.import_opt('periodic_interval', 'dolphin.service')
+
+# Resource types in the order they are collected.
+RESOURCE_TYPES = ('storage', 'pool', 'volume')
+
+# Storages whose registry contexts are read with one query.
+_PAGE_SIZE = 1000
+
+COLLECTOR_GROUP = 'task-collectors'
+# Points per node on the hash ring, more than the tooz default of 32 to
+# spread the storages more evenly over the nodes.
+_RING_PARTITIONS = 256
+
+# Seconds between two checks whether a job run by another node is done.
+_PEER_POLL_INTERVAL = 1
+# Seconds between two checks for a free worker, or for other nodes to be
+# done stealing from the nodes this one would steal from.
+_WORKER_POLL_INTERVAL = 0.1
+
+
+class Schedule(object):
+    """Collection schedule of one resource type of one storage."""
+
+    __slots__ = ('resource_type', 'factor', 'due')
+
+    def __init__(self, resource_type):
+        self.resource_type = resource_type
+        self.factor = 1.0
+        # A storage seen for the first time is collected right away.
+        self.due = 0
+
+    @property
+    def interval(self):
+        return (CONF.get('%s_collection_interval' % self.resource_type) *
+                self.factor)
+
+    def collected(self, change_ratio, now):
+        """Plan the next collection after the one just done.
+
+        :param change_ratio: share of the resources the collection
+            changed, None if it failed.
+        :param now: time the collection ended.
+        """
+        if not CONF.collection_adaptive:
+            self.factor = 1.0
+        elif not change_ratio:
+            # Unchanged, or failed: the array is not polled harder than
+            # its data changes or its state allows.
+            self.factor = min(self.factor * 2,
+                              CONF.collection_adaptive_max_factor)
+        elif change_ratio >= CONF.collection_volatile_ratio:
+            self.factor = max(min(self.factor, 1.0) / 2,
+                              CONF.collection_adaptive_min_factor)
+        else:
+            # Changed again, a stretched interval is reset.
+            self.factor = min(self.factor, 1.0)
+        self.due = now + self.interval
+
+
+class Collector(object):
+    """Runs collection cycles over all registered storages."""
+
+    def __init__(self):
+        self.pool = greenpool.GreenPool(CONF.collection_workers)
+        self.last_cycle = None
+        self._running = False
+        self._partitioner = None
+        # Schedules by storage_id, of the storages owned by this node.
+        self._schedules = {}
+        # Events of the collections running on this node, by
+        # (storage_id, resource_type).
+        self._in_flight = {}
+        self.coalesced = 0
+        self._stolen = 0
+        # Outcomes of the jobs finished since the last cycle report.
+        self._outcomes = collections.Counter()
+
+    def start_cycle(self, context):
+        """Start a collection cycle in the background.
+
+        :returns: whether a cycle was started, which is not the case as
+            long as the previous one is still running.
+        """
+        if self._running:
+            return False
+        self._running = True
+        eventlet.spawn_n(self._run_cycle, context)
+        return True
+
+    def _run_cycle(self, context):
+        try:
+            self.run_cycle(context)
+        except Exception:
+            LOG.exception("Collection cycle failed.")
+        finally:
+            self._running = False
+
+    def run_cycle(self, context):
+        """Queue the due jobs of the owned storages and start this node's.
+
+        The cycle ends once no more jobs can be leased, it does not wait
+        for the jobs it started. A storage is rescheduled when its own
+        job finishes, so a slow array only holds its own worker.
+
+        :returns: a dict with the number of jobs queued and started, the
+            number of jobs which succeeded, failed and timed_out since the
+            previous cycle, the queue depth and oldest job age at the
+            start, the number of members of the collector group and the
+            duration of the cycle.
+        """
+        start = time.time()
+        owns = self._ownership()
+        schedules = {}
+        due = []
+        for storage_id in self._storage_ids(context):
+            if not owns(storage_id):
+                continue
+            schedules[storage_id] = self._schedules.get(storage_id) or dict(
+                (resource_type, Schedule(resource_type))
+                for resource_type in RESOURCE_TYPES)
+            due.extend((storage_id, resource_type) for resource_type, schedule
+                       in schedules[storage_id].items()
+                       if schedule.due <= start)
+        # Storages moved to other nodes or deleted are forgotten.
+        self._schedules = schedules
+
+        queue = db.collection_job_stats(context, self.node_id)
+        room = max(CONF.collection_queue_max_depth - queue['depth'], 0)
+        if len(due) > room:
+            LOG.warning("Collection job queue of this node holds %(depth)s "
+                        "jobs, the oldest %(oldest_age).0fs old. Queuing "
+                        "%(room)s of %(due)s due jobs only.",
+                        dict(queue, room=room, due=len(due)))
+            due.sort(key=lambda job: schedules[job[0]][job[1]].due)
+            due = due[:room]
+        queued = db.collection_job_enqueue(context, due, self.node_id)
+        for storage_id, resource_type in due:
+            # Rescheduled from its result once the job is done, this only
+            # holds if the job is run by another node.
+            schedule = schedules[storage_id][resource_type]
+            schedule.due = start + schedule.interval
+
+        jobs = self._work_off(context, start)
+        results, self._outcomes = self._outcomes, collections.Counter()
+        self.last_cycle = {
+            'members': len(self._partitioner.ring.nodes),
+            'owned': len(schedules),
+            'queued': queued,
+            'queue_depth': queue['depth'],
+            'oldest_job_age': queue['oldest_age'],
+            'jobs': jobs,
+            'stolen': self._stolen,
+            'succeeded': results['succeeded'],
+            'failed': results['failed'],
+            'timed_out': results['timed_out'],
+            'duration': time.time() - start,
+        }
+        LOG.info("Collection cycle of this node, owning %(owned)s storages "
+                 "as one of %(members)s collector nodes, took "
+                 "%(duration).1fs: %(queued)s jobs queued on top of "
+                 "%(queue_depth)s, the oldest %(oldest_job_age).0fs old, "
+                 "%(jobs)s jobs started, %(stolen)s of them stolen, "
+                 "%(succeeded)s succeeded, %(failed)s failed, "
+                 "%(timed_out)s timed out since the previous cycle.",
+                 self.last_cycle)
+        return self.last_cycle
+
+    def _work_off(self, context, start):
+        """Start the jobs of this node until none is left to lease.
+
+        Then steal overdue jobs of other nodes, if enabled.
+
+        :returns: the number of jobs started.
+        """
+        started = 0
+        while True:
+            # Lease no more jobs than can start right away, the lease
+            # time runs from now on, and other nodes may steal the jobs
+            # left meanwhile.
+            self._wait_for_worker()
+            jobs = db.collection_job_lease(
+                context, self.node_id, self.pool.free(),
+                CONF.collection_job_lease_time)
+            if not jobs:
+                break
+            self._spawn_jobs(context, jobs)
+            started += len(jobs)
+        self._stolen = 0
+        if CONF.collection_work_stealing:
+            self._stolen = self._steal(context,
+                                       start + CONF.periodic_interval)
+        return started + self._stolen
+
+    def _wait_for_worker(self):
+        while not self.pool.free():
+            eventlet.sleep(_WORKER_POLL_INTERVAL)
+
+    def _spawn_jobs(self, context, jobs):
+        for job in jobs:
+            # Each job gets a context of its own, its db transactions are
+            # tracked on it.
+            self.pool.spawn_n(self._single_flight, job.storage_id,
+                              job.resource_type, self._run_job,
+                              context.elevated(), job)
+
+    def _steal(self, context, deadline):
+        """Run overdue jobs of other nodes while workers are idle.
+
+        The node with the most overdue jobs is stolen from first, half of
+        them at most at once. Stealing from a node is serialized by a
+        coordination lock, so that idle nodes spread over the loaded ones
+        rather than competing for the same jobs. It stops at deadline,
+        for the next cycle of this node to start on time.
+
+        :returns: the number of jobs stolen.
+        """
+        coordinator = coordination.LOCK_COORDINATOR
+        stolen = 0
+        while time.time() < deadline:
+            self._wait_for_worker()
+            created_before = timeutils.utcnow() - datetime.timedelta(
+                seconds=CONF.collection_steal_after)
+            overdue = db.collection_job_overdue(context, created_before)
+            overdue.pop(self.node_id, None)
+            jobs = []
+            contended = False
+            for node, count in sorted(overdue.items(),
+                                      key=lambda item: -item[1]):
+                lock = coordinator.get_lock('collection-steal-%s' % node)
+                if not lock.acquire(blocking=False):
+                    contended = True
+                    continue
+                try:
+                    jobs = db.collection_job_lease(
+                        context, self.node_id,
+                        min(self.pool.free(), (count + 1) // 2),
+                        CONF.collection_job_lease_time, node=node,
+                        created_before=created_before)
+                finally:
+                    lock.release()
+                if jobs:
+                    LOG.debug("Stole %(count)s collection jobs of node "
+                              "%(node)s.", {'count': len(jobs),
+                                            'node': node})
+                    break
+            if not jobs:
+                if not contended:
+                    return stolen
+                # Other nodes are stealing, try again once they are done.
+                eventlet.sleep(_WORKER_POLL_INTERVAL)
+                continue
+            stolen += len(jobs)
+            self._spawn_jobs(context, jobs)
+        return stolen
+
+    def refresh(self, context, storage_id, resource_type):
+        """Collect one resource type of a storage right away.
+
+        If that collection is running already, on this node or another
+        one, it is waited for instead of being run again.
+
+        :returns: a dict with the result of the collection, succeeded,
+            failed or timed_out, the share of the resources it changed
+            and the node which ran it. The result and share are None if
+            another node ran it.
+        """
+        if resource_type not in RESOURCE_TYPES:
+            msg = _("Invalid resource type: %s") % resource_type
+            raise exception.InvalidInput(reason=msg)
+        return self._single_flight(storage_id, resource_type,
+                                   self._refresh, context, storage_id,
+                                   resource_type)
+
+    def enqueue(self, context, jobs):
+        """Queue (storage_id, resource_type) jobs on this node.
+
+        The jobs are run like due ones, by a collection cycle started for
+        them, or by the running cycle or the next one. A job queued
+        already is not queued twice. Nothing waits for a free worker
+        here.
+
+        :returns: the number of jobs newly queued.
+        """
+        jobs = [tuple(job) for job in jobs]
+        for storage_id, resource_type in jobs:
+            if resource_type not in RESOURCE_TYPES:
+                msg = _("Invalid resource type: %s") % resource_type
+                raise exception.InvalidInput(reason=msg)
+        queued = db.collection_job_enqueue(context, jobs, self.node_id)
+        self.start_cycle(context)
+        return queued
+
+    def _single_flight(self, storage_id, resource_type, func, *args):
+        """Run func, unless it runs already for the same resources.
+
+        Callers arriving while it runs wait for it and get its return
+        value or exception.
+        """
+        key = (storage_id, resource_type)
+        flight = self._in_flight.get(key)
+        if flight is not None:
+            self.coalesced += 1
+            return flight.wait()
+        flight = self._in_flight[key] = event.Event()
+        try:
+            result = func(*args)
+        except Exception as e:
+            flight.send_exception(e)
+            raise
+        else:
+            flight.send(result)
+            return result
+        finally:
+            del self._in_flight[key]
+
+    def _refresh(self, context, storage_id, resource_type):
+        while True:
+            # Leasing the job keeps other nodes from running it meanwhile.
+            job = db.collection_job_claim(context, storage_id, resource_type,
+                                          self.node_id,
+                                          CONF.collection_job_lease_time)
+            if job.leased_by == self.node_id:
+                return self._run_job(context, job)
+            self.coalesced += 1
+            if self._wait_for_peer(context, job):
+                return {'result': None, 'change_ratio': None,
+                        'node': job.leased_by}
+            # The lease of the other node expired, run the job here.
+
+    def _wait_for_peer(self, context, job):
+        """Wait for another node to complete a job.
+
+        :returns: False if its lease expired instead.
+        """
+        while True:
+            eventlet.sleep(_PEER_POLL_INTERVAL)
+            current = db.collection_job_get(context, job.id)
+            if current is None:
+                return True
+            if current.lease_expires_at < timeutils.utcnow():
+                return False
+            # Leased again by a third node once the lease expired.
+            job = current
+
+    @property
+    def node_id(self):
+        return coordination.LOCK_COORDINATOR.member_id
+
+    def _ownership(self):
+        """Return a predicate telling whether this node owns a storage."""
+        coordinator = coordination.LOCK_COORDINATOR
+        if self._partitioner is None:
+            self._partitioner = coordinator.join_partitioned_group(
+                COLLECTOR_GROUP, partitions=_RING_PARTITIONS)
+        # Let the hash ring catch up with the members joined or left
+        # since the previous cycle.
+        coordinator.run_watchers()
+        return self._partitioner.belongs_to_self
+
+    def _storage_ids(self, context):
+        marker = None
+        while True:
+            registry_contexts = db.registry_context_get_all(
+                context, limit=_PAGE_SIZE, marker=marker,
+                sort_keys=['storage_id'], sort_dirs=['asc'])
+            storage_ids = [registry_context.storage_id
+                           for registry_context in registry_contexts]
+            if not storage_ids:
+                return
+            # Registry contexts of storages deleted before storage_delete
+            # removed them too are skipped.
+            live = set(storage.id for storage in db.storage_get_all(
+                context, filters={'id': storage_ids}))
+            for storage_id in storage_ids:
+                if storage_id in live:
+                    yield storage_id
+            if len(registry_contexts) < _PAGE_SIZE:
+                return
+            marker = registry_contexts[-1].storage_id
+
+    def _run_job(self, context, job):
+        start = time.time()
+        change_ratio = None
+        result = 'succeeded'
+        try:
+            change_ratio = self.collect(context, job.storage_id,
+                                        job.resource_type)
+        except eventlet.Timeout:
+            LOG.warning("Collection of the %(type)ss of storage %(storage)s "
+                        "timed out after %(timeout)ss.",
+                        {'type': job.resource_type,
+                         'storage': job.storage_id,
+                         'timeout': CONF.collection_timeout})
+            result = 'timed_out'
+        except Exception:
+            LOG.exception("Collection of the %(type)ss of storage "
+                          "%(storage)s failed.",
+                          {'type': job.resource_type,
+                           'storage': job.storage_id})
+            result = 'failed'
+        else:
+            LOG.debug("Collected the %(type)ss of storage %(storage)s in "
+                      "%(duration).1fs.",
+                      {'type': job.resource_type, 'storage': job.storage_id,
+                       'duration': time.time() - start})
+        # A failed job is done as well, it is retried when due again
+        # rather than once its lease expires.
+        schedule = self._schedules.get(job.storage_id, {}).get(
+            job.resource_type)
+        if schedule is not None:
+            schedule.collected(change_ratio, time.time())
+        self._outcomes[result] += 1
+        try:
+            db.collection_job_complete(context, job.id, self.node_id)
+        except Exception:
+            LOG.exception("Failed to complete collection job %s, it is "
+                          "run again once its lease expires.", job.id)
+        return {'result': result, 'change_ratio': change_ratio,
+                'node': self.node_id}
+
+    def collect(self, context, storage_id, resource_type):
+        """Collect one resource type of a storage and store it.
+
+        Only the driver calls are bounded by collection_timeout, a timeout
+        never interrupts a database transaction.
+
+        :returns: the share of the resources added, updated or deleted,
+            or None if the storage is gone.
+        """
+        storage = db.storage_get(context, storage_id)
+        if storage is None:
+            return None
+        credentials = db.registry_credentials_get(context, storage_id)
+        if credentials is None:
+            return None
+        driver = driver_api.get_driver(credentials)
+        with eventlet.Timeout(CONF.collection_timeout):
+            if resource_type == 'storage':
+                collected = driver.get_storage(context)
+            elif resource_type == 'pool':
+                collected = driver.list_pools(context)
+            else:
+                collected = driver.list_volumes(context)
+        if resource_type == 'storage':
+            changed = any(storage.get(key) != value
+                          for key, value in collected.items() if key != 'id')
+            if changed:
+                db.storage_bulk_upsert(context,
+                                       [dict(collected, id=storage_id)])
+            self._record_capacity(context, storage_id, resource_type,
+                                  [dict(collected, id=storage_id)])
+            return 1.0 if changed else 0.0
+        if resource_type == 'pool':
+            result = db.pool_sync(context, collected, storage_id)
+            self._record_capacity(context, storage_id, resource_type,
+                                  db.pool_get_all(context, storage_id))
+        else:
+            # Volume status and capacity change often, their updates are
+            # batched with the ones of other storages.
+            result = db.volume_sync(context, collected, storage_id,
+                                    deferred=True)
+        changed = result['added'] + result['updated'] + result['deleted']
+        return float(changed) / max(changed + result['unchanged'], 1)
+
+    def _record_capacity(self, context, storage_id, resource_type,
+                         resources):
+        """Store a capacity history sample of each resource.
+
+        Only storages and pools are sampled, one sample per volume and
+        collection would outgrow all other tables.
+        """
+        samples = [{'resource_type': resource_type,
+                    'resource_id': resource['id'],
+                    'storage_id': storage_id,
+                    'total_capacity': resource.get('total_capacity'),
+                    'used_capacity': resource.get('used_capacity'),
+                    'free_capacity': resource.get('free_capacity')}
+                   for resource in resources
+                   if resource.get('total_capacity') is not None]
+        if not samples:
+            return
+        try:
+            db.capacity_samples_add(context, samples)
+        except db_exc.DBDuplicateEntry:
+            # Collected twice within a second, the first sample is kept.
+            pass
@@ -18,11 +18,15 @@
 
 """
 
+import datetime
+
 from oslo_config import cfg
 from oslo_log import log
 from oslo_service import periodic_task
+from oslo_utils import timeutils
 
 from dolphin import manager
+from dolphin.task_manager import collector
 from dolphin.task_manager import rpcapi as task_rpcapi
 from dolphin import coordination
 from dolphin import context
@@ -35,18 +39,74 @@ CONF.import_opt('periodic_interval', 'dolphin.service')
 class TaskManager(manager.Manager):
     """manage periodical tasks"""
 
-    RPC_API_VERSION = '1.0'
+    RPC_API_VERSION = '1.3'
 
     def __init__(self, service_name=None, *args, **kwargs):
         super(TaskManager, self).__init__(*args, **kwargs)
         self.task_rpcapi = task_rpcapi.TaskAPI()
+        self.collector = collector.Collector()
+
+    @periodic_task.periodic_task(run_immediately=True)
+    def _collect_storages(self, context):
+        """Start a collection cycle of the storage resources due.
+
+        The cycle runs in the background, see
+        dolphin.task_manager.collector.
+        """
+        self.collector.start_cycle(context)
+
+    @periodic_task.periodic_task(spacing=300, run_immediately=True)
+    @coordination.synchronized('lock-capacity-rollup')
+    def _capacity_rollup(self, context):
+        """Roll capacity samples up and purge the expired ones."""
+        rolled = self.db.capacity_rollup(context)
+        purged = self.db.capacity_purge(context)
+        LOG.info("Capacity history: %(rolled)s rollups written, %(purged)s "
+                 "expired samples purged.",
+                 {'rolled': rolled, 'purged': purged})
+
+    @periodic_task.periodic_task(spacing=3600)
+    @coordination.synchronized('lock-tombstone-purge')
+    def _purge_tombstones(self, context):
+        """Hard delete expired soft deleted storages, pools and volumes."""
+        before = timeutils.utcnow() - datetime.timedelta(
+            days=CONF.tombstone_retention_days)
+        batch_size = CONF.tombstone_purge_batch_size
+        for resource_type in ('volume', 'pool', 'storage'):
+            purged = 0
+            for i in range(CONF.tombstone_purge_max_batches):
+                count = self.db.tombstone_purge(context, resource_type,
+                                                before, batch_size)
+                purged += count
+                if count < batch_size:
+                    break
+            if purged:
+                LOG.info("Purged %(purged)s deleted %(type)s rows.",
+                         {'purged': purged, 'type': resource_type})
+
+    def registry_context_changed(self, context, storage_id):
+        """Drop the cached credentials of a storage changed elsewhere."""
+        self.db.registry_context_invalidate(storage_id)
+
+    def refresh_storage(self, context, storage_id, resource_types=None):
+        """Collect resource types of a storage, by default all, now.
+
+        :returns: the outcome of the collection of each resource type,
+            see dolphin.task_manager.collector.Collector.refresh.
+        """
+        resource_types = resource_types or collector.RESOURCE_TYPES
+        return dict((resource_type,
+                     self.collector.refresh(context, storage_id,
+                                            resource_type))
+                    for resource_type in resource_types)
+
+    def collect_storages(self, context, jobs):
+        """Queue the (storage_id, resource_type) jobs of a batch.
 
-    """Periodical task, this task will use coordination for distribute synchronization."""
-    @periodic_task.periodic_task(spacing=2, run_immediately=True)
-    @coordination.synchronized('lock-task-example')
-    def _task_example(self, context):
-        LOG.info("Produce task, say hello ...")
-        self.task_rpcapi.say_hello(context)
+        The jobs are run by the collection cycle of this node, the cast
+        returns once they are queued.
+        """
+        self.collector.enqueue(context, jobs)
 
     def say_hello(self, context, request_spec=None,
                   filter_properties=None):
@@ -21,6 +21,7 @@ import oslo_messaging as messaging
 from oslo_serialization import jsonutils
 
 from dolphin import rpc
+from dolphin.task_manager import collector
 
 CONF = cfg.CONF
 
@@ -31,9 +32,12 @@ class TaskAPI(object):
     API version history:
 
         1.0 - Initial version.
+        1.1 - Add registry_context_changed.
+        1.2 - Add refresh_storage.
+        1.3 - Add collect_storages.
     """
 
-    RPC_API_VERSION = '1.0'
+    RPC_API_VERSION = '1.3'
 
     def __init__(self):
         super(TaskAPI, self).__init__()
@@ -49,3 +53,46 @@ class TaskAPI(object):
                                  'say_hello',
                                  request_spec=request_spec_p,
                                  filter_properties=filter_properties)
+
+    def registry_context_changed(self, context, storage_id):
+        """Tell all task managers to reload the credentials of a storage."""
+        call_context = self.client.prepare(version='1.1', fanout=True)
+        return call_context.cast(context,
+                                 'registry_context_changed',
+                                 storage_id=storage_id)
+
+    def refresh_storage(self, context, storage_id, resource_types=None):
+        """Collect resources of a storage now and return the outcome.
+
+        Collections of the storage in progress are joined rather than
+        run a second time. The resource types are collected one after
+        the other. A type may wait up to collection_job_lease_time for a
+        job of a dead node to expire, then take up to collection_timeout
+        to collect, so the call timeout allows for both per type.
+        """
+        resource_types = resource_types or list(collector.RESOURCE_TYPES)
+        timeout = len(resource_types) * (CONF.collection_job_lease_time +
+                                         CONF.collection_timeout)
+        call_context = self.client.prepare(version='1.2', timeout=timeout)
+        return call_context.call(context,
+                                 'refresh_storage',
+                                 storage_id=storage_id,
+                                 resource_types=resource_types)
+
+    def collect_storages(self, context, jobs):
+        """Have the task managers collect resources of storages.
+
+        jobs is a list of (storage_id, resource_type). They are sent in
+        messages of up to task_rpc_batch_size jobs, each queued by the
+        task manager receiving it, rather than one message per job.
+
+        :returns: the number of messages sent.
+        """
+        jobs = jsonutils.to_primitive(list(jobs))
+        batch_size = CONF.task_rpc_batch_size
+        call_context = self.client.prepare(version='1.3')
+        for start in range(0, len(jobs), batch_size):
+            call_context.cast(context,
+                              'collect_storages',
+                              jobs=jobs[start:start + batch_size])
+        return (len(jobs) + batch_size - 1) // batch_size
@@ -0,0 +1,83 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Base classes for the unit tests."""
+
+import os
+import tempfile
+import unittest
+
+from oslo_config import cfg
+
+from dolphin.common import config  # noqa
+from dolphin import context
+from dolphin import db
+from dolphin.db import api as db_api
+from dolphin.db.sqlalchemy import models
+
+CONF = cfg.CONF
+CONF([], project='dolphin', default_config_files=[])
+
+_DB_PATH = None
+
+
+def _setup_database():
+    """Create the schema once per test run, in a temporary SQLite file.
+
+    The enginefacade keeps the connection it was first started with, so
+    all tests share one database, emptied before each test.
+    """
+    global _DB_PATH
+    if _DB_PATH is None:
+        fd, _DB_PATH = tempfile.mkstemp(prefix='dolphin-test-',
+                                        suffix='.sqlite')
+        os.close(fd)
+        CONF.set_override('connection', 'sqlite:///' + _DB_PATH,
+                          group='database')
+        db.register_db()
+
+
+class TestCase(unittest.TestCase):
+    """Test case base class for all unit tests."""
+
+    def flags(self, **kw):
+        """Override flag variables for a test."""
+        group = kw.pop('group', None)
+        for k, v in kw.items():
+            CONF.set_override(k, v, group)
+            self.addCleanup(CONF.clear_override, k, group)
+
+    def stub(self, obj, attr, value):
+        """Replace an attribute of obj for the duration of a test."""
+        original = getattr(obj, attr)
+        setattr(obj, attr, value)
+        self.addCleanup(setattr, obj, attr, original)
+
+
+class DBTestCase(TestCase):
+    """Test case running against an empty SQLite database."""
+
+    def setUp(self):
+        super(DBTestCase, self).setUp()
+        _setup_database()
+        self.context = context.get_admin_context()
+        with db.transaction(self.context):
+            for table in reversed(models.BASE.metadata.sorted_tables):
+                self.context.session.execute(table.delete())
+        self._clear_caches()
+        self.addCleanup(self._clear_caches)
+
+    @staticmethod
+    def _clear_caches():
+        for cache in db_api._CACHES.values():
+            cache.clear()
+        db_api._CACHES.clear()
@@ -0,0 +1,45 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import webob
+import webob.exc
+
+from dolphin.api.v1 import db_stats
+from dolphin import context
+from dolphin import test
+
+
+class DBStatsControllerTestCase(test.DBTestCase):
+
+    def setUp(self):
+        super(DBStatsControllerTestCase, self).setUp()
+        self.controller = db_stats.DBStatsController()
+
+    def _request(self, ctxt):
+        req = webob.Request.blank('/v1/admin/db-stats')
+        if ctxt is not None:
+            req.environ['dolphin.context'] = ctxt
+        return req
+
+    def test_show_admin(self):
+        result = self.controller.show(self._request(self.context))
+        self.assertEqual(0, result['db_stats']['collection_jobs']['depth'])
+        self.assertIn('engines', result['db_stats'])
+
+    def test_show_without_context_forbidden(self):
+        self.assertRaises(webob.exc.HTTPForbidden, self.controller.show,
+                          self._request(None))
+
+    def test_show_non_admin_forbidden(self):
+        ctxt = context.RequestContext('user', 'project', is_admin=False)
+        self.assertRaises(webob.exc.HTTPForbidden, self.controller.show,
+                          self._request(ctxt))
@@ -0,0 +1,88 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import unittest
+
+from dolphin.common import capacity
+from dolphin import db
+from dolphin import test
+
+# Above the range of a 32 bit integer, as capacities in bytes usually are.
+_TB = 1 << 40
+
+
+class CapacityTestMixin(object):
+    """Tests run once with NumPy, if installed, and once without."""
+
+    def test_total(self):
+        self.assertEqual(0, capacity.total(capacity.to_array([])))
+        values = capacity.to_array([3 * _TB, None, 5 * (1 << 31) + 1])
+        self.assertEqual(3 * _TB + 5 * (1 << 31) + 1, capacity.total(values))
+        self.assertIsInstance(capacity.total(values), int)
+
+    def test_percentile(self):
+        self.assertIsNone(capacity.percentile(capacity.to_array([]), 50))
+        values = capacity.to_array([40, 10, 30, 20])
+        self.assertEqual(10, capacity.percentile(values, 0))
+        self.assertEqual(25, capacity.percentile(values, 50))
+        self.assertEqual(37, capacity.percentile(values, 90))
+        self.assertEqual(40, capacity.percentile(values, 100))
+        self.assertEqual(7, capacity.percentile(capacity.to_array([7]), 95))
+        self.assertEqual(1.5 * _TB, capacity.percentile(
+            capacity.to_array([2 * _TB, _TB]), 50))
+
+    def test_over_threshold(self):
+        empty = capacity.to_array([])
+        self.assertEqual([], capacity.over_threshold(empty, empty, 0.9))
+        used = capacity.to_array([95, 50, 90, 91 * _TB])
+        total = capacity.to_array([100, 100, 100, 100 * _TB])
+        self.assertEqual([0, 3], capacity.over_threshold(used, total, 0.9))
+        self.assertEqual([0, 1, 2, 3],
+                         capacity.over_threshold(used, total, 0.1))
+
+    def test_capacity_arrays(self):
+        volumes = [('v1', 2 * _TB, _TB + 1), ('v2', 3 * (1 << 31), None),
+                   ('v3', 100, 95)]
+        db.volume_bulk_upsert(
+            self.context, [{'name': name, 'pool_id': 'p1',
+                            'total_capacity': total, 'used_capacity': used}
+                           for name, total, used in volumes], 's1')
+        arrays = db.capacity_arrays(self.context, 'volume', 's1',
+                                    columns=('total_capacity',
+                                             'used_capacity'))
+        ids = dict((volume.id, volume.name) for volume in
+                   db.volume_get_all(self.context, 's1'))
+        self.assertEqual(sorted(ids), arrays['id'])
+        names = [ids[volume_id] for volume_id in arrays['id']]
+        expected = dict((name, (total, used or 0))
+                        for name, total, used in volumes)
+        self.assertEqual([expected[name] for name in names],
+                         list(zip(arrays['total_capacity'],
+                                  arrays['used_capacity'])))
+        self.assertEqual('q', arrays['total_capacity'].typecode)
+
+        self.assertEqual(2 * _TB + 3 * (1 << 31) + 100,
+                         capacity.total(arrays['total_capacity']))
+        self.assertEqual(['v3'], [names[i] for i in capacity.over_threshold(
+            arrays['used_capacity'], arrays['total_capacity'], 0.9)])
+
+
+class PurePythonCapacityTestCase(CapacityTestMixin, test.DBTestCase):
+
+    def setUp(self):
+        super(PurePythonCapacityTestCase, self).setUp()
+        self.stub(capacity, 'numpy', None)
+
+
+@unittest.skipIf(capacity.numpy is None, 'NumPy is not installed')
+class NumpyCapacityTestCase(CapacityTestMixin, test.DBTestCase):
+    pass
@@ -0,0 +1,779 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Tests of the database API, run against SQLite."""
+
+import datetime
+import os
+import tempfile
+import time
+
+from oslo_db.sqlalchemy import enginefacade
+from oslo_utils import timeutils
+from sqlalchemy import event
+
+from dolphin import context
+from dolphin import db
+from dolphin import exception
+from dolphin.db import api as db_api
+from dolphin.db.sqlalchemy import api as sqlalchemy_api
+from dolphin.db.sqlalchemy import models
+from dolphin import rpc
+from dolphin.task_manager import manager as task_manager
+from dolphin.task_manager import rpcapi as task_rpcapi
+from dolphin import test
+from dolphin.tests import fakes
+
+
+class LookupCacheTestCase(test.DBTestCase):
+
+    def setUp(self):
+        super(LookupCacheTestCase, self).setUp()
+        db.storage_bulk_upsert(self.context, [{'id': 's1', 'name': 'old'}])
+
+    def _name(self):
+        return db.storage_get(context.get_admin_context(), 's1').name
+
+    def test_write_invalidates(self):
+        self.assertEqual('old', self._name())
+        db.storage_bulk_upsert(self.context, [{'id': 's1', 'name': 'new'}])
+        self.assertEqual('new', self._name())
+
+    def test_read_during_transaction_not_cached_past_commit(self):
+        with db.transaction(self.context):
+            db.storage_bulk_upsert(self.context,
+                                   [{'id': 's1', 'name': 'new'}])
+            self.assertEqual('old', self._name())
+        self.assertEqual('new', self._name())
+
+    def test_rolled_back_write(self):
+        try:
+            with db.transaction(self.context):
+                db.storage_bulk_upsert(self.context,
+                                       [{'id': 's1', 'name': 'new'}])
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual('old', self._name())
+
+    def test_load_started_before_write_is_not_cached(self):
+        def load_racing_write(ctxt, storage_id):
+            value = real_get(ctxt, storage_id)
+            db.storage_bulk_upsert(self.context,
+                                   [{'id': 's1', 'name': 'new'}])
+            return value
+
+        real_get = db_api.IMPL.storage_get
+        self.assertEqual('old', db_api._cached_get(
+            'storages', context.get_admin_context(), 's1',
+            load_racing_write).name)
+        self.assertEqual('new', self._name())
+
+
+class CapacityHistoryTestCase(test.DBTestCase):
+
+    def _add_samples(self, count, interval, now):
+        for i in range(count):
+            db.capacity_samples_add(
+                self.context,
+                [{'resource_type': 'pool', 'resource_id': 1,
+                  'storage_id': 's1', 'total_capacity': 100,
+                  'used_capacity': i, 'free_capacity': 100 - i}],
+                sampled_at=now - (count - i) * interval)
+
+    def test_short_range_served_from_raw_samples(self):
+        now = int(time.time())
+        self._add_samples(30, 60, now)
+        db.capacity_rollup(self.context, now=now + 3600)
+        history = db.capacity_history_get(self.context, 'pool', [1],
+                                          now - 1800, now + 1)
+        self.assertEqual(30, len(history))
+        self.assertEqual(now - 60, history[-1].sampled_at)
+
+    def test_rollup_picked_when_raw_exceeds_max_points(self):
+        self.flags(capacity_history_max_points=10)
+        now = int(time.time())
+        self._add_samples(30, 60, now)
+        db.capacity_rollup(self.context, now=now + 3600)
+        history = db.capacity_history_get(self.context, 'pool', [1],
+                                          now - 1800, now + 1)
+        self.assertTrue(0 < len(history) <= 10)
+        self.assertEqual(0, history[0].sampled_at % 300)
+
+    def test_rollup_picked_beyond_raw_retention(self):
+        now = int(time.time())
+        start = now - 3 * 86400
+        with db.transaction(self.context, read_only=True):
+            resolution = sqlalchemy_api._capacity_resolution_for(
+                self.context, 'pool', ['1'], start, start + 1800)
+        self.assertEqual(300, resolution)
+
+    def _statements(self, func):
+        """Run func and return the statements it executed on samples."""
+        statements = []
+
+        def record(conn, cursor, statement, parameters, context,
+                   executemany):
+            if 'capacity_samples' in statement:
+                statements.append((statement, parameters))
+
+        engine = sqlalchemy_api.get_engine()
+        event.listen(engine, 'before_cursor_execute', record)
+        try:
+            func()
+        finally:
+            event.remove(engine, 'before_cursor_execute', record)
+        return statements
+
+    def test_rollup_and_purge_use_index(self):
+        now = int(time.time())
+        self._add_samples(30, 60, now - 90 * 86400)
+        self._add_samples(30, 60, now)
+        statements = self._statements(lambda: (
+            db.capacity_rollup(self.context, now=now + 86400 * 2),
+            db.capacity_purge(self.context, now=now)))
+        self.assertTrue(statements)
+        engine = sqlalchemy_api.get_engine()
+        for statement, parameters in statements:
+            plan = ' '.join(row[-1] for row in engine.execute(
+                'EXPLAIN QUERY PLAN ' + statement, parameters))
+            self.assertNotIn('SCAN capacity_samples', plan, statement)
+
+
+class StorageDeleteTestCase(test.DBTestCase):
+
+    def setUp(self):
+        super(StorageDeleteTestCase, self).setUp()
+        for storage_id in ('s1', 's2'):
+            db.storage_bulk_upsert(self.context, [{'id': storage_id}])
+            db.registry_context_create(self.context,
+                                       fakes.FakeRegisterInfo(storage_id))
+        db.collection_job_enqueue(self.context, [('s1', 'pool'),
+                                                 ('s2', 'pool')], 'node')
+
+    def test_delete_removes_registry_context_and_jobs(self):
+        db.storage_delete(self.context, 's1')
+        self.assertIsNone(db.registry_context_get(self.context, 's1'))
+        self.assertIsNotNone(db.registry_context_get(self.context, 's2'))
+        self.assertEqual(1, db.collection_job_stats(self.context)['depth'])
+
+    def test_purge_removes_left_over_registry_context(self):
+        db.storage_delete(self.context, 's1')
+        # A registry context left behind by an earlier delete.
+        db.registry_context_create(self.context, fakes.FakeRegisterInfo('s1'))
+        purged = db.tombstone_purge(self.context, 'storage',
+                                    timeutils.utcnow() +
+                                    datetime.timedelta(seconds=1), 10)
+        self.assertEqual(1, purged)
+        self.assertIsNone(db.registry_context_get(self.context, 's1'))
+
+
+class RegistryContextChangedTestCase(test.DBTestCase):
+
+    def setUp(self):
+        super(RegistryContextChangedTestCase, self).setUp()
+        self.notified = []
+        test_case = self
+
+        class FakeTaskAPI(object):
+            def registry_context_changed(self, ctxt, storage_id):
+                test_case.notified.append(storage_id)
+
+        self.stub(rpc, 'initialized', lambda: True)
+        self.stub(task_rpcapi, 'TaskAPI', FakeTaskAPI)
+
+    def test_create_notifies(self):
+        db.registry_context_create(self.context,
+                                   fakes.FakeRegisterInfo('s1'))
+        self.assertEqual(['s1'], self.notified)
+
+    def test_delete_notifies(self):
+        db.storage_bulk_upsert(self.context, [{'id': 's1'}])
+        db.storage_delete(self.context, 's1')
+        self.assertEqual(['s1'], self.notified)
+
+    def test_notified_once_committed(self):
+        with db.transaction(self.context):
+            db.registry_context_create(self.context,
+                                       fakes.FakeRegisterInfo('s1'))
+            self.assertEqual([], self.notified)
+        self.assertEqual(['s1'], self.notified)
+
+    def test_not_notified_when_rolled_back(self):
+        try:
+            with db.transaction(self.context):
+                db.registry_context_create(self.context,
+                                           fakes.FakeRegisterInfo('s1'))
+                raise ValueError()
+        except ValueError:
+            pass
+        self.assertEqual([], self.notified)
+
+
+class RegistryCredentialsTestCase(test.DBTestCase):
+
+    def setUp(self):
+        super(RegistryCredentialsTestCase, self).setUp()
+        db.registry_context_create(self.context, fakes.FakeRegisterInfo(
+            's1', extra_attributes={'port': 8443}))
+        self.loads = []
+        self.notified = []
+        test_case = self
+        real_get = sqlalchemy_api.registry_context_get
+
+        def registry_context_get(ctxt, storage_id):
+            self.loads.append(storage_id)
+            return real_get(ctxt, storage_id)
+
+        class FakeTaskAPI(object):
+            """Delivers the cast to the task manager right away."""
+
+            def registry_context_changed(self, ctxt, storage_id):
+                test_case.notified.append(storage_id)
+                test_case.task_manager.registry_context_changed(ctxt,
+                                                                storage_id)
+
+        self.stub(sqlalchemy_api, 'registry_context_get',
+                  registry_context_get)
+        self.stub(rpc, 'initialized', lambda: True)
+        self.stub(task_rpcapi, 'TaskAPI', FakeTaskAPI)
+        self.task_manager = task_manager.TaskManager()
+
+    def _password(self):
+        return db.registry_credentials_get(self.context, 's1')['password']
+
+    def _change_elsewhere(self, password):
+        # As another process would, without touching the caches here.
+        sqlalchemy_api.get_engine().execute(
+            models.RegistryContext.__table__.update().values(
+                password=password))
+
+    def test_cache_hit(self):
+        credentials = db.registry_credentials_get(self.context, 's1')
+        self.assertEqual({'port': 8443}, credentials['extra_attributes'])
+        self.assertEqual(('s1', 'user', 'secret'),
+                         (credentials['storage_id'], credentials['username'],
+                          credentials['password']))
+        self.assertIs(credentials,
+                      db.registry_credentials_get(self.context, 's1'))
+        self.assertEqual(['s1'], self.loads)
+
+    def test_missing_not_cached(self):
+        self.assertIsNone(db.registry_credentials_get(self.context, 's2'))
+        self.assertIsNone(db.registry_credentials_get(self.context, 's2'))
+        self.assertEqual(['s2', 's2'], self.loads)
+
+    def test_bypassed_in_transaction(self):
+        with db.transaction(self.context):
+            self._password()
+            self._password()
+        self.assertEqual(['s1', 's1'], self.loads)
+
+    def test_changed_here(self):
+        self.assertEqual('secret', self._password())
+        self._change_elsewhere('new')
+        self.assertEqual('secret', self._password())
+        db_api._registry_context_changed(self.context, 's1')
+        self.assertEqual(['s1'], self.notified)
+        self.assertEqual('new', self._password())
+        self.assertEqual(['s1', 's1'], self.loads)
+
+    def test_cast_invalidates_task_manager(self):
+        self.assertEqual('secret', self._password())
+        self._change_elsewhere('new')
+        db_api._notify_registry_context_changed(self.context, 's1')
+        self.assertEqual('new', self._password())
+
+    def test_notified_after_commit(self):
+        self.assertEqual('secret', self._password())
+        with db.transaction(self.context):
+            self._change_elsewhere('new')
+            db_api._registry_context_changed(self.context, 's1')
+            self.assertEqual([], self.notified)
+        self.assertEqual(['s1'], self.notified)
+        self.assertEqual('new', self._password())
+
+
+class CollectionJobTestCase(test.DBTestCase):
+
+    def setUp(self):
+        super(CollectionJobTestCase, self).setUp()
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+
+    def _jobs(self):
+        return dict(((job.storage_id, job.resource_type), job)
+                    for job in self.context.session.query(
+                        sqlalchemy_api.CollectionJob))
+
+    def test_enqueue_skips_queued_jobs(self):
+        self.assertEqual(2, db.collection_job_enqueue(
+            self.context, [('s1', 'pool'), ('s1', 'pool'),
+                           ('s1', 'volume')], 'node1'))
+        self.assertEqual(1, db.collection_job_enqueue(
+            self.context, [('s1', 'pool'), ('s2', 'pool')], 'node1'))
+        self.assertEqual(3, db.collection_job_stats(self.context,
+                                                    'node1')['depth'])
+
+    def test_enqueue_hands_over_unleased_jobs(self):
+        db.collection_job_enqueue(self.context,
+                                  [('s1', 'pool'), ('s2', 'pool')], 'node1')
+        leased, = db.collection_job_lease(self.context, 'node1', 1, 60)
+        self.assertEqual(0, db.collection_job_enqueue(
+            self.context, [('s1', 'pool'), ('s2', 'pool')], 'node2'))
+        with db.transaction(self.context):
+            nodes = dict((job.storage_id, job.node)
+                         for job in self._jobs().values())
+        # The leased job stays with the node running it.
+        self.assertEqual('node1', nodes.pop(leased.storage_id))
+        self.assertEqual(['node2'], list(nodes.values()))
+
+    def test_lease_oldest_first(self):
+        db.collection_job_enqueue(self.context, [('s1', 'pool')], 'node1')
+        timeutils.advance_time_seconds(1)
+        db.collection_job_enqueue(self.context, [('s2', 'pool')], 'node1')
+        jobs = db.collection_job_lease(self.context, 'node1', 1, 60)
+        self.assertEqual(['s1'], [job.storage_id for job in jobs])
+        jobs = db.collection_job_lease(self.context, 'node1', 10, 60)
+        self.assertEqual(['s2'], [job.storage_id for job in jobs])
+        self.assertEqual([], db.collection_job_lease(self.context, 'node1',
+                                                     10, 60))
+
+    def test_lease_other_node(self):
+        db.collection_job_enqueue(self.context, [('s1', 'pool')], 'node1')
+        created_before = timeutils.utcnow()
+        self.assertEqual([], db.collection_job_lease(
+            self.context, 'node2', 10, 60, node='node1',
+            created_before=created_before))
+        timeutils.advance_time_seconds(1)
+        jobs = db.collection_job_lease(
+            self.context, 'node2', 10, 60, node='node1',
+            created_before=timeutils.utcnow())
+        self.assertEqual(['node2'], [job.leased_by for job in jobs])
+
+    def test_expired_lease_leased_again(self):
+        db.collection_job_enqueue(self.context, [('s1', 'pool')], 'node1')
+        job, = db.collection_job_lease(self.context, 'node1', 10, 60)
+        self.assertEqual(1, job.attempts)
+        timeutils.advance_time_seconds(30)
+        self.assertEqual([], db.collection_job_lease(self.context, 'node1',
+                                                     10, 60))
+        timeutils.advance_time_seconds(31)
+        job, = db.collection_job_lease(self.context, 'node2', 10, 60,
+                                       node='node1')
+        self.assertEqual(('node2', 2), (job.leased_by, job.attempts))
+
+    def test_complete_by_stale_worker(self):
+        db.collection_job_enqueue(self.context, [('s1', 'pool')], 'node1')
+        job, = db.collection_job_lease(self.context, 'node1', 10, 60)
+        timeutils.advance_time_seconds(61)
+        db.collection_job_lease(self.context, 'node2', 10, 60, node='node1')
+        self.assertFalse(db.collection_job_complete(self.context, job.id,
+                                                    'node1'))
+        self.assertIsNotNone(db.collection_job_get(self.context, job.id))
+        self.assertTrue(db.collection_job_complete(self.context, job.id,
+                                                   'node2'))
+        self.assertIsNone(db.collection_job_get(self.context, job.id))
+
+    def test_claim_leaves_running_job(self):
+        job = db.collection_job_claim(self.context, 's1', 'pool', 'node1',
+                                      60)
+        self.assertEqual('node1', job.leased_by)
+        job = db.collection_job_claim(self.context, 's1', 'pool', 'node2',
+                                      60)
+        self.assertEqual('node1', job.leased_by)
+
+    def test_stats_and_overdue(self):
+        db.collection_job_enqueue(self.context,
+                                  [('s1', 'pool'), ('s2', 'pool')], 'node1')
+        db.collection_job_enqueue(self.context, [('s3', 'pool')], 'node2')
+        db.collection_job_lease(self.context, 'node1', 1, 60)
+        timeutils.advance_time_seconds(10)
+        self.assertEqual({'depth': 2, 'leased': 1, 'oldest_age': 10.0},
+                         db.collection_job_stats(self.context, 'node1'))
+        self.assertEqual({'node1': 1, 'node2': 1},
+                         db.collection_job_overdue(self.context,
+                                                   timeutils.utcnow()))
+
+
+def _volume(name, pool_id='p1', total=100, used=40, **values):
+    return dict(values, name=name, pool_id=pool_id, total_capacity=total,
+                used_capacity=used, free_capacity=total - used)
+
+
+class ResourceSyncTestCase(test.DBTestCase):
+
+    def _names(self):
+        return sorted(volume.name for volume in
+                      db.volume_get_all(self.context, 's1'))
+
+    def test_sync(self):
+        self.assertEqual(
+            {'added': 3, 'updated': 0, 'deleted': 0, 'unchanged': 0},
+            db.volume_sync(self.context, [_volume('v1'), _volume('v2'),
+                                          _volume('v3')], 's1'))
+        self.assertEqual(
+            {'added': 1, 'updated': 1, 'deleted': 1, 'unchanged': 1},
+            db.volume_sync(self.context,
+                           [_volume('v1'), _volume('v2', used=50),
+                            _volume('v4')], 's1'))
+        self.assertEqual(['v1', 'v2', 'v4'], self._names())
+        volume, = db.volume_get_all(self.context, 's1',
+                                    filters={'name': 'v2'})
+        self.assertEqual(50, volume.used_capacity)
+
+    def test_sync_unchanged_rows_not_written(self):
+        db.pool_sync(self.context, [{'name': 'p1', 'status': 'normal'}],
+                     's1')
+        pool, = db.pool_get_all(self.context, 's1')
+        self.assertEqual(
+            {'added': 0, 'updated': 0, 'deleted': 0, 'unchanged': 1},
+            db.pool_sync(self.context, [{'name': 'p1', 'status': 'normal'}],
+                         's1'))
+        self.assertIsNone(db.pool_get(self.context, pool.id, 's1')
+                          .updated_at)
+
+    def test_name_reused_after_delete(self):
+        db.volume_sync(self.context, [_volume('v1')], 's1')
+        db.volume_sync(self.context, [], 's1')
+        self.assertEqual(
+            {'added': 1, 'updated': 0, 'deleted': 0, 'unchanged': 0},
+            db.volume_sync(self.context, [_volume('v1')], 's1'))
+        self.assertEqual(['v1'], self._names())
+
+    def test_storages_kept_apart(self):
+        db.volume_sync(self.context, [_volume('v1')], 's1')
+        db.volume_sync(self.context, [_volume('v1')], 's2')
+        db.volume_sync(self.context, [], 's2')
+        self.assertEqual(['v1'], self._names())
+
+
+class BulkUpsertTestCase(test.DBTestCase):
+
+    def _volumes(self):
+        return dict((volume.name, volume) for volume in
+                    db.volume_get_all(self.context, 's1'))
+
+    def test_insert_and_update(self):
+        self.assertEqual(2, db.volume_bulk_upsert(
+            self.context, [_volume('v1'), _volume('v2')], 's1'))
+        ids = dict((name, volume.id)
+                   for name, volume in self._volumes().items())
+        self.assertEqual(2, db.volume_bulk_upsert(
+            self.context, [_volume('v2', used=90), _volume('v3')], 's1'))
+        volumes = self._volumes()
+        self.assertEqual(['v1', 'v2', 'v3'], sorted(volumes))
+        self.assertEqual(ids['v2'], volumes['v2'].id)
+        self.assertEqual((40, 90), (volumes['v1'].used_capacity,
+                                    volumes['v2'].used_capacity))
+        self.assertEqual({'volume_count': 3, 'total_capacity': 300,
+                          'used_capacity': 170, 'free_capacity': 130},
+                         db.storage_capacity_summary_get(self.context, 's1'))
+
+    def test_duplicates_in_batch(self):
+        self.assertEqual(2, db.volume_bulk_upsert(
+            self.context, [_volume('v1', used=10), _volume('v2'),
+                           _volume('v1', used=20)], 's1'))
+        self.assertEqual(20, self._volumes()['v1'].used_capacity)
+        self.assertEqual(1, db.volume_bulk_upsert(
+            self.context, [_volume('v1', used=30), _volume('v1', used=40)],
+            's1'))
+        self.assertEqual(40, self._volumes()['v1'].used_capacity)
+
+    def test_chunked(self):
+        self.flags(db_bulk_upsert_batch_size=2)
+        db.pool_bulk_upsert(self.context,
+                            [{'name': 'p%d' % i, 'status': 'normal'}
+                             for i in range(5)], 's1')
+        self.assertEqual(5, db.pool_bulk_upsert(
+            self.context, [{'name': 'p%d' % i, 'status': 'offline'}
+                           for i in range(5)] +
+            [{'name': 'p0', 'status': 'abnormal'}], 's1'))
+        pools = dict((pool.name, pool.status)
+                     for pool in db.pool_get_all(self.context, 's1'))
+        self.assertEqual(dict(('p%d' % i, 'offline') for i in range(1, 5)),
+                         dict((name, status) for name, status
+                              in pools.items() if name != 'p0'))
+        self.assertEqual('abnormal', pools['p0'])
+
+    def test_pools_kept_apart_per_storage(self):
+        db.pool_bulk_upsert(self.context, [{'name': 'p1'}], 's1')
+        db.pool_bulk_upsert(self.context, [{'name': 'p1'}], 's2')
+        self.assertEqual(1, len(db.pool_get_all(self.context, 's1')))
+        self.assertEqual(1, len(db.pool_get_all(self.context, 's2')))
+
+    def test_deleted_volume_not_revived(self):
+        db.volume_bulk_upsert(self.context, [_volume('v1')], 's1')
+        old = self._volumes()['v1']
+        db.volume_sync(self.context, [], 's1')
+        db.volume_bulk_upsert(self.context, [_volume('v1')], 's1')
+        self.assertNotEqual(old.id, self._volumes()['v1'].id)
+
+    def test_storages(self):
+        self.assertEqual(1, db.storage_bulk_upsert(
+            self.context, [{'id': 's1', 'name': 'a'},
+                           {'id': 's1', 'name': 'b'}]))
+        self.assertEqual('b', db.storage_get(self.context, 's1').name)
+
+
+class IterTestCase(test.DBTestCase):
+
+    def _ids(self, rows):
+        ids = [row.id for row in rows]
+        self.assertEqual(sorted(set(ids)), ids)
+        return ids
+
+    def test_storage_iter(self):
+        db.storage_bulk_upsert(self.context,
+                               [{'id': 's%d' % i, 'name': 'storage-%d' % i}
+                                for i in range(7)])
+        db.storage_delete(self.context, 's3')
+        self.assertEqual(['s0', 's1', 's2', 's4', 's5', 's6'],
+                         self._ids(db.storage_iter(self.context,
+                                                   chunk_size=2)))
+        self.assertEqual(['s5'], self._ids(db.storage_iter(
+            self.context, filters={'name': 'storage-5'}, chunk_size=2)))
+
+    def test_volume_iter(self):
+        db.volume_bulk_upsert(
+            self.context, [_volume('v%d' % i, pool_id='p%d' % (i % 2))
+                           for i in range(7)], 's1')
+        db.volume_bulk_upsert(self.context, [_volume('v0'), _volume('v1')],
+                              's2')
+        db.volume_sync(self.context, [_volume('v%d' % i, pool_id='p%d' % (
+            i % 2)) for i in range(7) if i != 4], 's1')
+        volumes = db.volume_get_all(self.context, 's1')
+        self.assertEqual(6, len(volumes))
+
+        self.assertEqual(sorted(volume.id for volume in volumes),
+                         self._ids(db.volume_iter(self.context, 's1',
+                                                  chunk_size=4)))
+        self.assertEqual(8, len(self._ids(
+            db.volume_iter(self.context, chunk_size=3))))
+        self.assertEqual(['v1', 'v3', 'v5'], sorted(
+            volume.name for volume in db.volume_iter(
+                self.context, 's1', filters={'pool_id': 'p1'},
+                chunk_size=2)))
+
+    def test_pool_iter(self):
+        db.pool_bulk_upsert(self.context, [{'name': 'p%d' % i}
+                                           for i in range(5)], 's1')
+        db.pool_sync(self.context, [{'name': 'p%d' % i}
+                                    for i in range(1, 5)], 's1')
+        pools = list(db.pool_iter(self.context, 's1', chunk_size=2))
+        self._ids(pools)
+        self.assertEqual(['p1', 'p2', 'p3', 'p4'],
+                         sorted(pool.name for pool in pools))
+
+    def test_abandoned(self):
+        db.volume_bulk_upsert(self.context, [_volume('v%d' % i)
+                                             for i in range(5)], 's1')
+        volumes = db.volume_iter(self.context, 's1', chunk_size=2)
+        next(volumes)
+        volumes.close()
+        self.assertEqual(5, len(list(db.volume_iter(self.context, 's1',
+                                                    chunk_size=2))))
+
+
+class PaginationTestCase(test.DBTestCase):
+
+    def setUp(self):
+        super(PaginationTestCase, self).setUp()
+        db.storage_bulk_upsert(self.context, [
+            {'id': 's%d' % i, 'vendor': 'vendor%d' % (i % 2)}
+            for i in range(5)])
+
+    def _ids(self, **kwargs):
+        return [storage.id
+                for storage in db.storage_get_all(self.context, **kwargs)]
+
+    def test_pages(self):
+        self.assertEqual(['s0', 's1'], self._ids(limit=2))
+        self.assertEqual(['s2', 's3'], self._ids(limit=2, marker='s1'))
+        self.assertEqual(['s4'], self._ids(limit=2, marker='s3'))
+
+    def test_pages_by_sort_key(self):
+        pages = []
+        marker = None
+        while True:
+            page = self._ids(limit=2, marker=marker, sort_keys=['vendor'],
+                             sort_dirs=['desc'])
+            if not page:
+                break
+            pages.append(page)
+            marker = page[-1]
+        # Ties of the sort key are broken by the id, in the same direction.
+        self.assertEqual([['s3', 's1'], ['s4', 's2'], ['s0']], pages)
+
+    def test_filters(self):
+        self.assertEqual(['s1', 's3'], self._ids(filters={
+            'vendor': 'vendor1'}))
+        self.assertEqual(['s0', 's4'], self._ids(filters={
+            'id': ['s0', 's3', 's4'], 'vendor': 'vendor0'}))
+
+    def test_unknown_marker(self):
+        self.assertRaises(exception.MarkerNotFound, self._ids, limit=2,
+                          marker='unknown')
+
+    def test_invalid_sort_key(self):
+        self.assertRaises(exception.InvalidInput, self._ids,
+                          sort_keys=['unknown'])
+
+
+class VolumePaginationTestCase(test.DBTestCase):
+
+    def setUp(self):
+        super(VolumePaginationTestCase, self).setUp()
+        # Every third volume has no status.
+        db.volume_sync(self.context, [
+            {'name': 'v%d' % i,
+             'status': None if i % 3 == 0 else 'status%d' % (i % 2)}
+            for i in range(10)], 's1')
+        db.volume_sync(self.context, [{'name': 'v0'}], 's2')
+        self.names = dict((volume.id, volume.name) for volume in
+                          db.volume_get_all(self.context, 's1'))
+
+    def _pages(self, sort_dir):
+        names = []
+        marker = None
+        while True:
+            page = db.volume_get_all(self.context, 's1', limit=3,
+                                     marker=marker, sort_keys=['status'],
+                                     sort_dirs=[sort_dir])
+            if not page:
+                return names
+            names.extend(self.names[volume.id] for volume in page)
+            marker = page[-1].id
+
+    def test_pages_across_nulls(self):
+        # NULLs sort last ascending, ties are broken by the id.
+        self.assertEqual(['v2', 'v4', 'v8', 'v1', 'v5', 'v7',
+                          'v0', 'v3', 'v6', 'v9'], self._pages('asc'))
+
+    def test_pages_across_nulls_descending(self):
+        self.assertEqual(['v9', 'v6', 'v3', 'v0', 'v7', 'v5',
+                          'v1', 'v8', 'v4', 'v2'], self._pages('desc'))
+
+    def test_marker_of_other_storage(self):
+        other, = db.volume_get_all(self.context, 's2')
+        self.assertRaises(exception.MarkerNotFound, db.volume_get_all,
+                          self.context, 's1', limit=3, marker=other.id)
+
+    def test_marker_excluded_by_filters(self):
+        volume, = db.volume_get_all(self.context, 's1', filters={
+            'name': 'v1'})
+        self.assertRaises(exception.MarkerNotFound, db.volume_get_all,
+                          self.context, 's1', filters={'status': None},
+                          marker=volume.id)
+
+
+class CapacitySummaryTestCase(test.DBTestCase):
+
+    def _pools(self):
+        return dict((summary.pool_id,
+                     (summary.volume_count, summary.total_capacity,
+                      summary.used_capacity, summary.free_capacity))
+                    for summary in db.capacity_summary_get_all(self.context,
+                                                               's1'))
+
+    def test_sync_deltas(self):
+        db.volume_sync(self.context, [_volume('v1'), _volume('v2'),
+                                      _volume('v3', pool_id='p2')], 's1')
+        self.assertEqual({'p1': (2, 200, 80, 120), 'p2': (1, 100, 40, 60)},
+                         self._pools())
+        # v1 grows, v2 moves to p2 and v3 vanishes.
+        db.volume_sync(self.context,
+                       [_volume('v1', total=150, used=90),
+                        _volume('v2', pool_id='p2')], 's1')
+        self.assertEqual({'p1': (1, 150, 90, 60), 'p2': (1, 100, 40, 60)},
+                         self._pools())
+        self.assertEqual({'volume_count': 2, 'total_capacity': 250,
+                          'used_capacity': 130, 'free_capacity': 120},
+                         db.storage_capacity_summary_get(self.context, 's1'))
+
+    def test_storage_delete(self):
+        db.storage_bulk_upsert(self.context, [{'id': 's1'}])
+        db.volume_sync(self.context, [_volume('v1')], 's1')
+        db.storage_delete(self.context, 's1')
+        self.assertEqual({}, self._pools())
+        self.assertEqual({'volume_count': 0, 'total_capacity': 0,
+                          'used_capacity': 0, 'free_capacity': 0},
+                         db.storage_capacity_summary_get(self.context, 's1'))
+
+    def test_by_vendor(self):
+        db.storage_bulk_upsert(self.context, [
+            {'id': 's1', 'vendor': 'a'}, {'id': 's2', 'vendor': 'a'},
+            {'id': 's3', 'vendor': 'b'}])
+        for storage_id in ('s1', 's2', 's3'):
+            db.volume_sync(self.context, [_volume('v1')], storage_id)
+        self.assertEqual([('a', 2, 200, 80, 120), ('b', 1, 100, 40, 60)],
+                         [tuple(row) for row in
+                          db.capacity_summary_by_vendor(self.context)])
+
+
+class ReplicaTestCase(test.DBTestCase):
+    """Reads against a primary and a replica in two SQLite files."""
+
+    def setUp(self):
+        super(ReplicaTestCase, self).setUp()
+        urls = []
+        for name in ('primary', 'replica'):
+            fd, path = tempfile.mkstemp(prefix='dolphin-test-%s-' % name,
+                                        suffix='.sqlite')
+            os.close(fd)
+            self.addCleanup(os.remove, path)
+            urls.append('sqlite:///' + path)
+        self.flags(slave_connection=urls[1], group='database')
+        self.flags(db_replica_max_staleness=5)
+        facade = enginefacade.transaction_context()
+        facade.configure(connection=urls[0], slave_connection=urls[1])
+        self.stub(sqlalchemy_api, 'main_context_manager', facade)
+        engines = (facade.writer.get_engine(),
+                   facade.reader.get_engine())
+        for engine in engines:
+            models.BASE.metadata.create_all(engine)
+            self.addCleanup(engine.dispose)
+        # The replica lags behind, it only knows an older storage.
+        engines[1].execute(models.Storage.__table__.insert(),
+                           [{'id': 'old', 'deleted': 0}])
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+
+    def _ids(self, ctxt):
+        return [storage.id for storage in db.storage_get_all(ctxt)]
+
+    def test_reads_from_replica(self):
+        db.storage_bulk_upsert(context.get_admin_context(), [{'id': 'new'}])
+        self.assertEqual(['old'], self._ids(context.get_admin_context()))
+
+    def test_reads_own_writes_from_primary(self):
+        ctxt = context.get_admin_context()
+        db.storage_bulk_upsert(ctxt, [{'id': 'new'}])
+        self.assertEqual(['new'], self._ids(ctxt))
+        timeutils.advance_time_seconds(4)
+        self.assertEqual(['new'], self._ids(ctxt))
+        # The replica is assumed to have caught up by now.
+        timeutils.advance_time_seconds(2)
+        self.assertEqual(['old'], self._ids(ctxt))
+
+    def test_read_only_transaction(self):
+        ctxt = context.get_admin_context()
+        with db.transaction(ctxt, read_only=True):
+            self.assertEqual(['old'], self._ids(ctxt))
+        db.storage_bulk_upsert(ctxt, [{'id': 'new'}])
+        with db.transaction(ctxt, read_only=True):
+            self.assertEqual(['new'], self._ids(ctxt))
+
+    def test_without_replica(self):
+        self.flags(slave_connection=None, group='database')
+        db.storage_bulk_upsert(context.get_admin_context(), [{'id': 'new'}])
+        self.assertEqual(['new'], self._ids(context.get_admin_context()))
@@ -0,0 +1,161 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import sqlalchemy
+from sqlalchemy import exc as sqla_exc
+from sqlalchemy import pool as sqla_pool
+
+from dolphin import db
+from dolphin.db.sqlalchemy import metrics
+from dolphin import test
+
+
+class FakeTime(object):
+    """Stands in for the time module, every call takes one second."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def time(self):
+        self.now += 1
+        return self.now
+
+
+class FingerprintTestCase(test.TestCase):
+
+    def test_literals(self):
+        self.assertEqual(
+            "SELECT * FROM volumes WHERE name = ? AND deleted = ?",
+            metrics.fingerprint("SELECT *  FROM volumes\n WHERE "
+                                "name = 'it''s' AND deleted = 0"))
+
+    def test_placeholder_lists(self):
+        self.assertEqual(
+            "SELECT id FROM volumes WHERE id IN (...)",
+            metrics.fingerprint("SELECT id FROM volumes WHERE id IN "
+                                "(?, ?, ?)"))
+        self.assertEqual(
+            "INSERT INTO pools (id, name) VALUES (...)",
+            metrics.fingerprint("INSERT INTO pools (id, name) VALUES "
+                                "(?, ?), (?, ?), (?, ?)"))
+
+
+class EngineMetricsTestCase(test.TestCase):
+
+    def setUp(self):
+        super(EngineMetricsTestCase, self).setUp()
+        self.flags(db_metrics_log_interval=0)
+        self.engine = sqlalchemy.create_engine(
+            'sqlite://', poolclass=sqla_pool.QueuePool, pool_size=1,
+            max_overflow=1, pool_timeout=0.1)
+        self.addCleanup(self.engine.dispose)
+        self.metrics = metrics.EngineMetrics('test', self.engine)
+        self.metrics.instrument()
+
+    def _execute(self, *statements):
+        with self.engine.connect() as connection:
+            for statement in statements:
+                connection.execute(statement)
+
+    def test_counters(self):
+        self._execute('SELECT 1', 'SELECT 2')
+        self._execute('SELECT 3')
+        stats = self.metrics.stats()
+        self.assertEqual('test', stats['name'])
+        self.assertEqual('QueuePool', stats['pool_class'])
+        self.assertEqual(2, stats['checkouts'])
+        self.assertEqual(1, stats['connects'])
+        self.assertEqual(3, stats['statements'])
+        self.assertEqual(0, stats['slow_statements'])
+        self.assertEqual(0, stats['pool_checkedout'])
+        self.assertEqual(1, stats['pool_checkedin'])
+
+    def test_checkout_timers(self):
+        self.stub(metrics, 'time', FakeTime())
+        self._execute()
+        self._execute()
+        stats = self.metrics.stats()
+        self.assertEqual(1.0, stats['checkout_wait_avg'])
+        self.assertEqual(1.0, stats['checkout_wait_max'])
+
+    def test_overflow_and_timeout(self):
+        first = self.engine.connect()
+        second = self.engine.connect()
+        self.assertRaises(sqla_exc.TimeoutError, self.engine.connect)
+        second.close()
+        first.close()
+        stats = self.metrics.stats()
+        self.assertEqual(2, stats['checkouts'])
+        self.assertEqual(1, stats['overflow_max'])
+        self.assertEqual(1, stats['checkout_timeouts'])
+
+    def test_invalidations(self):
+        with self.engine.connect() as connection:
+            connection.invalidate()
+        self.assertEqual(1, self.metrics.stats()['invalidations'])
+
+    def test_slow_statements(self):
+        self.flags(db_slow_statement_threshold=0.5)
+        self.stub(metrics, 'time', FakeTime())
+        self._execute("SELECT 'a'", "SELECT 'b'", 'SELECT 1, 2')
+        stats = self.metrics.stats()
+        self.assertEqual(3, stats['statements'])
+        self.assertEqual(3, stats['slow_statements'])
+        self.assertEqual(
+            [{'fingerprint': 'SELECT ?', 'count': 2, 'time': 2.0,
+              'max_time': 1.0},
+             {'fingerprint': 'SELECT ?, ?', 'count': 1, 'time': 1.0,
+              'max_time': 1.0}],
+            stats['slow_fingerprints'])
+
+    def test_slow_statements_disabled(self):
+        self.flags(db_slow_statement_threshold=0)
+        self.stub(metrics, 'time', FakeTime())
+        self._execute('SELECT 1')
+        self.assertEqual(0, self.metrics.stats()['slow_statements'])
+
+    def test_fingerprints_bounded(self):
+        self.flags(db_slow_statement_threshold=0.5)
+        self.stub(metrics, 'time', FakeTime())
+        self.stub(metrics, 'MAX_FINGERPRINTS', 1)
+        self._execute('SELECT 1', 'SELECT 1, 2', 'SELECT 3')
+        stats = self.metrics.stats()
+        self.assertEqual(3, stats['slow_statements'])
+        self.assertEqual([('SELECT ?', 2)],
+                         [(slow['fingerprint'], slow['count'])
+                          for slow in stats['slow_fingerprints']])
+
+    def test_failed_statement(self):
+        with self.engine.connect() as connection:
+            self.assertRaises(sqla_exc.OperationalError,
+                              connection.execute, 'SELECT * FROM missing')
+            self.assertEqual([], connection.info['query_start'])
+            connection.execute('SELECT 1')
+        self.assertEqual(1, self.metrics.stats()['statements'])
+
+    def test_dispose(self):
+        self._execute()
+        self.engine.dispose()
+        self._execute()
+        self.assertEqual(2, self.metrics.stats()['checkouts'])
+
+
+class EngineStatsTestCase(test.DBTestCase):
+
+    def test_query_counted(self):
+        primary, = [stats for stats in db.engine_stats()
+                    if stats['name'] == 'primary']
+        db.storage_get_all(self.context)
+        stats, = [stats for stats in db.engine_stats()
+                  if stats['name'] == 'primary']
+        self.assertGreater(stats['statements'], primary['statements'])
+        self.assertGreater(stats['checkouts'], primary['checkouts'])
@@ -0,0 +1,66 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import os
+import tempfile
+
+import sqlalchemy
+
+from dolphin.db.sqlalchemy import models
+from dolphin.db.sqlalchemy import sharding
+from dolphin import exception
+from dolphin import test
+
+
+class ShardTablesTestCase(test.TestCase):
+    """Shard tables of a SQLite database of its own."""
+
+    def setUp(self):
+        super(ShardTablesTestCase, self).setUp()
+        fd, path = tempfile.mkstemp(suffix='.sqlite')
+        os.close(fd)
+        self.addCleanup(os.remove, path)
+        self.engine = sqlalchemy.create_engine('sqlite:///' + path)
+        self.addCleanup(self.engine.dispose)
+        models.BASE.metadata.create_all(self.engine)
+        self.addCleanup(sharding._SHARDS.clear)
+        self.addCleanup(sharding._METADATA.clear)
+
+    def test_check_single_table(self):
+        sharding.check_shards(self.engine)
+
+    def test_check_refuses_unpartitioned_tables(self):
+        self.flags(db_inventory_shards=2)
+        self.assertRaises(exception.InvalidInput, sharding.check_shards,
+                          self.engine)
+
+    def test_reshard_creates_and_fills_shard_tables(self):
+        self.engine.execute(models.Volume.__table__.insert(), [
+            {'name': 'v%d' % i, 'storage_id': 's%d' % i, 'deleted': 0}
+            for i in range(10)])
+        self.flags(db_inventory_shards=2)
+        sharding.reshard(self.engine)
+        sharding.check_shards(self.engine)
+        with self.engine.connect() as conn:
+            tables = sharding.physical_tables(conn, 'volumes')
+            self.assertEqual(['volumes', 'volumes_p0', 'volumes_p1'],
+                             tables)
+            counts = [conn.execute('SELECT COUNT(*) FROM %s'
+                                   % table).scalar() for table in tables]
+        self.assertEqual(0, counts[0])
+        self.assertEqual(10, sum(counts))
+
+    def test_is_shard_table(self):
+        self.assertTrue(sharding.is_shard_table('volumes_p3'))
+        self.assertTrue(sharding.is_shard_table('pools_p0'))
+        self.assertFalse(sharding.is_shard_table('volumes'))
+        self.assertFalse(sharding.is_shard_table('storages_p0'))
@@ -0,0 +1,142 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from dolphin import db
+from dolphin.db import api as db_api
+from dolphin.db import write_behind
+from dolphin import test
+
+
+class FakeWriter(object):
+
+    def __init__(self):
+        self.fail = False
+        self.written = []
+
+    def __call__(self, context, resource_type, storage_id, updates):
+        if self.fail:
+            raise ValueError()
+        self.written.append((resource_type, storage_id, updates))
+
+
+class WriteBehindBufferTestCase(test.TestCase):
+
+    def setUp(self):
+        super(WriteBehindBufferTestCase, self).setUp()
+        self.flags(db_write_behind_interval=60, db_write_behind_max_rows=10)
+        self.writer = FakeWriter()
+        self.buffer = write_behind.WriteBehindBuffer(self.writer)
+        # Flushed explicitly by the tests.
+        self.stub(self.buffer, '_ensure_timer', lambda: None)
+
+    def test_updates_coalesced(self):
+        self.buffer.add('volume', 1, 's1', {'status': 'normal'})
+        self.buffer.add('volume', 1, 's1', {'status': 'offline',
+                                            'used_capacity': 10})
+        self.buffer.add('volume', 2, 's1', {'status': 'normal'})
+        self.buffer.add('pool', 1, 's1', {'status': 'normal'})
+        self.assertEqual(3, self.buffer.flush())
+        self.assertEqual(
+            [('pool', 's1', {1: {'status': 'normal'}}),
+             ('volume', 's1', {1: {'status': 'offline', 'used_capacity': 10},
+                               2: {'status': 'normal'}})],
+            sorted(self.writer.written))
+        self.assertEqual(0, self.buffer.flush())
+
+    def test_flushed_when_full(self):
+        self.flags(db_write_behind_max_rows=2)
+        self.buffer.add('volume', 1, 's1', {'status': 'normal'})
+        self.assertEqual([], self.writer.written)
+        self.buffer.add('volume', 2, 's1', {'status': 'normal'})
+        self.assertEqual(1, len(self.writer.written))
+        self.assertEqual(0, len(self.buffer))
+
+    def test_failed_flush_requeued(self):
+        self.buffer.add('volume', 1, 's1', {'status': 'normal',
+                                            'used_capacity': 10})
+        self.writer.fail = True
+        self.assertRaises(ValueError, self.buffer.flush)
+        self.assertEqual(1, len(self.buffer))
+        self.writer.fail = False
+        self.assertEqual(1, self.buffer.flush())
+        self.assertEqual(
+            [('volume', 's1', {1: {'status': 'normal',
+                                   'used_capacity': 10}})],
+            self.writer.written)
+
+    def test_newer_values_win_over_requeued(self):
+        self.buffer.add('volume', 1, 's1', {'status': 'normal',
+                                            'used_capacity': 10})
+        buffer = self.buffer
+
+        class RacingWriter(FakeWriter):
+            def __call__(self, context, resource_type, storage_id, updates):
+                # Queued while the failing write runs.
+                buffer.add('volume', 1, 's1', {'status': 'offline'})
+                raise ValueError()
+
+        self.buffer._writer = RacingWriter()
+        self.assertRaises(ValueError, self.buffer.flush)
+        self.buffer._writer = self.writer
+        self.buffer.flush()
+        self.assertEqual(
+            [('volume', 's1', {1: {'status': 'offline',
+                                   'used_capacity': 10}})],
+            self.writer.written)
+        self.assertEqual({'pending': 0, 'updates': 2, 'flushes': 1,
+                          'rows_written': 1}, self.buffer.stats())
+
+
+class DeferredUpdateTestCase(test.DBTestCase):
+
+    def setUp(self):
+        super(DeferredUpdateTestCase, self).setUp()
+        self.flags(db_write_behind_interval=60, db_write_behind_max_rows=10)
+        self.stub(db_api._WRITE_BEHIND, '_ensure_timer', lambda: None)
+        self.addCleanup(db_api._WRITE_BEHIND._pending.clear)
+        db.volume_sync(self.context, [{'name': 'v1', 'status': 'normal'}],
+                       's1')
+        self.volume, = db.volume_get_all(self.context, 's1')
+
+    def _status(self):
+        return db.volume_get(self.context, self.volume.id, 's1').status
+
+    def test_written_on_flush(self):
+        db.volume_update_deferred(self.context, self.volume.id, 's1',
+                                  {'status': 'offline'})
+        self.assertEqual('normal', self._status())
+        self.assertEqual(1, db.write_behind_flush(self.context))
+        self.assertEqual('offline', self._status())
+
+    def test_sync_deferred(self):
+        db.volume_sync(self.context, [{'name': 'v1', 'status': 'normal'},
+                                      {'name': 'v2', 'status': 'normal',
+                                       'pool_id': 'p1',
+                                       'total_capacity': 100}], 's1')
+        collected = [{'name': 'v1', 'status': 'offline'},
+                     {'name': 'v2', 'status': 'normal', 'pool_id': 'p1',
+                      'total_capacity': 300}]
+        self.assertEqual(
+            {'added': 0, 'updated': 2, 'deleted': 0, 'unchanged': 0},
+            db.volume_sync(self.context, collected, 's1', deferred=True))
+        self.assertEqual('normal', self._status())
+        self.assertEqual(100, db.storage_capacity_summary_get(
+            self.context, 's1')['total_capacity'])
+
+        self.assertEqual(2, db.write_behind_flush(self.context))
+        self.assertEqual('offline', self._status())
+        self.assertEqual(300, db.storage_capacity_summary_get(
+            self.context, 's1')['total_capacity'])
+        # Written with their content hash, the next sync finds no change.
+        self.assertEqual(
+            {'added': 0, 'updated': 0, 'deleted': 0, 'unchanged': 2},
+            db.volume_sync(self.context, collected, 's1', deferred=True))
@@ -0,0 +1,164 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from dolphin.driver import throttle
+from dolphin import exception
+from dolphin import test
+
+
+class FakeClock(object):
+    """Stands in for the time module, sleeping only advances the clock."""
+
+    def __init__(self):
+        self.now = 1000.0
+        self.sleeps = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.sleeps.append(seconds)
+        self.now += seconds
+
+
+class TokenBucketTestCase(test.TestCase):
+
+    def setUp(self):
+        super(TokenBucketTestCase, self).setUp()
+        self.clock = FakeClock()
+        self.stub(throttle, 'time', self.clock)
+
+    def test_burst(self):
+        bucket = throttle.TokenBucket(2, burst=3)
+        for i in range(3):
+            bucket.acquire()
+        self.assertEqual([], self.clock.sleeps)
+        bucket.acquire()
+        self.assertEqual([0.5], self.clock.sleeps)
+
+    def test_waiters_start_in_order(self):
+        bucket = throttle.TokenBucket(4, burst=1)
+        bucket.acquire()
+        # Tokens are taken in advance, each caller waits for its own.
+        self.stub(self.clock, 'sleep', self.clock.sleeps.append)
+        bucket.acquire()
+        bucket.acquire()
+        self.assertEqual([0.25, 0.5], self.clock.sleeps)
+
+    def test_refill(self):
+        bucket = throttle.TokenBucket(2, burst=2)
+        bucket.acquire()
+        bucket.acquire()
+        self.clock.now += 1
+        bucket.acquire()
+        bucket.acquire()
+        self.assertEqual([], self.clock.sleeps)
+
+    def test_refill_capped_at_burst(self):
+        bucket = throttle.TokenBucket(1)
+        self.clock.now += 60
+        bucket.acquire()
+        bucket.acquire()
+        self.assertEqual([1.0], self.clock.sleeps)
+
+
+class LimiterTestCase(test.TestCase):
+
+    def setUp(self):
+        super(LimiterTestCase, self).setUp()
+        self.clock = FakeClock()
+        self.stub(throttle, 'time', self.clock)
+
+    def test_concurrency(self):
+        limiter = throttle.Limiter(2, 0)
+        with limiter, limiter:
+            self.assertFalse(limiter._semaphore.acquire(False))
+        self.assertTrue(limiter._semaphore.acquire(False))
+
+    def test_rate(self):
+        limiter = throttle.Limiter(1, 1)
+        with limiter:
+            pass
+        with limiter:
+            pass
+        self.assertEqual([1.0], self.clock.sleeps)
+
+    def test_released_when_interrupted(self):
+        limiter = throttle.Limiter(1, 1)
+        with limiter:
+            pass
+
+        def sleep(seconds):
+            raise RuntimeError()
+
+        self.stub(self.clock, 'sleep', sleep)
+        self.assertRaises(RuntimeError, limiter.__enter__)
+        self.assertTrue(limiter._semaphore.acquire(False))
+
+
+class LimiterForTestCase(test.TestCase):
+
+    def _limits(self, **credentials):
+        limiter = throttle.limiter_for(credentials)
+        return limiter.concurrency, limiter.rate
+
+    def test_defaults(self):
+        self.flags(driver_max_concurrent_calls=3,
+                   driver_max_calls_per_second=2.0)
+        self.assertEqual((3, 2.0), self._limits(vendor='acme'))
+
+    def test_vendor_and_model_first(self):
+        self.flags(driver_call_limits={'acme': '2/5', 'acme/x9000': '1/0.5'})
+        self.assertEqual((1, 0.5), self._limits(vendor='acme',
+                                                model='x9000'))
+        self.assertEqual((2, 5.0), self._limits(vendor='acme',
+                                                model='x100'))
+        self.assertEqual((2, 5.0), self._limits(vendor='acme'))
+
+    def test_parse_limits(self):
+        self.assertEqual((2, 5.0), throttle._parse_limits('k', '2/5', 4, 0))
+        self.assertEqual((2, 1.5), throttle._parse_limits('k', '2', 4, 1.5))
+        self.assertEqual((4, 0.5), throttle._parse_limits('k', '/0.5', 4, 0))
+        self.assertEqual((4, 0), throttle._parse_limits('k', '', 4, 0))
+
+    def test_parse_invalid_limits(self):
+        for value in ('x/1', '1/y', '0/1', '1/-1', '-2'):
+            self.assertRaises(exception.InvalidInput,
+                              throttle._parse_limits, 'k', value, 4, 0)
+
+
+class FakeDriver(object):
+
+    name = 'fake'
+
+    def __init__(self, limiter):
+        self.limiter = limiter
+        self.calls = []
+
+    def list_pools(self, context, detail=False):
+        # The limiter is held while the driver runs.
+        self.calls.append((context, detail,
+                           self.limiter._semaphore.acquire(False)))
+        return ['pool']
+
+
+class ThrottledDriverTestCase(test.TestCase):
+
+    def test_calls_passed_through(self):
+        limiter = throttle.Limiter(1, 0)
+        driver = FakeDriver(limiter)
+        throttled = throttle.ThrottledDriver(driver, limiter)
+        self.assertEqual(['pool'], throttled.list_pools('ctxt', detail=True))
+        self.assertEqual([('ctxt', True, False)], driver.calls)
+        self.assertEqual('list_pools', throttled.list_pools.__name__)
+        self.assertEqual('fake', throttled.name)
+        self.assertTrue(limiter._semaphore.acquire(False))
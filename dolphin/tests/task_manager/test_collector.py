@@ -0,0 +1,402 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+import collections
+import time
+
+import eventlet
+from eventlet import event
+from oslo_utils import timeutils
+
+from dolphin import coordination
+from dolphin import db
+from dolphin import exception
+from dolphin.db.sqlalchemy import api as sqlalchemy_api
+from dolphin.db.sqlalchemy import models
+from dolphin import test
+from dolphin.task_manager import collector
+from dolphin.tests import fakes
+
+
+class StorageIdsTestCase(test.DBTestCase):
+
+    def test_skips_deleted_storages(self):
+        for storage_id in ('s1', 's2', 's3'):
+            db.storage_bulk_upsert(self.context, [{'id': storage_id}])
+            db.registry_context_create(
+                self.context, fakes.FakeRegisterInfo(storage_id))
+        db.storage_delete(self.context, 's2')
+        # Soft deleted before its registry context was removed with it.
+        with db.transaction(self.context):
+            self.context.session.query(models.Storage) \
+                .filter(models.Storage.id == 's3') \
+                .update({'deleted': 1})
+        self.assertIsNotNone(sqlalchemy_api.registry_context_get(
+            self.context, 's3'))
+        self.assertEqual(['s1'], list(
+            collector.Collector()._storage_ids(self.context)))
+
+
+class ScheduleTestCase(test.TestCase):
+
+    def setUp(self):
+        super(ScheduleTestCase, self).setUp()
+        self.flags(pool_collection_interval=100,
+                   collection_adaptive_max_factor=4.0,
+                   collection_adaptive_min_factor=0.25,
+                   collection_volatile_ratio=0.1)
+        self.schedule = collector.Schedule('pool')
+
+    def _intervals(self, *change_ratios):
+        intervals = []
+        for change_ratio in change_ratios:
+            self.schedule.collected(change_ratio, 1000)
+            intervals.append(self.schedule.interval)
+            self.assertEqual(1000 + self.schedule.interval,
+                             self.schedule.due)
+        return intervals
+
+    def test_due_right_away(self):
+        self.assertEqual(0, self.schedule.due)
+        self.assertEqual(100, self.schedule.interval)
+
+    def test_backs_off_when_unchanged(self):
+        self.assertEqual([200, 400, 400], self._intervals(0.0, 0.0, 0.0))
+
+    def test_backs_off_on_failure(self):
+        self.assertEqual([200, 400, 400], self._intervals(None, None, None))
+
+    def test_reset_on_change(self):
+        self.assertEqual([200, 400, 100, 100],
+                         self._intervals(0.0, None, 0.05, 0.05))
+
+    def test_shortened_when_volatile(self):
+        self.assertEqual([50, 25, 25, 25],
+                         self._intervals(0.5, 0.1, 1.0, 0.05))
+
+    def test_volatile_after_back_off(self):
+        self.assertEqual([400, 50], self._intervals(0.0, 0.0, 0.5)[1:])
+
+    def test_not_adaptive(self):
+        self._intervals(0.0, 0.0)
+        self.flags(collection_adaptive=False)
+        self.assertEqual([100, 100], self._intervals(0.0, 1.0))
+
+
+class FakePartitioner(object):
+    ring = collections.namedtuple('Ring', 'nodes')(['node1'])
+
+
+class RunCycleTestCase(test.DBTestCase):
+
+    def setUp(self):
+        super(RunCycleTestCase, self).setUp()
+        self.collector = collector.Collector()
+        self.collector._partitioner = FakePartitioner()
+        self.stub(collector.Collector, 'node_id', 'node1')
+        self.stub(self.collector, '_ownership',
+                  lambda: lambda storage_id: True)
+        # The jobs are left queued.
+        self.stub(self.collector, '_work_off',
+                  lambda context, start: collections.Counter())
+        for storage_id in ('s1', 's2'):
+            db.storage_bulk_upsert(self.context, [{'id': storage_id}])
+            db.registry_context_create(
+                self.context, fakes.FakeRegisterInfo(storage_id))
+
+    def test_queues_due_jobs(self):
+        self.assertEqual(6, self.collector.run_cycle(self.context)['queued'])
+        # Not due again before their interval passed.
+        self.assertEqual(0, self.collector.run_cycle(self.context)['queued'])
+
+    def test_backpressure(self):
+        self.flags(collection_queue_max_depth=4)
+        db.collection_job_enqueue(self.context, [('s0', 'pool')], 'node1')
+        result = self.collector.run_cycle(self.context)
+        self.assertEqual((1, 3), (result['queue_depth'], result['queued']))
+        self.assertEqual(4, db.collection_job_stats(self.context,
+                                                    'node1')['depth'])
+        # The jobs left out are still due, queued once there is room.
+        schedules = self.collector._schedules
+        left_out = [(storage_id, resource_type)
+                    for storage_id in ('s1', 's2')
+                    for resource_type in collector.RESOURCE_TYPES
+                    if schedules[storage_id][resource_type].due == 0]
+        self.assertEqual(3, len(left_out))
+        self.assertEqual(0, self.collector.run_cycle(self.context)['queued'])
+        with db.transaction(self.context):
+            self.context.session.query(sqlalchemy_api.CollectionJob) \
+                .delete()
+        self.assertEqual(3, self.collector.run_cycle(self.context)['queued'])
+
+    def _wait_for(self, collected, count):
+        with eventlet.Timeout(5):
+            while len(collected) < count:
+                eventlet.sleep(0.01)
+
+    def test_slow_storage_does_not_hold_others(self):
+        self.flags(collection_work_stealing=False)
+        db.storage_bulk_upsert(self.context, [{'id': 'slow'}])
+        db.registry_context_create(self.context,
+                                   fakes.FakeRegisterInfo('slow'))
+        release = event.Event()
+        collected = []
+
+        def collect(context, storage_id, resource_type):
+            if storage_id == 'slow':
+                release.wait()
+            collected.append((storage_id, resource_type))
+            return 0.0
+
+        self.stub(self.collector, 'collect', collect)
+        # Run the jobs this time.
+        del self.collector._work_off
+        with eventlet.Timeout(5):
+            self.assertEqual(9, self.collector.run_cycle(
+                self.context)['jobs'])
+        self._wait_for(collected, 6)
+        self.assertNotIn('slow', [storage_id for storage_id, _type
+                                  in collected])
+
+        # The others are due again while the slow array still hangs.
+        for storage_id in ('s1', 's2'):
+            for schedule in self.collector._schedules[storage_id].values():
+                self.assertTrue(schedule.due > 0)
+                schedule.due = 0
+        with eventlet.Timeout(5):
+            result = self.collector.run_cycle(self.context)
+        self.assertEqual((6, 6, 6), (result['queued'], result['jobs'],
+                                     result['succeeded']))
+        self._wait_for(collected, 12)
+
+        release.send()
+        self._wait_for(collected, 15)
+        self.collector.pool.waitall()
+        self.assertEqual(9, self.collector.run_cycle(
+            self.context)['succeeded'])
+
+
+class EnqueueTestCase(test.DBTestCase):
+
+    def setUp(self):
+        super(EnqueueTestCase, self).setUp()
+        self.collector = collector.Collector()
+        self.stub(collector.Collector, 'node_id', 'node1')
+        self.cycles = []
+        self.stub(self.collector, 'start_cycle', self.cycles.append)
+
+    def test_queued_on_this_node(self):
+        db.collection_job_enqueue(self.context, [('s1', 'pool')], 'node2')
+        self.assertEqual(1, self.collector.enqueue(
+            self.context, [['s1', 'pool'], ['s1', 'volume']]))
+        self.assertEqual(2, db.collection_job_stats(self.context,
+                                                    'node1')['depth'])
+        self.assertEqual([self.context], self.cycles)
+
+    def test_invalid_resource_type(self):
+        self.assertRaises(exception.InvalidInput, self.collector.enqueue,
+                          self.context, [('s1', 'disk')])
+        self.assertEqual(0, db.collection_job_stats(self.context)['depth'])
+
+
+class RefreshTestCase(test.DBTestCase):
+
+    def setUp(self):
+        super(RefreshTestCase, self).setUp()
+        self.collector = collector.Collector()
+        self.stub(collector.Collector, 'node_id', 'node1')
+        self.stub(collector, '_PEER_POLL_INTERVAL', 0.01)
+        self.release = event.Event()
+        self.collected = []
+
+        def collect(context, storage_id, resource_type):
+            self.collected.append((storage_id, resource_type))
+            self.release.wait()
+            return 0.5
+
+        self.stub(self.collector, 'collect', collect)
+
+    def _refresh(self, storage_id='s1', resource_type='pool'):
+        return eventlet.spawn(self.collector.refresh, self.context,
+                              storage_id, resource_type)
+
+    def test_concurrent_refreshes_coalesced(self):
+        threads = [self._refresh() for i in range(3)]
+        other = self._refresh(resource_type='volume')
+        eventlet.sleep(0.05)
+        self.release.send()
+        with eventlet.Timeout(5):
+            results = [thread.wait() for thread in threads]
+            other.wait()
+        self.assertEqual([('s1', 'pool'), ('s1', 'volume')],
+                         sorted(self.collected))
+        self.assertEqual([{'result': 'succeeded', 'change_ratio': 0.5,
+                           'node': 'node1'}] * 3, results)
+        self.assertEqual(2, self.collector.coalesced)
+        # The job is done, a later refresh polls the array again.
+        with eventlet.Timeout(5):
+            self._refresh().wait()
+        self.assertEqual(3, len(self.collected))
+
+    def test_failure_shared(self):
+        def collect(context, storage_id, resource_type):
+            self.collected.append((storage_id, resource_type))
+            self.release.wait()
+            raise ValueError()
+
+        self.stub(self.collector, 'collect', collect)
+        threads = [self._refresh() for i in range(2)]
+        eventlet.sleep(0.05)
+        self.release.send()
+        with eventlet.Timeout(5):
+            results = [thread.wait() for thread in threads]
+        self.assertEqual(['failed', 'failed'],
+                         [result['result'] for result in results])
+        self.assertEqual(1, len(self.collected))
+
+    def test_waits_for_peer(self):
+        job = db.collection_job_claim(self.context, 's1', 'pool', 'node2',
+                                      60)
+        thread = self._refresh()
+        eventlet.sleep(0.05)
+        self.assertFalse(thread.dead)
+        self.assertTrue(db.collection_job_complete(self.context, job.id,
+                                                   'node2'))
+        with eventlet.Timeout(5):
+            self.assertEqual({'result': None, 'change_ratio': None,
+                              'node': 'node2'}, thread.wait())
+        self.assertEqual([], self.collected)
+        self.assertEqual(1, self.collector.coalesced)
+
+    def test_runs_job_of_dead_peer(self):
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+        db.collection_job_claim(self.context, 's1', 'pool', 'node2', 60)
+        thread = self._refresh()
+        eventlet.sleep(0.05)
+        self.assertEqual([], self.collected)
+        timeutils.advance_time_seconds(61)
+        self.release.send()
+        with eventlet.Timeout(5):
+            self.assertEqual('node1', thread.wait()['node'])
+        self.assertEqual([('s1', 'pool')], self.collected)
+        self.assertEqual(0, db.collection_job_stats(self.context)['depth'])
+
+
+class FakeLock(object):
+
+    def __init__(self, held):
+        self.held = held
+
+    def acquire(self, blocking=True):
+        return not self.held
+
+    def release(self):
+        pass
+
+
+class FakeCoordinator(object):
+    """Coordinator whose locks of the nodes in held are taken elsewhere."""
+
+    def __init__(self):
+        self.held = set()
+
+    def get_lock(self, name):
+        return FakeLock(name in self.held)
+
+
+class StealTestCase(test.DBTestCase):
+
+    def setUp(self):
+        super(StealTestCase, self).setUp()
+        self.flags(collection_workers=1, collection_steal_after=60)
+        timeutils.set_time_override()
+        self.addCleanup(timeutils.clear_time_override)
+        self.coordinator = FakeCoordinator()
+        self.stub(coordination, 'LOCK_COORDINATOR', self.coordinator)
+        self.stub(collector.Collector, 'node_id', 'node1')
+        self.collector = collector.Collector()
+        self.collected = []
+
+        def collect(context, storage_id, resource_type):
+            self.collected.append(storage_id)
+            return 0.0
+
+        self.stub(self.collector, 'collect', collect)
+
+    def _work_off(self):
+        with eventlet.Timeout(5):
+            started = self.collector._work_off(self.context, time.time())
+            self.collector.pool.waitall()
+        return started
+
+    def test_own_jobs_first(self):
+        db.collection_job_enqueue(self.context,
+                                  [('s2', 'pool'), ('s3', 'pool')], 'node2')
+        timeutils.advance_time_seconds(120)
+        db.collection_job_enqueue(self.context, [('s1', 'pool')], 'node1')
+        self.assertEqual(3, self._work_off())
+        self.assertEqual(2, self.collector._stolen)
+        self.assertEqual('s1', self.collected[0])
+        self.assertEqual(['s2', 's3'], sorted(self.collected[1:]))
+        self.assertEqual(0, db.collection_job_stats(self.context)['depth'])
+
+    def test_expired_lease_stolen(self):
+        db.collection_job_enqueue(self.context, [('s2', 'pool')], 'node2')
+        timeutils.advance_time_seconds(120)
+        job, = db.collection_job_lease(self.context, 'node2', 1, 60)
+        timeutils.advance_time_seconds(30)
+        # Overdue, but still leased by its node.
+        self.assertEqual(0, self._work_off())
+        timeutils.advance_time_seconds(31)
+        self.assertEqual(1, self._work_off())
+        self.assertEqual((['s2'], 1), (self.collected,
+                                       self.collector._stolen))
+        # The node whose lease expired can not complete it any more.
+        self.assertFalse(db.collection_job_complete(self.context, job.id,
+                                                    'node2'))
+
+    def test_recent_jobs_left(self):
+        db.collection_job_enqueue(self.context, [('s2', 'pool')], 'node2')
+        timeutils.advance_time_seconds(30)
+        self.assertEqual(0, self._work_off())
+        self.assertEqual(0, self.collector._stolen)
+        self.assertEqual(1, db.collection_job_stats(self.context,
+                                                    'node2')['depth'])
+
+    def test_contended_node_skipped(self):
+        self.flags(collection_workers=4)
+        self.collector = collector.Collector()
+        self.stub(self.collector, 'collect',
+                  lambda context, storage_id, resource_type:
+                  self.collected.append(storage_id))
+        db.collection_job_enqueue(self.context, [('s2', 'pool')], 'node2')
+        db.collection_job_enqueue(self.context,
+                                  [('s3', 'pool'), ('s4', 'pool')], 'node3')
+        timeutils.advance_time_seconds(120)
+        self.coordinator.held.add('collection-steal-node3')
+        self.stub(collector, '_WORKER_POLL_INTERVAL', 0.01)
+
+        def release_node3():
+            eventlet.sleep(0.05)
+            self.coordinator.held.clear()
+
+        eventlet.spawn_n(release_node3)
+        self.assertEqual(3, self._work_off())
+        self.assertEqual(['s2', 's3', 's4'], sorted(self.collected))
+
+    def test_stealing_disabled(self):
+        self.flags(collection_work_stealing=False)
+        db.collection_job_enqueue(self.context, [('s2', 'pool')], 'node2')
+        timeutils.advance_time_seconds(120)
+        self.assertEqual(0, self._work_off())
+        self.assertEqual([], self.collected)
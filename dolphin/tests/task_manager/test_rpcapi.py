@@ -0,0 +1,69 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from dolphin import context
+from dolphin import test
+from dolphin.task_manager import rpcapi
+
+
+class FakeClient(object):
+    """Records the messages sent instead of sending them."""
+
+    def __init__(self):
+        self.sent = []
+
+    def prepare(self, **kwargs):
+        client = self
+
+        class Prepared(object):
+            def cast(self, ctxt, method, **args):
+                client.sent.append(('cast', method, kwargs, args))
+
+            def call(self, ctxt, method, **args):
+                client.sent.append(('call', method, kwargs, args))
+        return Prepared()
+
+
+class TaskAPITestCase(test.TestCase):
+
+    def setUp(self):
+        super(TaskAPITestCase, self).setUp()
+        self.context = context.get_admin_context()
+        self.api = rpcapi.TaskAPI.__new__(rpcapi.TaskAPI)
+        self.api.client = FakeClient()
+
+    def test_refresh_storage_timeout_covers_all_types(self):
+        self.flags(collection_job_lease_time=600, collection_timeout=240)
+        self.api.refresh_storage(self.context, 's1')
+        kind, method, options, args = self.api.client.sent[0]
+        self.assertEqual(('call', 'refresh_storage'), (kind, method))
+        self.assertEqual(3 * 840, options['timeout'])
+        self.assertEqual(['storage', 'pool', 'volume'],
+                         args['resource_types'])
+
+    def test_refresh_storage_timeout_of_one_type(self):
+        self.flags(collection_job_lease_time=600, collection_timeout=240)
+        self.api.refresh_storage(self.context, 's1', ['volume'])
+        self.assertEqual(840, self.api.client.sent[0][2]['timeout'])
+
+    def test_collect_storages_batched(self):
+        self.flags(task_rpc_batch_size=2)
+        jobs = [('s%d' % i, 'volume') for i in range(5)]
+        self.assertEqual(3, self.api.collect_storages(self.context, jobs))
+        self.assertEqual([[['s0', 'volume'], ['s1', 'volume']],
+                          [['s2', 'volume'], ['s3', 'volume']],
+                          [['s4', 'volume']]],
+                         [args['jobs'] for kind, method, options, args
+                          in self.api.client.sent])
+        self.assertEqual(set([('cast', 'collect_storages')]),
+                         set((kind, method) for kind, method, options, args
+                             in self.api.client.sent))
@@ -0,0 +1,50 @@
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+from dolphin import test
+from dolphin import utils
+
+
+class LRUCacheTestCase(test.TestCase):
+
+    def test_evicts_least_recently_used(self):
+        cache = utils.LRUCache(2, 60)
+        cache.set('a', 1)
+        cache.set('b', 2)
+        cache.get('a')
+        cache.set('c', 3)
+        self.assertEqual(1, cache.get('a'))
+        self.assertIsNone(cache.get('b'))
+        self.assertEqual(1, cache.stats()['evictions'])
+
+    def test_set_with_current_version(self):
+        cache = utils.LRUCache(2, 60)
+        version = cache.version('a')
+        cache.set('a', 1, version)
+        self.assertEqual(1, cache.get('a'))
+
+    def test_set_after_invalidate_is_dropped(self):
+        cache = utils.LRUCache(2, 60)
+        version = cache.version('a')
+        cache.invalidate('a')
+        cache.set('a', 'stale', version)
+        self.assertIsNone(cache.get('a'))
+        cache.set('a', 'fresh', cache.version('a'))
+        self.assertEqual('fresh', cache.get('a'))
+
+    def test_set_after_versions_reset_is_dropped(self):
+        cache = utils.LRUCache(2, 60)
+        version = cache.version('a')
+        for key in ('b', 'c', 'd'):
+            cache.invalidate(key)
+        cache.set('a', 'stale', version)
+        self.assertIsNone(cache.get('a'))
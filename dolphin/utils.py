@@ -17,6 +17,7 @@
 
 """Utilities and helper functions."""
 
+import collections
 import contextlib
 import functools
 import inspect
@@ -27,6 +28,7 @@ import re
 import shutil
 import sys
 import tempfile
+import threading
 import time
 
 from eventlet import pools
@@ -438,6 +440,80 @@ class ComparableMixin(object):
         return self._compare(other, lambda s, o: s != o)
 
 
+class LRUCache(object):
+    """A bounded least recently used cache whose entries expire.
+
+    Once maxsize entries are stored, adding one more evicts the least
+    recently used entry. Entries older than ttl seconds are treated as
+    absent, a ttl of 0 disables the cache altogether. The critical sections
+    never yield, so the cache is safe to share between green threads.
+
+    Each key has a version, bumped by :meth:`invalidate`. A loader reads it
+    with :meth:`version` before loading a value and passes it to
+    :meth:`set`, which drops the value if the key was invalidated since,
+    as the value may have been read before the change.
+    """
+
+    def __init__(self, maxsize, ttl):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = collections.OrderedDict()
+        self._versions = {}
+        # Bumped when the versions are reset, which happens once they
+        # grow past maxsize, so that no earlier version matches again.
+        self._generation = 0
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is None or entry[0] < time.time():
+                self.misses += 1
+                return default
+            # Re-insert to mark the entry as the most recently used one.
+            self._entries[key] = entry
+            self.hits += 1
+            return entry[1]
+
+    def version(self, key):
+        with self._lock:
+            return self._generation, self._versions.get(key, 0)
+
+    def set(self, key, value, version=None):
+        if self.ttl <= 0 or self.maxsize <= 0:
+            return
+        with self._lock:
+            if version is not None and version != (
+                    self._generation, self._versions.get(key, 0)):
+                return
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + self.ttl, value)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+            if len(self._versions) >= max(self.maxsize, 1):
+                self._versions.clear()
+                self._generation += 1
+            self._versions[key] = self._versions.get(key, 0) + 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        return {'size': len(self._entries),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions}
+
+
 def retry(exception, interval=1, retries=10, backoff_rate=2,
           wait_random=False, backoff_sleep_max=None):
     """A wrapper around retrying library.
@@ -25,4 +25,9 @@ setup(
     maintanier="sfzeng",
     packages=find_packages(exclude=("tests", "tests.*")),
     python_requires=">=2.7, !=3.0.*, !=3.1.*, !=3.2.*, !=3.3.*",
+    entry_points={
+        'console_scripts': [
+            'dolphin-manage = dolphin.cmd.manage:main',
+        ],
+    },
 )
@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+
+#    Licensed under the Apache License, Version 2.0 (the "License"); you may
+#    not use this file except in compliance with the License. You may obtain
+#    a copy of the License at
+#
+#         http://www.apache.org/licenses/LICENSE-2.0
+#
+#    Unless required by applicable law or agreed to in writing, software
+#    distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+#    WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+#    License for the specific language governing permissions and limitations
+#    under the License.
+
+"""Benchmarks of the database API.
+
+  db_bench.py [--connection URL] upsert [--rows N]
+      Per-row volume_create against volume_bulk_upsert inserts and
+      updates.
+  db_bench.py [--connection URL] listing [--sizes N,N,...]
+                                         [--per-storage N]
+      Listing the volumes of one storage as the volumes table grows,
+      with the indexes and, on SQLite, with a full table scan.
+  db_bench.py [--connection URL] capacity [--rows N]
+      Capacity aggregation over Decimal values against capacity_arrays.
+  db_bench.py [--connection URL] startup [--repeat N]
+      Import time of the db backend and the time register_db takes.
+
+Without --connection a temporary SQLite file is used, otherwise the
+database has to be an empty one which the benchmark may fill.
+"""
+
+from __future__ import print_function
+
+import argparse
+import decimal
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+
+from oslo_config import cfg
+import sqlalchemy
+from sqlalchemy import sql
+
+from dolphin.common import capacity
+from dolphin.common import config  # noqa
+from dolphin import context as dolphin_context
+from dolphin import db
+from dolphin.db.sqlalchemy import api as sqlalchemy_api
+from dolphin.db.sqlalchemy import models
+
+CONF = cfg.CONF
+
+# Volumes inserted per statement when filling the tables.
+_FILL_CHUNK = 10000
+
+
+def _volume(storage_id, i, **values):
+    total = random.randint(1, 1 << 40)
+    used = random.randint(0, total)
+    return dict(values, storage_id=storage_id, name='volume-%d' % i,
+                pool_id='pool-%d' % (i % 10), status='normal',
+                total_capacity=total, used_capacity=used,
+                free_capacity=total - used, deleted=0)
+
+
+def _fill(storage_ids, per_storage):
+    """Insert per_storage volumes into each storage, bypassing the API."""
+    table = models.Volume.__table__
+    engine = sqlalchemy_api.get_engine()
+    rows = []
+    for storage_id in storage_ids:
+        rows.extend(_volume(storage_id, i) for i in range(per_storage))
+        if len(rows) >= _FILL_CHUNK:
+            engine.execute(table.insert(), rows)
+            rows = []
+    if rows:
+        engine.execute(table.insert(), rows)
+
+
+def _timed(func, *args, **kwargs):
+    start = time.time()
+    func(*args, **kwargs)
+    return time.time() - start
+
+
+def _median(func, repeat):
+    return sorted(_timed(func) for i in range(repeat))[repeat // 2]
+
+
+def bench_upsert(context, args):
+    rows = args.rows
+    elapsed = _timed(lambda: [
+        db.volume_create(context, _volume('per-row', i), 'per-row')
+        for i in range(rows)])
+    print("per-row create: %d rows/s" % (rows / elapsed))
+
+    volumes = [_volume('bulk', i) for i in range(rows)]
+    elapsed = _timed(db.volume_bulk_upsert, context, volumes, 'bulk')
+    print("bulk insert:    %d rows/s" % (rows / elapsed))
+
+    for volume in volumes:
+        volume['status'] = 'offline'
+    elapsed = _timed(db.volume_bulk_upsert, context, volumes, 'bulk')
+    print("bulk update:    %d rows/s" % (rows / elapsed))
+
+
+def bench_listing(context, args):
+    per_storage = args.per_storage
+    engine = sqlalchemy_api.get_engine()
+    sqlite = engine.dialect.name == 'sqlite'
+    # Full table scan of the query volume_get_all issues, for comparison.
+    scan = sql.text("SELECT * FROM volumes NOT INDEXED "
+                    "WHERE storage_id = :storage_id AND deleted = 0")
+    storages = 0
+    for size in [int(size) for size in args.sizes.split(',')]:
+        count = size // per_storage
+        _fill(['storage-%d' % i for i in range(storages, count)],
+              per_storage)
+        storages = max(storages, count)
+        storage_id = 'storage-%d' % random.randrange(storages)
+
+        def listing():
+            db.volume_get_all(context, storage_id)
+
+        line = "%9d rows: %.2fms" % (
+            storages * per_storage, _median(listing, args.repeat) * 1000)
+        if sqlite:
+            def full_scan():
+                engine.execute(scan, storage_id=storage_id).fetchall()
+            line += ", full scan %.2fms" % (_median(full_scan, 3) * 1000)
+        print(line)
+
+    if sqlite:
+        plan = engine.execute(
+            "EXPLAIN QUERY PLAN SELECT * FROM volumes "
+            "WHERE storage_id = 'storage-0' AND deleted = 0 "
+            "ORDER BY id").fetchall()
+        print("query plan: %s" % "; ".join(row[-1] for row in plan))
+
+
+def bench_capacity(context, args):
+    _fill(['capacity'], args.rows)
+    volume = models.Volume
+
+    def decimal_path():
+        columns = [sqlalchemy.type_coerce(getattr(volume, column),
+                                          sqlalchemy.Numeric())
+                   for column in ('total_capacity', 'used_capacity')]
+        rows = context.session.query(*columns) \
+            .filter(volume.storage_id == 'capacity').all()
+        total = sum((row[0] for row in rows), decimal.Decimal(0))
+        used = sorted(row[1] for row in rows)
+        p95 = used[int((len(used) - 1) * 0.95)]
+        full = sum(1 for row in rows if row[1] > row[0] * decimal.Decimal(
+            '0.9'))
+        return total, p95, full
+
+    def array_path():
+        arrays = db.capacity_arrays(context, 'volume', 'capacity',
+                                    columns=('total_capacity',
+                                             'used_capacity'))
+        used = arrays['used_capacity']
+        total = arrays['total_capacity']
+        return (capacity.total(total), capacity.percentile(used, 95),
+                len(capacity.over_threshold(used, total, 0.9)))
+
+    with db.transaction(context, read_only=True):
+        print("Decimal rows:    %.2fs" % _timed(decimal_path))
+        print("capacity_arrays: %.2fs" % _timed(array_path))
+    print("numpy: %s" % ('yes' if capacity.numpy is not None else 'no'))
+
+
+def bench_startup(context, args):
+    code = ("import time; start = time.time(); "
+            "import dolphin.db.sqlalchemy.api; "
+            "print(time.time() - start)")
+    elapsed = float(subprocess.check_output([sys.executable, '-c', code]))
+    print("import of the db backend: %.0fms" % (elapsed * 1000))
+    print("register_db, schema created: %.1fms" %
+          (_timed(db.register_db) * 1000))
+    elapsed = sum(_timed(db.register_db) for i in range(args.repeat))
+    print("register_db, schema at head: %.1fms (mean of %d)" %
+          (elapsed / args.repeat * 1000, args.repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--connection',
+                        help='SQLAlchemy URL of an empty database.')
+    subparsers = parser.add_subparsers(dest='benchmark')
+    upsert = subparsers.add_parser('upsert')
+    upsert.add_argument('--rows', type=int, default=20000)
+    upsert.set_defaults(func=bench_upsert)
+    listing = subparsers.add_parser('listing')
+    listing.add_argument('--sizes', default='100000,500000,1000000')
+    listing.add_argument('--per-storage', type=int, default=100)
+    listing.add_argument('--repeat', type=int, default=20)
+    listing.set_defaults(func=bench_listing)
+    capacity_parser = subparsers.add_parser('capacity')
+    capacity_parser.add_argument('--rows', type=int, default=300000)
+    capacity_parser.set_defaults(func=bench_capacity)
+    startup = subparsers.add_parser('startup')
+    startup.add_argument('--repeat', type=int, default=20)
+    startup.set_defaults(func=bench_startup)
+    args = parser.parse_args()
+    if not getattr(args, 'func', None):
+        parser.error('a benchmark is required')
+
+    CONF([], project='dolphin', default_config_files=[])
+    path = None
+    connection = args.connection
+    if connection is None:
+        fd, path = tempfile.mkstemp(prefix='dolphin-bench-',
+                                    suffix='.sqlite')
+        os.close(fd)
+        connection = 'sqlite:///' + path
+    CONF.set_override('connection', connection, group='database')
+    try:
+        if args.func is not bench_startup:
+            db.register_db()
+        args.func(dolphin_context.get_admin_context(), args)
+    finally:
+        if path is not None:
+            os.remove(path)
+
+
+if __name__ == '__main__':
+    main()